@@ -1,5 +1,10 @@
-from .acmdb import ACMDatabase
+from .acmdb import ACMDatabase, PoolTimeout
 from .manager import Manager
+from .async_manager import AsyncManager
 from .data import Settings
+from .maintenance import MaintenancePolicy
+from .scheduler import ServiceScheduler
+from .storage import MemoryStorage, SQLiteStorage, Storage
 
-__all__ = ['Manager', 'ACMDatabase', 'Settings']
+__all__ = ['Manager', 'AsyncManager', 'ACMDatabase', 'Settings', 'MaintenancePolicy', 'ServiceScheduler', 'Storage',
+           'SQLiteStorage', 'MemoryStorage', 'PoolTimeout']
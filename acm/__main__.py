@@ -0,0 +1,171 @@
+"""
+数据库维护命令。
+
+    python -m acm stays verify   校验每次入住的累计费用
+    python -m acm stays repair   从原始使用记录重建累计费用
+    python -m acm rollups verify 校验使用记录汇总表
+    python -m acm rollups repair 从原始使用记录重建汇总表
+    python -m acm rooms provision FILE  按 CSV/JSON 房间定义批量创建房间，已存在的跳过
+    python -m acm events verify  重放事件日志并与使用记录比较
+    python -m acm events rebuild 按当前计价规则重放事件日志，重建使用记录、累计费用和汇总表
+    python -m acm maintenance run    合并并归档超过保留期限的已退房入住的使用记录，回收空间
+    python -m acm maintenance vacuum 整库 VACUUM 一次，旧数据库之后才能增量回收空间
+    python -m acm users role NAME ROLE  修改用户的角色，2 为前台等工作人员，1 为客人
+"""
+import argparse
+import sys
+import time
+
+from .acmdb import ACMDatabase
+from .clock import SystemClock
+from .events import rebuild_from_events, verify_replay
+from .maintenance import MaintenancePolicy, run_maintenance
+from .migrations import migrate
+from .provisioning import load_room_specs, provision_rooms
+from .sessions import GUEST, STAFF
+from .rollups import rebuild_rollups, verify_rollups
+from .stays import rebuild_stay_totals, verify_stay_totals
+from .storage import SQLiteStorage
+
+
+def stays_verify(db, args):
+    with db.cursor() as c:
+        mismatched = verify_stay_totals(c)
+    for user_id, in_time, cost, expected_cost, segments, expected_segments in mismatched:
+        print(f"user {user_id} in_time {in_time}: cost {cost} != {expected_cost}, "
+              f"segments {segments} != {expected_segments}")
+    print(f"{len(mismatched)} stay total(s) out of date")
+    return 1 if mismatched else 0
+
+
+def stays_repair(db, args):
+    with db.transaction() as c:
+        count = rebuild_stay_totals(c)
+    print(f"rebuilt {count} stay total(s)")
+    return 0
+
+
+def rollups_verify(db, args):
+    with db.cursor() as c:
+        mismatched = verify_rollups(c)
+    for room_id, day, mode, fan_speed in mismatched:
+        print(f"room {room_id} day {day} {mode}/{fan_speed} out of date")
+    print(f"{len(mismatched)} rollup row(s) out of date")
+    return 1 if mismatched else 0
+
+
+def rollups_repair(db, args):
+    with db.transaction() as c:
+        count = rebuild_rollups(c)
+    print(f"rolled up {count} usage record(s)")
+    return 0
+
+
+def rooms_provision(db, args):
+    specs = load_room_specs(args.file, args.rooms_per_floor)
+    with db.transaction() as c:
+        inserted = provision_rooms(c, specs)
+    # 正在运行的服务需要重启才能看到新房间
+    print(f"created {len(inserted)} of {len(specs)} room(s)")
+    return 0
+
+
+def events_verify(db, args):
+    mismatched = verify_replay(SQLiteStorage(db), args.chunk_size)
+    for index, replayed, recorded in mismatched[:args.show]:
+        print(f"#{index}: replayed {replayed} != recorded {recorded}")
+    print(f"{len(mismatched)} usage record(s) differ from the event log")
+    return 1 if mismatched else 0
+
+
+def events_rebuild(db, args):
+    start = time.perf_counter()
+    storage = SQLiteStorage(db)
+    with storage.transaction():
+        count = rebuild_from_events(storage, args.chunk_size)
+    # 正在运行的服务不缓存使用记录和累计费用，不需要重启
+    print(f"replayed {count} usage record(s) in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+def maintenance_run(db, args):
+    policy = MaintenancePolicy(retention_days=args.retention_days, batch_stays=args.batch, pause_ms=args.pause_ms,
+                               vacuum_pages=args.vacuum_pages)
+    stats = run_maintenance(SQLiteStorage(db), policy, SystemClock().now_ms())
+    print(f"archived {stats['stays']} stay(s): {stats['moved']} usage record(s) -> {stats['archived']}, "
+          f"freed {stats['freed_pages']} page(s) in {stats['seconds']:.2f}s")
+    return 0
+
+
+def maintenance_vacuum(db, args):
+    # VACUUM 不能在事务中执行，期间其他连接无法写入
+    with db.connection() as conn:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    print(f"auto_vacuum = {mode}")
+    return 0
+
+
+def users_role(db, args):
+    updated = SQLiteStorage(db).set_user_role(args.name, args.role)
+    # 已签发的令牌中带有原来的角色，重新登录后才生效
+    print(f"updated {updated} user(s)")
+    return 0 if updated else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m acm")
+    parser.add_argument("--db", default="acm.db", help="数据库文件路径")
+    commands = parser.add_subparsers(dest="group", required=True)
+    stays = commands.add_parser("stays", help="每次入住的累计费用")
+    stays_commands = stays.add_subparsers(dest="command", required=True)
+    stays_commands.add_parser("verify").set_defaults(handler=stays_verify)
+    stays_commands.add_parser("repair").set_defaults(handler=stays_repair)
+    rollups = commands.add_parser("rollups", help="使用记录汇总表")
+    rollups_commands = rollups.add_subparsers(dest="command", required=True)
+    rollups_commands.add_parser("verify").set_defaults(handler=rollups_verify)
+    rollups_commands.add_parser("repair").set_defaults(handler=rollups_repair)
+    rooms = commands.add_parser("rooms", help="房间")
+    rooms_commands = rooms.add_subparsers(dest="command", required=True)
+    provision = rooms_commands.add_parser("provision")
+    provision.add_argument("file", help="CSV 或 JSON 房间定义文件")
+    provision.add_argument("--rooms-per-floor", type=int, default=100, help="未给出楼层时按此推算")
+    provision.set_defaults(handler=rooms_provision)
+    events = commands.add_parser("events", help="空调事件日志")
+    events_commands = events.add_subparsers(dest="command", required=True)
+    verify = events_commands.add_parser("verify")
+    verify.add_argument("--show", type=int, default=20, help="最多显示的不一致记录数")
+    verify.set_defaults(handler=events_verify)
+    rebuild = events_commands.add_parser("rebuild")
+    rebuild.set_defaults(handler=events_rebuild)
+    for command in (verify, rebuild):
+        command.add_argument("--chunk-size", type=int, default=100000, help="每次读取的事件数")
+    maintenance = commands.add_parser("maintenance", help="使用记录的归档和空间回收")
+    maintenance_commands = maintenance.add_subparsers(dest="command", required=True)
+    run = maintenance_commands.add_parser("run")
+    run.add_argument("--retention-days", type=float, default=30, help="退房超过这么多天的入住才归档")
+    run.add_argument("--batch", type=int, default=100, help="每个事务归档的入住数")
+    run.add_argument("--pause-ms", type=float, default=100, help="批之间的暂停时间")
+    run.add_argument("--vacuum-pages", type=int, default=1000, help="最多归还的空闲页数")
+    run.set_defaults(handler=maintenance_run)
+    maintenance_commands.add_parser("vacuum").set_defaults(handler=maintenance_vacuum)
+    users = commands.add_parser("users", help="用户")
+    users_commands = users.add_subparsers(dest="command", required=True)
+    role = users_commands.add_parser("role")
+    role.add_argument("name", help="用户名")
+    role.add_argument("role", type=int, choices=(GUEST, STAFF))
+    role.set_defaults(handler=users_role)
+    args = parser.parse_args(argv)
+
+    db = ACMDatabase(args.db)
+    with db.connection() as conn:
+        migrate(conn)
+    try:
+        return args.handler(db, args)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,259 @@
+import os
+import queue
 import sqlite3
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+from .metrics import SQL_LATENCY, statement_kind
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """按语句类型记录 SQL 的执行次数和耗时"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - start, statement_kind(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQL_LATENCY.observe(time.perf_counter() - start, statement_kind(sql))
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class PoolTimeout(Exception):
+    """连接已全部借出，等待归还超时"""
 
 
 class ACMDatabase:
-    def __init__(self, path = 'acm.db'):
+    """
+    sqlite 连接池。
+
+    每个线程同一时间只持有一个连接，嵌套使用时复用同一个连接；
+    写操作通过 transaction() 串行执行，读操作在 WAL 模式下可以与写并行。
+    """
+
+    def __init__(self, path = 'acm.db', pool_size = 8, busy_timeout = 5000, cache_size = -16000,
+                 synchronous = 'NORMAL', instrument = True, readonly = False, acquire_timeout = 30):
         self.path = path
+        # 为 True 时以只读方式打开，用于读取其他进程拥有的数据库，任何写操作都会失败
+        self.readonly = readonly
+        # 为 True 时记录每条 SQL 的耗时，见 metrics.SQL_LATENCY
+        self.instrument = instrument
+        self.pool_size = pool_size
+        # 连接全部借出时最多等待的秒数，超时抛出 PoolTimeout
+        self.acquire_timeout = acquire_timeout
+        self.busy_timeout = busy_timeout
+        # 负数表示以 KiB 为单位
+        self.cache_size = cache_size
+        self.synchronous = synchronous
+        self._pool = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
 
     def get_connection(self):
-        return sqlite3.connect(self.path, check_same_thread = False)
+        factory = InstrumentedConnection if self.instrument else sqlite3.Connection
+        if self.readonly:
+            uri = f"file:{urllib.request.pathname2url(os.path.abspath(self.path))}?mode=ro"
+            conn = sqlite3.connect(uri, check_same_thread = False, isolation_level = None, factory = factory,
+                                   uri = True)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread = False, isolation_level = None, factory = factory)
+        # PRAGMA 不支持参数绑定
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        if not self.readonly:
+            # 只读连接不能修改日志模式，由拥有数据库的进程设置
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.pool_size
+            if create:
+                self._created += 1
+        if not create:
+            # 连接已全部借出，等待归还
+            try:
+                return self._pool.get(timeout = self.acquire_timeout)
+            except queue.Empty:
+                raise PoolTimeout(f"no connection returned to the pool of {self.path} within "
+                                  f"{self.acquire_timeout}s ({self.pool_size} connections in use)") from None
+        try:
+            return self.get_connection()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # 同一线程内嵌套使用，复用已借出的连接
+            yield conn
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._pool.put(conn)
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn:
+            yield conn.cursor()
+
+    @contextmanager
+    def transaction(self):
+        """
+        写事务，正常退出时提交，异常时回滚。
+        在已有事务中嵌套使用时退化为 SAVEPOINT，只回滚内层的修改。
+        """
+        depth = getattr(self._local, 'depth', 0)
+        with self.connection() as conn:
+            c = conn.cursor()
+            if depth:
+                savepoint = f"sp_{depth}"
+                c.execute(f"SAVEPOINT {savepoint}")
+                self._local.depth = depth + 1
+                self._local.undo.append([])
+                try:
+                    yield c
+                except BaseException:
+                    c.execute(f"ROLLBACK TO {savepoint}")
+                    c.execute(f"RELEASE {savepoint}")
+                    self._run_undo(self._local.undo.pop())
+                    raise
+                else:
+                    c.execute(f"RELEASE {savepoint}")
+                    undo = self._local.undo.pop()
+                    self._local.undo[-1].extend(undo)
+                finally:
+                    self._local.depth = depth
+                return
+            with self._write_lock:
+                c.execute("BEGIN IMMEDIATE")
+                self._local.depth = 1
+                self._local.undo = [[]]
+                self._local.before_commit = []
+                self._local.after_commit = []
+                try:
+                    yield c
+                    self._run_before_commit()
+                    # 提交失败时同样回滚并撤销内存中的修改
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    self._run_undo(self._local.undo[0])
+                    raise
+                else:
+                    after_commit = self._local.after_commit
+                finally:
+                    self._local.depth = 0
+                    self._local.undo = None
+                    self._local.before_commit = None
+                    self._local.after_commit = None
+            # 提交并释放写锁之后执行
+            for callback in after_commit:
+                callback()
+
+    @property
+    def in_transaction(self):
+        """当前线程是否处于 transaction() 中"""
+        return getattr(self._local, 'depth', 0) > 0
+
+    def on_rollback(self, callback):
+        """
+        登记当前事务回滚时需要执行的操作，用于撤销内存中已经做出的修改。
+        不在事务中时直接忽略。
+        """
+        undo = getattr(self._local, 'undo', None)
+        if undo:
+            undo[-1].append(callback)
+
+    def before_commit(self, callback):
+        """
+        登记最外层事务提交前、仍在事务中执行的操作，同一个回调在一个事务中只登记一次。
+        不在事务中时直接忽略。
+        """
+        callbacks = getattr(self._local, 'before_commit', None)
+        if callbacks is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    def after_commit(self, callback):
+        """
+        登记最外层事务提交成功后执行的操作，同一个回调在一个事务中只登记一次，回滚时不执行。
+        不在事务中时直接忽略。
+        """
+        callbacks = getattr(self._local, 'after_commit', None)
+        if callbacks is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    def _run_before_commit(self):
+        # 回调中可能登记新的回调
+        callbacks = self._local.before_commit
+        i = 0
+        while i < len(callbacks):
+            callbacks[i]()
+            i += 1
+
+    @staticmethod
+    def _run_undo(callbacks):
+        for callback in reversed(callbacks):
+            callback()
+
+    def total_changes(self):
+        """池中空闲的连接打开以来插入、修改和删除的行数之和，用于测量写入量"""
+        return sum(conn.total_changes for conn in list(self._pool.queue))
+
+    def close(self):
+        while True:
+            try:
+                conn = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if not self.readonly:
+                self._optimize(conn)
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    @staticmethod
+    def _optimize(conn):
+        # SQLite 建议关闭连接前执行：只分析这个连接的查询用到的、统计信息缺失或过时的表，采样行数有上限
+        try:
+            conn.execute("PRAGMA analysis_limit = 1000")
+            conn.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            # 其他连接正在写或者数据库只读，下次关闭时再更新
+            pass
@@ -0,0 +1,116 @@
+import heapq
+import threading
+from collections import deque
+
+
+class FreeRoomAllocator:
+    """
+    空闲房间分配器，启动时由 RoomStore 重建。
+
+    分配策略：
+    lowest  房间号最小的优先
+    floor   优先分配指定楼层，该楼层没有空房时退化为 lowest，
+            楼层取 rooms 表的 floor 列，没有时按每层 rooms_per_floor 间推算
+    lru     最久没有被使用的房间优先
+
+    分配器只是加速查找，真正的占用以 rooms 表上带 busy = 0 条件的 UPDATE 为准。
+    各个结构都采用惰性删除，_free 集合中的房间才是真正空闲的。
+    """
+
+    POLICIES = ('lowest', 'floor', 'lru')
+
+    def __init__(self, policy='lowest', rooms_per_floor=100):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown allocation policy: {policy}")
+        self.policy = policy
+        self.rooms_per_floor = rooms_per_floor
+        self._free = set()
+        self._heap = []
+        self._floors = {}
+        # 房间号 -> 楼层，只记录 rooms 表中给出了楼层的房间
+        self._room_floors = {}
+        # (序号, 房间号)，序号与 _stamps 中不一致的是过期条目
+        self._lru = deque()
+        self._stamps = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def floor_of(self, room_id):
+        floor = self._room_floors.get(room_id)
+        if floor is None:
+            return (room_id - 1) // self.rooms_per_floor + 1
+        return floor
+
+    def rebuild(self, rooms):
+        with self._lock:
+            self._room_floors = {room.id: room.floor for room in rooms if room.floor is not None}
+            self._free = {room.id for room in rooms if not room.busy}
+            self._heap = sorted(self._free)
+            self._floors = {}
+            for room_id in self._heap:
+                self._floors.setdefault(self.floor_of(room_id), []).append(room_id)
+            self._lru = deque()
+            self._stamps = {}
+            for room_id in self._heap:
+                self._touch(room_id)
+
+    def pop(self, floor=None):
+        """取出一个空闲房间，没有空房时返回 None"""
+        with self._lock:
+            if self.policy == 'lru':
+                while self._lru:
+                    stamp, room_id = self._lru.popleft()
+                    if room_id in self._free and self._stamps.get(room_id) == stamp:
+                        self._free.discard(room_id)
+                        return room_id
+                return None
+            if self.policy == 'floor' and floor is not None:
+                heap = self._floors.get(floor)
+                if heap:
+                    room_id = self._pop_from(lambda: heapq.heappop(heap), heap)
+                    if room_id is not None:
+                        return room_id
+            return self._pop_from(lambda: heapq.heappop(self._heap), self._heap)
+
+    def push(self, room_id, floor=None):
+        """房间重新变为空闲，新增的房间可以同时给出楼层"""
+        with self._lock:
+            if floor is not None:
+                self._room_floors[room_id] = floor
+            if room_id in self._free:
+                return
+            self._free.add(room_id)
+            heapq.heappush(self._heap, room_id)
+            heapq.heappush(self._floors.setdefault(self.floor_of(room_id), []), room_id)
+            self._touch(room_id)
+            # 过期条目太多时压缩，避免惰性删除让结构无限增长
+            if len(self._heap) > 2 * len(self._free) + 64:
+                self._compact()
+
+    def discard(self, room_id):
+        with self._lock:
+            self._free.discard(room_id)
+
+    def __len__(self):
+        return len(self._free)
+
+    def _touch(self, room_id):
+        self._counter += 1
+        self._stamps[room_id] = self._counter
+        self._lru.append((self._counter, room_id))
+
+    def _pop_from(self, pop, items):
+        while items:
+            room_id = pop()
+            if room_id in self._free:
+                self._free.discard(room_id)
+                return room_id
+        return None
+
+    def _compact(self):
+        self._heap = sorted(self._free)
+        self._floors = {}
+        for room_id in self._heap:
+            self._floors.setdefault(self.floor_of(room_id), []).append(room_id)
+        self._lru = deque((stamp, room_id) for stamp, room_id in self._lru
+                          if room_id in self._free and self._stamps.get(room_id) == stamp)
@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .data import Settings
+from .manager import Manager
+from .metrics import WRITE_BATCH_SIZE, log_event
+
+
+def _log_refresh_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        log_event(logging.ERROR, 'rollup_refresh_failed', error=str(future.exception()))
+
+
+class AsyncManager:
+    """
+    Manager 的 asyncio 版本。
+
+    所有写操作进入同一个队列，由唯一的写协程把一小段时间窗口内排队的操作放进同一个事务
+    提交（group commit），事务落盘后才唤醒各个调用方；单个操作失败只回滚它自己的 SAVEPOINT。
+    读操作在独立的线程池中使用各自的连接并行执行，不经过写队列。
+    close() 之后的写操作抛出 RuntimeError。
+    """
+
+    def __init__(self, manager=None, batch_window=0.002, max_batch=256, read_workers=4):
+        self.manager = manager if manager is not None else Manager()
+        self.sessions = self.manager.sessions
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='acm-writer')
+        self._read_executor = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='acm-reader')
+        self._queue = None
+        self._writer = None
+        # close() 开始后不再接受写操作
+        self._closing = False
+        # 排队中的汇总表刷新，同一时间只排一个
+        self._rollup_refresh = None
+
+    async def start(self):
+        if self._writer is None:
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.get_running_loop().create_task(self._run_writer())
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        self._closing = True
+        if self._writer is not None:
+            self._queue.put_nowait(None)
+            try:
+                await self._writer
+            finally:
+                self._writer = None
+                # 写协程异常退出或被取消时，仍在队列中的调用方不会再被唤醒
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None and not item[2].done():
+                        item[2].set_exception(RuntimeError("AsyncManager is closed"))
+        await loop.run_in_executor(self._write_executor, self.manager.storage.release_writer)
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+
+    async def _write(self, fn, *args):
+        if self._closing:
+            raise RuntimeError("AsyncManager is closed")
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((fn, args, future))
+        return await future
+
+    async def _read(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor,
+                                                                functools.partial(fn, *args, **kwargs))
+
+    async def _run_writer(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            if self.batch_window > 0:
+                # 等待一个窗口，让同时到达的请求进入同一批
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                results = await loop.run_in_executor(self._write_executor, self._commit_batch,
+                                                     [(fn, args) for fn, args, _ in batch])
+            except Exception as e:
+                # 整批提交失败，所有调用方都收到同一个异常
+                results = [(False, e)] * len(batch)
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _commit_batch(self, batch):
+        storage = self.manager.storage
+        storage.hold_writer()
+        WRITE_BATCH_SIZE.observe(len(batch))
+        results = []
+        with storage.transaction():
+            for fn, args in batch:
+                try:
+                    with storage.transaction():
+                        results.append((True, fn(*args)))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+    async def register_user(self, username, phone, password):
+        # 哈希计算在 hasher 的线程池中进行，不占用写协程
+        hashed_password, salt = await self.manager.hasher.hash_async(password)
+        return await self._write(self.manager.create_user, username, phone, hashed_password, salt)
+
+    async def login(self, username, password):
+        user = await self._read(self.manager.get_login_user, username)
+        if user is None or not await self.manager.hasher.check_async(password, user[1]):
+            return -1, -1, -1
+        user_id, hashed_password, role = user
+        return role, await self._read(self.manager.get_room_id_by_user, user_id), user_id
+
+    async def checkin(self, user_id, floor=None):
+        return await self._write(self.manager.checkin, user_id, floor)
+
+    async def get_cost(self, user_id):
+        return await self._read(self.manager.get_cost, user_id)
+
+    async def live_cost_snapshot(self):
+        return await self._read(self.manager.live_cost_snapshot)
+
+    async def checkout(self, user_id):
+        return await self._write(self.manager.checkout, user_id)
+
+    async def turn_on_ac(self, room_id):
+        return await self._write(self.manager.turn_on_ac, room_id)
+
+    async def turn_off_ac(self, room_id):
+        return await self._write(self.manager.turn_off_ac, room_id)
+
+    async def set_ac(self, room_id, settings: Settings):
+        return await self._write(self.manager.set_ac, room_id, settings)
+
+    async def select_rooms(self, room_ids=None, first=None, last=None):
+        return await self._read(self.manager.select_rooms, room_ids, first, last)
+
+    async def turn_off_many(self, room_ids):
+        return await self._write(self.manager.turn_off_many, room_ids)
+
+    async def set_many(self, room_ids, settings: Settings):
+        return await self._write(self.manager.set_many, room_ids, settings)
+
+    def subscribe(self):
+        """订阅房间状态的变更，见 notifications"""
+        return self.manager.bus.subscribe()
+
+    async def room_snapshot(self):
+        return await self._read(self.manager.room_snapshot)
+
+    async def tick_scheduler(self):
+        return await self._write(self.manager.tick_scheduler)
+
+    async def tick_scheduler_if_due(self):
+        # 检查到期也要读写调度队列，同样交给写协程
+        return await self._write(self.manager.tick_scheduler_if_due)
+
+    async def scheduler_state(self):
+        return await self._read(self.manager.scheduler_state)
+
+    async def check_status(self, room_id):
+        return await self._read(self.manager.check_status, room_id)
+
+    async def generate_report(self, **filters):
+        return await self._read(self.manager.generate_report, **filters)
+
+    async def generate_summary(self, group='day', start_day=None, end_day=None, room_id=None):
+        # 在读线程中查询，尚未计入汇总表的记录在查询时加上；刷新汇总表需要写事务，交给写协程，不等待它完成
+        items = await self._read(self.manager.read_summary, group, start_day, end_day, room_id)
+        if self._rollup_refresh is None or self._rollup_refresh.done():
+            self._rollup_refresh = asyncio.ensure_future(self._write(self.manager.refresh_rollups))
+            self._rollup_refresh.add_done_callback(_log_refresh_error)
+        return items
+
+    async def iter_report(self, chunk_size=1000, after_id=0, **filters):
+        while True:
+            rows = await self._read(self.manager.report_rows, after_id, chunk_size, **filters)
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1][0]
+
+    async def generate_bill(self, user_id):
+        return await self._read(self.manager.generate_bill, user_id)
+
+    async def get_user_id_by_name(self, username):
+        return await self._read(self.manager.get_user_id_by_name, username)
@@ -0,0 +1,47 @@
+import threading
+import time
+
+
+class Clock:
+    """时间来源，所有时间均为毫秒时间戳"""
+
+    def now_ms(self):
+        raise NotImplementedError
+
+
+class SystemClock(Clock):
+    def now_ms(self):
+        return time.time_ns() // 1_000_000
+
+
+class ManualClock(Clock):
+    """手动推进的时钟，用于测试和模拟"""
+
+    def __init__(self, start_ms=0):
+        self._now = start_ms
+        self._lock = threading.Lock()
+
+    def now_ms(self):
+        return self._now
+
+    def set(self, now_ms):
+        with self._lock:
+            self._now = now_ms
+
+    def advance(self, ms=0, seconds=0, hours=0):
+        with self._lock:
+            self._now += ms + int(seconds * 1000) + int(hours * 3600 * 1000)
+            return self._now
+
+
+class ScaledClock(Clock):
+    """以 speed 倍速流逝的时钟，用于加速的负载模拟"""
+
+    def __init__(self, speed, start_ms=None):
+        self.speed = speed
+        self._origin = time.monotonic_ns() // 1_000_000
+        self._start = start_ms if start_ms is not None else SystemClock().now_ms()
+
+    def now_ms(self):
+        elapsed = time.monotonic_ns() // 1_000_000 - self._origin
+        return self._start + int(elapsed * self.speed)
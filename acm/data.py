@@ -1,6 +1,8 @@
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+
+from .pricing import FAN_SPEEDS, MODES
 
 
 class Settings(BaseModel):
@@ -9,8 +11,28 @@ class Settings(BaseModel):
     mode: str
 
 
+class SettingsRequest(Settings):
+    # 请求中的设置，风速和模式不区分大小写，不认识的取值返回 422；
+    # Settings 本身不做限制，默认设置和 invalid_ac_setting 等内部取值不受影响
+    @field_validator('fan_speed')
+    @classmethod
+    def check_fan_speed(cls, value):
+        if value.lower() not in FAN_SPEEDS:
+            raise ValueError(f"fan_speed must be one of {', '.join(FAN_SPEEDS)}")
+        return value
+
+    @field_validator('mode')
+    @classmethod
+    def check_mode(cls, value):
+        if value.lower() not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        return value
+
+
 class CheckInRequest(BaseModel):
     user_id: int
+    # 希望入住的楼层，仅在 floor 分配策略下生效
+    floor: Optional[int] = None
 
 
 class CheckInResponse(BaseModel):
@@ -26,6 +48,8 @@ class Invoice(BaseModel):
 
 
 class ReportItem(BaseModel):
+    # 记录 id，作为下一页的 after_id
+    id: int = 0
     room_id: int
     user_id: int
     start_time: str
@@ -34,6 +58,22 @@ class ReportItem(BaseModel):
     settings: Settings
 
 
+class ShardReportItem(ReportItem):
+    # 记录所在的分片，记录 id 只在分片内唯一
+    shard: int
+
+
+class UsageSummaryItem(BaseModel):
+    # 只有分组用到的键有值，day 为 UTC 日期，按周分组时为该周的星期一
+    room_id: Optional[int] = None
+    day: Optional[str] = None
+    mode: Optional[str] = None
+    fan_speed: Optional[str] = None
+    cost: float
+    runtime_hours: float
+    segments: int
+
+
 class ReportResponse(BaseModel):
     reports: List[ReportItem]
 
@@ -52,19 +92,57 @@ class RoomRequest(BaseModel):
 
 
 class ACSwitchResponse(BaseModel):
+    # 0 为成功；启用送风调度时开启或修改设置后在排队为 1
     status: int
     settings: Settings
 
 
 class ACSettingRequest(BaseModel):
     room_id: int
-    settings: Settings
+    settings: SettingsRequest
+
+
+class BulkRoomRequest(BaseModel):
+    # 房间号列表，或者 first_room 到 last_room 的闭区间，两者可以同时给出
+    room_ids: List[int] = []
+    first_room: Optional[int] = None
+    last_room: Optional[int] = None
+
+
+class BulkACSettingRequest(BulkRoomRequest):
+    settings: SettingsRequest
+
+
+class BulkRoomStatus(BaseModel):
+    room_id: int
+    status: int
+
+
+class BulkACResponse(BaseModel):
+    results: List[BulkRoomStatus]
 
 
 class RoomCostResponse(BaseModel):
     cost: float
 
 
+class QueuedRoom(BaseModel):
+    room_id: int
+    # 风速对应的优先级，0 为低风
+    priority: int
+    # 开始送风或开始等待的时刻
+    since: str
+    elapsed_ms: int
+
+
+class ACQueueResponse(BaseModel):
+    capacity: int
+    time_slice_ms: int
+    # 送风的按优先级从高到低，等待的按出队顺序
+    serving: List[QueuedRoom]
+    waiting: List[QueuedRoom]
+
+
 class RoomStatusResponse(BaseModel):
     busy: int
     ac_on: int
@@ -90,6 +168,7 @@ class UserLoginResponse(BaseModel):
     status: int
     room_id: int
     user_id: int
+    token: str = ""
 
 
 class UserLoginRequest(BaseModel):
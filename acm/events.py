@@ -0,0 +1,197 @@
+"""
+只追加的空调事件日志（ac_events 表）。
+
+入住、退房、开关空调和修改设置都会追加一条事件，与 rooms、ac_usage_record 的修改在同一个事务中，
+一个事务中的事件在提交前用一次 executemany 写入。EventProjector 按 id 顺序读取事件，
+增量计算房间状态和结束的使用时段；replay 用当前的计价规则重新计算全部时段的费用，
+可以校验或整体重建 ac_usage_record，计价规则修改后也可以追溯地重新计费。
+
+开启合并窗口（Manager 的 coalesce_ms）后，合并进当前时段的设置修改记为 SETTINGS_MERGED 事件，
+重放时同样只修改时段的设置和费用差额，不结束时段，所以重放结果与窗口的配置无关。
+
+启用送风调度（见 scheduler）时，开始送风记为 POWER_ON，被抢占记为 PREEMPTED，与关闭一样结束时段；
+排队中的开启和修改设置记为 QUEUED，不影响计费，重放时忽略。
+
+日志开始之前的使用记录无法重放，rollup_state 中 EVENT_LOG_NAME 一行记录了
+建立日志时 ac_usage_record 的最大 id，重放只涉及 id 更大的记录。
+"""
+import threading
+
+from .maintenance import merge_segments
+from .pricing import batch_costs, fan_speed_code, mode_code, price_segment
+
+EVENT_COLUMNS = ('id', 'time', 'kind', 'user_id', 'room_id', 'temperature', 'fan_speed', 'mode')
+
+CHECKIN = 'checkin'
+CHECKOUT = 'checkout'
+POWER_ON = 'on'
+POWER_OFF = 'off'
+SETTINGS = 'set'
+SETTINGS_MERGED = 'merge'
+# 送风调度：开启或修改设置后进入排队，正在送风时被抢占
+QUEUED = 'queued'
+PREEMPTED = 'preempt'
+
+EVENT_LOG_NAME = 'ac_events'
+
+
+def seed_events(c):
+    """建立日志时按当前的入住和空调状态补上事件，使重放能接上正在进行的入住和使用时段"""
+    c.execute(r"""
+    INSERT INTO ac_events (time, kind, user_id, room_id)
+    SELECT COALESCE(ur.in_time, r.start_time, 0), ?, r.user_id, r.id
+    FROM rooms r LEFT JOIN user_record ur ON ur.user_id = r.user_id
+    WHERE r.busy = 1
+    ORDER BY r.id""", (CHECKIN,))
+    c.execute(r"""
+    INSERT INTO ac_events (time, kind, user_id, room_id, temperature, fan_speed, mode)
+    SELECT start_time, ?, user_id, id, temperature, fan_speed, mode
+    FROM rooms
+    WHERE busy = 1 AND ac_on = 1
+    ORDER BY id""", (POWER_ON,))
+    c.execute(r"""
+    INSERT OR IGNORE INTO rollup_state (name, last_id)
+    SELECT ?, COALESCE(MAX(id), 0) FROM ac_usage_record""", (EVENT_LOG_NAME,))
+
+
+class EventLog:
+    """
+    事件缓冲区。事务中追加的事件先保存在当前线程的缓冲区中，
+    最外层事务提交前一次写入；AsyncManager 一批操作共用一个事务，所以整批只写一次。
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._local = threading.local()
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def append(self, time, kind, user_id, room_id, settings=None):
+        pending = self._pending()
+        count = len(pending)
+        if settings is None:
+            pending.append((time, kind, user_id, room_id, None, None, None))
+        else:
+            pending.append((time, kind, user_id, room_id, settings.temperature, settings.fan_speed, settings.mode))
+        self.storage.before_commit(self.flush)
+        # 回滚时丢弃本次追加的事件，嵌套事务只丢弃内层的
+        self.storage.on_rollback(lambda: pending.__delitem__(slice(count, None)))
+
+    def flush(self):
+        pending = self._pending()
+        if pending:
+            self.storage.append_events(pending)
+            pending.clear()
+
+
+class EventProjector:
+    """
+    从事件流增量计算房间状态，apply 返回这批事件中结束的使用时段，
+    (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost_offset)。
+    """
+
+    def __init__(self):
+        # room_id -> [user_id, ac_on, start_time, temperature, fan_speed, mode, cost_offset]，只保存有人入住的房间
+        self.rooms = {}
+        self.last_id = 0
+
+    def apply(self, events):
+        segments = []
+        for event_id, time, kind, user_id, room_id, temperature, fan_speed, mode in events:
+            self.last_id = event_id
+            if kind == CHECKIN:
+                self.rooms[room_id] = [user_id, 0, None, None, None, None, 0.0]
+                continue
+            room = self.rooms.get(room_id)
+            if room is None:
+                continue
+            if kind == SETTINGS_MERGED:
+                if room[1]:
+                    # 与 Manager.set_ac 相同的计算，时段的开始时间不变
+                    room[6] += (price_segment(room[2], time, room[3], room[4], room[5])
+                                - price_segment(room[2], time, temperature, fan_speed, mode))
+                    room[3:6] = [temperature, fan_speed, mode]
+                continue
+            if room[1] and kind in (SETTINGS, POWER_OFF, PREEMPTED, CHECKOUT):
+                segments.append((room[0], room_id, room[2], time, room[3], room[4], room[5], room[6]))
+            if kind == POWER_ON or kind == SETTINGS:
+                room[1:] = [1, time, temperature, fan_speed, mode, 0.0]
+            elif kind == POWER_OFF or kind == PREEMPTED:
+                room[1] = 0
+            elif kind == CHECKOUT:
+                del self.rooms[room_id]
+        return segments
+
+
+def price_segments(segments):
+    """批量计价，返回带费用的使用记录 (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)"""
+    if not segments:
+        return []
+    costs = batch_costs([segment[2] for segment in segments], [segment[3] for segment in segments],
+                        [segment[4] for segment in segments],
+                        [fan_speed_code(segment[5]) for segment in segments],
+                        [mode_code(segment[6]) for segment in segments])
+    return [(*segment[:7], float(cost) + segment[7]) for segment, cost in zip(segments, costs)]
+
+
+def replay(storage, chunk_size=100000):
+    """从头重放事件日志，逐块返回按当前计价规则计算的使用记录，顺序与写入 ac_usage_record 的顺序相同"""
+    projector = EventProjector()
+    while True:
+        events = storage.event_rows(projector.last_id, chunk_size)
+        if not events:
+            return
+        records = price_segments(projector.apply(events))
+        if records:
+            yield records
+
+
+def _recorded(storage, after_id, chunk_size):
+    while True:
+        rows = storage.report_rows(after_id, chunk_size)
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after_id = rows[-1][0]
+
+
+def verify_replay(storage, chunk_size=100000, tolerance=1e-6):
+    """
+    比较重放结果与日志开始后的使用记录，返回不一致的 (序号, 重放的记录, 已有的记录)，
+    一方缺少的记录为 None。归档时合并过的时段无法与重放结果逐条对应，
+    所以两边都先按 maintenance.merge_segments 合并相邻时段再比较。
+    """
+    replayed = merge_segments((None, *record) for records in replay(storage, chunk_size) for record in records)
+    recorded = merge_segments(_recorded(storage, storage.event_log_start(), chunk_size))
+    mismatched = []
+    index = 0
+    while True:
+        row = next(replayed, None)
+        expected = row[1:] if row is not None else None
+        row = next(recorded, None)
+        if expected is None and row is None:
+            return mismatched
+        actual = row[1:] if row is not None else None
+        if (expected is None or actual is None or expected[:7] != actual[:7]
+                or abs(expected[7] - actual[7]) > tolerance):
+            mismatched.append((index, expected, actual))
+        index += 1
+
+
+def rebuild_from_events(storage, chunk_size=100000):
+    """
+    用重放结果替换日志开始后的全部使用记录，并重建入住累计费用和汇总表，返回写入的记录数。
+    需要在写事务中调用。
+    """
+    storage.delete_records_after(storage.event_log_start())
+    count = 0
+    for records in replay(storage, chunk_size):
+        storage.insert_records(records)
+        count += len(records)
+    storage.rebuild_stay_totals()
+    storage.rebuild_rollups()
+    return count
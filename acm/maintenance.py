@@ -0,0 +1,195 @@
+"""
+使用记录的后台维护。
+
+ac_usage_record 只增不减，而报表、账单和累计费用的重建都要读它。维护任务分批处理
+退房时间早于保留期限的入住：合并这次入住中首尾相接、设置相同、在同一天开始的相邻时段，
+把结果移入归档表 ac_usage_archive，再用 incremental_vacuum 归还空闲页，
+用有采样上限的 ANALYZE 更新统计信息。热表中只剩下在住和最近退房的客人的记录。
+
+报表、汇总表和累计费用的重建与校验读取视图 ac_usage_history（归档表和热表的 UNION ALL），
+归档的记录保留原来的 id，按 id 分页的结果与归档前相同，只是合并过的时段变成了一条。
+合并不改变费用和运行时间，入住累计和汇总表中的段数在归档时同步减去。
+
+在 API 进程中由 ACM_MAINTENANCE_INTERVAL 开启（见 MaintenancePolicy.from_env），
+也可以手动执行 python -m acm maintenance run。
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+
+from .clock import SystemClock
+from .metrics import log_event
+from .reports import REPORT_COLUMNS
+from .rollups import MS_PER_DAY, refresh_rollups
+
+
+class MaintenancePolicy:
+    """
+    维护任务的调度和节流参数。
+    每隔 interval_s 秒执行一次，每个事务最多归档 batch_stays 次入住，批之间暂停 pause_ms 毫秒，
+    写线程每次最多被阻塞一批的时间。
+    """
+
+    def __init__(self, interval_s=3600, retention_days=30, batch_stays=100, pause_ms=100, vacuum_pages=1000,
+                 analysis_limit=1000):
+        self.interval_s = interval_s
+        self.retention_days = retention_days
+        self.batch_stays = batch_stays
+        self.pause_ms = pause_ms
+        # 每次最多归还的空闲页数，0 为不回收
+        self.vacuum_pages = vacuum_pages
+        # ANALYZE 每个索引最多采样的行数，0 为不更新统计信息
+        self.analysis_limit = analysis_limit
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """
+        从 ACM_MAINTENANCE_INTERVAL、ACM_RETENTION_DAYS、ACM_MAINTENANCE_BATCH、ACM_MAINTENANCE_PAUSE_MS 读取，
+        没有设置 ACM_MAINTENANCE_INTERVAL 或为 0 时返回 None
+        """
+        interval_s = float(environ.get('ACM_MAINTENANCE_INTERVAL') or 0)
+        if interval_s <= 0:
+            return None
+        return cls(interval_s, float(environ.get('ACM_RETENTION_DAYS', 30)),
+                   int(environ.get('ACM_MAINTENANCE_BATCH', 100)), float(environ.get('ACM_MAINTENANCE_PAUSE_MS', 100)))
+
+    def horizon(self, now_ms):
+        """退房时间早于这个时刻的入住会被归档"""
+        return now_ms - int(self.retention_days * MS_PER_DAY)
+
+
+def _mergeable(last, row):
+    # 同一客人、首尾相接、设置相同，并且在同一天开始，合并后汇总表的分组不变
+    return (last[1] == row[1] and last[4] == row[3] and last[5:8] == row[5:8]
+            and last[3] // MS_PER_DAY == row[3] // MS_PER_DAY)
+
+
+def merge_segments(rows):
+    """
+    合并相邻的时段，rows 为按 id 排序的使用记录，列见 reports.REPORT_COLUMNS。
+    合并后保留第一段的 id，结束时间取最后一段的，费用为各段之和。
+    同一房间的下一段到来时才能确定上一段已经结束，所以结果按这一时刻的顺序返回，
+    对合并过和没合并过的记录流得到的结果相同，事件日志的校验依赖这一点。
+    """
+    pending = {}
+    for row in rows:
+        last = pending.get(row[2])
+        if last is not None:
+            if _mergeable(last, row):
+                pending[row[2]] = (*last[:4], row[4], *last[5:8], last[8] + row[8])
+                continue
+            yield last
+        pending[row[2]] = row
+    yield from pending.values()
+
+
+def archive_stays(c, horizon_ms, limit):
+    """
+    归档最早退房的至多 limit 次入住，返回 (入住数, 移出的记录数, 写入归档表的记录数)。
+    需要在写事务中调用。
+    """
+    # 先把所有记录计入汇总表，移走的记录不会再被增量刷新读到
+    refresh_rollups(c)
+    c.execute(r"""
+    SELECT user_id, in_time, out_time FROM stay_totals
+    WHERE archived = 0 AND out_time IS NOT NULL AND out_time < ?
+    ORDER BY out_time
+    LIMIT ?""", (horizon_ms, limit))
+    stays = c.fetchall()
+    columns = ', '.join(REPORT_COLUMNS)
+    moved = kept = 0
+    for user_id, in_time, out_time in stays:
+        # 与 stays 中一次入住包含的记录的条件相同
+        c.execute(f"""
+        SELECT {columns} FROM ac_usage_record
+        WHERE user_id = ? AND start_time >= ? AND start_time <= ?
+        ORDER BY id""", (user_id, in_time, out_time))
+        rows = c.fetchall()
+        merged = list(merge_segments(rows))
+        c.executemany(f"INSERT INTO ac_usage_archive ({columns}) VALUES ({', '.join('?' * len(REPORT_COLUMNS))})",
+                      merged)
+        c.executemany("DELETE FROM ac_usage_record WHERE id = ?", [(row[0],) for row in rows])
+        c.execute("UPDATE stay_totals SET archived = 1, segments = segments - ? WHERE user_id = ? AND in_time = ?",
+                  (len(rows) - len(merged), user_id, in_time))
+        if len(merged) < len(rows):
+            # 合并掉的段从汇总表中减去，费用和运行时间不变
+            removed = Counter(_rollup_key(row) for row in rows)
+            removed.subtract(_rollup_key(row) for row in merged)
+            c.executemany(r"""
+            UPDATE usage_rollup SET segments = segments - ?
+            WHERE room_id = ? AND day = ? AND mode = ? AND fan_speed = ?""",
+                          [(count, *key) for key, count in removed.items() if count])
+        moved += len(rows)
+        kept += len(merged)
+    return len(stays), moved, kept
+
+
+def _rollup_key(row):
+    return row[2], row[3] // MS_PER_DAY, row[7], row[6]
+
+
+def unarchive_stays(c):
+    """重建使用记录后，所有入住都需要重新归档"""
+    c.execute("UPDATE stay_totals SET archived = 0 WHERE archived = 1")
+
+
+def reclaim_space(c, vacuum_pages, analysis_limit):
+    """
+    归还至多 vacuum_pages 个空闲页并更新统计信息，返回归还的页数。
+    只有 auto_vacuum 为 INCREMENTAL 的数据库能增量回收，旧数据库需要先执行一次
+    python -m acm maintenance vacuum。
+    """
+    c.execute("PRAGMA auto_vacuum")
+    freed = 0
+    if vacuum_pages and c.fetchone()[0] == 2:
+        c.execute("PRAGMA freelist_count")
+        before = c.fetchone()[0]
+        # PRAGMA 不支持参数绑定，每一步归还一页，需要取完结果
+        c.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+        c.execute("PRAGMA freelist_count")
+        freed = before - c.fetchone()[0]
+    if analysis_limit:
+        c.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        try:
+            c.execute("ANALYZE")
+        finally:
+            c.execute("PRAGMA analysis_limit = 0")
+    return freed
+
+
+def run_maintenance(storage, policy, now_ms):
+    """按 policy 执行一轮维护，返回统计信息。每批一个事务，批之间暂停，在后台线程中调用"""
+    start = time.perf_counter()
+    horizon_ms = policy.horizon(now_ms)
+    stats = {'stays': 0, 'moved': 0, 'archived': 0, 'batches': 0, 'max_batch_ms': 0.0, 'freed_pages': 0}
+    while True:
+        batch_start = time.perf_counter()
+        with storage.transaction():
+            stays, moved, kept = storage.archive_stays(horizon_ms, policy.batch_stays)
+        # 一批的耗时就是写线程最多被阻塞的时间
+        stats['max_batch_ms'] = max(stats['max_batch_ms'], (time.perf_counter() - batch_start) * 1000)
+        stats['stays'] += stays
+        stats['moved'] += moved
+        stats['archived'] += kept
+        stats['batches'] += 1
+        if stays < policy.batch_stays:
+            break
+        time.sleep(policy.pause_ms / 1000)
+    stats['freed_pages'] = storage.reclaim_space(policy.vacuum_pages, policy.analysis_limit)
+    stats['seconds'] = time.perf_counter() - start
+    log_event(logging.INFO, 'maintenance', **stats)
+    return stats
+
+
+async def maintenance_loop(storage, policy, clock=None):
+    """每隔 policy.interval_s 秒在线程池中执行一轮维护，直到被取消"""
+    clock = clock if clock is not None else SystemClock()
+    while True:
+        await asyncio.sleep(policy.interval_s)
+        try:
+            await asyncio.to_thread(run_maintenance, storage, policy, clock.now_ms())
+        except Exception as e:
+            # 维护失败不影响服务，下一轮重试
+            log_event(logging.ERROR, 'maintenance_failed', error=str(e))
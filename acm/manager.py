@@ -1,370 +1,661 @@
-import sqlite3
+import logging
+import threading
 
-import bcrypt
-
-from .acmdb import ACMDatabase
+from .allocator import FreeRoomAllocator
+from .clock import SystemClock
 from .data import Settings, Invoice, ReportItem
-from .sql_queries import *
-from .utils import calculate_cost
-from .values import invalid_ac_setting, default_ac_setting
+from .events import (CHECKIN, CHECKOUT, POWER_OFF, POWER_ON, PREEMPTED, QUEUED, SETTINGS, SETTINGS_MERGED, EventLog,
+                     rebuild_from_events, verify_replay)
+from .maintenance import run_maintenance
+from .metrics import log_event, timed
+from .notifications import ChangeBus, RoomChanges
+from .passwords import PasswordHasher
+from .pricing import batch_costs, fan_speed_code, mode_code, price_segment
+from .provisioning import generate_room_specs, load_room_specs
+from .reports import report_fields
+from .rollups import summary_items
+from .rooms import AC_WAITING, RoomState, RoomStore
+from .sessions import GUEST, SessionStore
+from .storage import SQLiteStorage, StorageError
+from .utils import format_time
+from .values import invalid_ac_setting
 
 MIN_ROOM_COUNT = 50
 
 
 class Manager:
-    def __init__(self, room_count=100):
-        self.db = ACMDatabase()
-        self.conn = self.db.get_connection()
+    def __init__(self, room_count=100, hasher=None, allocator=None, clock=None, rooms_config=None, db=None,
+                 users_db=None, first_room=1, storage=None, coalesce_ms=0, scheduler=None):
+        # 持久化数据都通过 storage 读写，默认为 sqlite；users_db 为用户表所在的数据库，
+        # 分片部署时所有分片共用一个，默认与房间在同一个库
+        self.storage = storage if storage is not None else SQLiteStorage(db, users_db)
+        # sqlite 存储时为底层的 ACMDatabase，供命令行工具和基准测试直接访问
+        self.db = getattr(self.storage, 'db', None)
+        self.users_db = getattr(self.storage, 'users_db', None)
+        # 状态变化同时追加到只追加的事件日志，随事务一起提交
+        self.events = EventLog(self.storage)
+        # 房间状态的变更在事务提交后发布给订阅者，见 notifications
+        self.bus = ChangeBus()
+        self.changes = RoomChanges(self.storage, self._publish_rooms)
+        self._publish_lock = threading.Lock()
+        # 启动时保证房间号 first_room 起的 room_count 间都存在（至少 MIN_ROOM_COUNT 间），
+        # 给出 rooms_config 时改为按文件中的房间定义创建
+        self.room_count = max(room_count, MIN_ROOM_COUNT)
+        self.first_room = first_room
+        self.rooms_config = rooms_config
+        # 所有时间都是毫秒时间戳，测试和模拟时可以换成 ManualClock
+        self.clock = clock if clock is not None else SystemClock()
+        # bcrypt 工作因子和并发度由 hasher 决定
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+        # 缓存未命中时按内存中的房间状态补上会话的房间号
+        self.sessions = SessionStore(room_of=self.get_room_id_by_user)
+        self.rooms = RoomStore()
+        # 入住时的选房策略由 allocator 决定
+        self.allocator = allocator if allocator is not None else FreeRoomAllocator()
+        # 使用时段开始后 coalesce_ms 毫秒内只改温度的设置修改合并进这个时段，不写使用记录，0 为不合并；
+        # 每次修改仍然更新 rooms 并追加一条 ac_events，见 _merge_settings
+        self.coalesce_ms = coalesce_ms
+        # 给出 ServiceScheduler 时同时送风的房间数受限，开启空调可能需要排队，见 scheduler；None 为不限
+        self.scheduler = scheduler
+        self._schedule_stale = False
+        # 最后一次提交后的送风队列，只用于 scheduler_state，读线程查询时不接触写线程正在修改的队列
+        self._schedule_view = None
         self._create_tables()
         self.init_rooms()
-
+        self.rooms.load(self.storage.load_rooms())
+        self.allocator.rebuild(self.rooms)
+        self._resume_waiting()
+
+    def _resume_waiting(self):
+        # 启动时按 rooms 表恢复送风队列，服务位数可能变了，需要重新调度一次；
+        # 不再启用调度时，排队中的房间直接开始送风
+        with self.storage.transaction():
+            now = self.clock.now_ms()
+            if self.scheduler is not None:
+                self.scheduler.load(self.rooms)
+                self.storage.after_commit(self._publish_schedule)
+                self._apply_decisions(self.scheduler.tick(now), now)
+                return
+            for room in self.rooms:
+                if room.busy and room.ac_on == AC_WAITING:
+                    self._open_segments([room.id], now)
+                    self.events.append(now, POWER_ON, room.user_id, room.id, room.settings)
+
+    def _schedule_ready(self):
+        # 调度器只在内存中，事务回滚后按回滚后的房间状态重新加载
+        if self._schedule_stale:
+            self.scheduler.load(self.rooms)
+            self._schedule_stale = False
+        self.storage.on_rollback(self._invalidate_schedule)
+        self.storage.after_commit(self._publish_schedule)
+
+    def _invalidate_schedule(self):
+        self._schedule_stale = True
+
+    def _publish_schedule(self):
+        # 在提交事务的线程中执行；同一事务中回滚的内层操作改过的队列先按房间状态重新加载
+        if self._schedule_stale:
+            self.scheduler.load(self.rooms)
+            self._schedule_stale = False
+        self._schedule_view = self.scheduler.snapshot()
+
+    def _apply_decisions(self, decisions, now):
+        # 执行调度决定：开始送风时打开使用时段，被抢占时结束时段并转入等待，只有送风的时间计费
+        for room_id, serve in decisions:
+            room = self.rooms.get(room_id)
+            if serve:
+                self._open_segments([room_id], now)
+                self.events.append(now, POWER_ON, room.user_id, room_id, room.settings)
+            else:
+                self._close_segments([room], now)
+                self._update_rooms([room_id], ac_on=AC_WAITING, start_time=now)
+                self.events.append(now, PREEMPTED, room.user_id, room_id)
+
+    @timed
     def register_user(self, username, phone, password):
-        c = self.conn.cursor()
-        # Generate a new salt
-        salt = bcrypt.gensalt()
-        # Hash the password with the generated salt
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+        hashed_password, salt = self.hash_password(password)
+        return self.create_user(username, phone, hashed_password, salt)
+
+    def hash_password(self, password):
+        return self.hasher.hash(password)
+
+    @timed
+    def create_user(self, username, phone, hashed_password, salt, role=GUEST):
         # Insert user into the database and get the user id
-        insert_query = "INSERT INTO users (username, password, salt, phone,role) VALUES (?, ?, ?, ?,?)"
-        role = 1
-        values = (username, hashed_password.decode('utf-8'), salt.decode('utf-8'), phone, role)
         try:
-            c.execute(insert_query, values)
-            user_id = c.lastrowid
-            self.conn.commit()
-            return user_id
-        except sqlite3.Error as e:
-            print("Error registering user:", e)
+            return self.storage.create_user(username, phone, hashed_password, salt, role)
+        except StorageError as e:
+            log_event(logging.WARNING, 'register_failed', username=username, error=str(e))
             return -1
 
+    @timed
     def login(self, username, password):
-        c = self.conn.cursor()
-        query = "SELECT id, password, salt , role FROM users WHERE username = ?"
-        values = (username,)
-        c.execute(query, values)
-        user = c.fetchone()
-        print(user)
-        if user is None:
-            return 0, 0
-        user_id, hashed_password, salt, role = user
-        if not bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8')):
-            return 0, 0
-        # get room_id from rooms
-        query = "SELECT id FROM rooms WHERE user_id = ?"
-        c.execute(query, (user_id,))
-        room_id = c.fetchone()
-        if room_id is None:
-            room_id = -1
-        else:
-            room_id = room_id[0]
-        return role, room_id, user_id
-
-    def checkin(self, user_id):
-        c = self.conn.cursor()
-        # check if the user exists
-        query = "SELECT id FROM users WHERE id = ?"
-        c.execute(query, (user_id,))
-        user = c.fetchone()
-        if user is None:
-            return -3
-        # check if user already checked in from user_record
-        query = "SELECT user_id FROM rooms WHERE user_id = ?"
-        c.execute(query, (user_id,))
-        room = c.fetchone()
-        if room is not None:
-            return -2
-        # find a room that isn't busy
-        query = "SELECT id, ac_on, temperature, fan_speed, mode FROM rooms WHERE busy = 0"
-        c.execute(query)
-        room = c.fetchone()
+        user = self.get_login_user(username)
+        # 校验密码时不占用数据库连接
+        if user is None or not self.hasher.check(password, user[1]):
+            return -1, -1, -1
+        user_id, hashed_password, role = user
+        return role, self.get_room_id_by_user(user_id), user_id
+
+    @timed
+    def get_login_user(self, username):
+        return self.storage.get_login_user(username)
+
+    def get_room_id_by_user(self, user_id):
+        room = self.rooms.by_user(user_id)
         if room is None:
             return -1
-        room_id, ac_on, temperature, fan_speed, mode = room
-        busy = 1
-        # get current time
-        get_time_query = "SELECT datetime('now')"
-        c.execute(get_time_query)
-        start_time = c.fetchone()[0]
-        # update the room
-        update_room_query = r"""
-        UPDATE rooms
-        SET busy = ?, user_id = ?, start_time = ?, temperature = ?, fan_speed = ?, mode = ?
-        WHERE id = ?"""
-        values = (busy, user_id, start_time, temperature, fan_speed, mode, room_id)
-        c.execute(update_room_query, values)
-        # insert user record
-        insert_user_record_query = "INSERT INTO user_record (user_id, in_time) VALUES (?, ?)"
-        values = (user_id, start_time)
-        c.execute(insert_user_record_query, values)
-        self.conn.commit()
-        return room_id
-
+        return room.id
+
+    @timed
+    def checkin(self, user_id, floor=None):
+        with self.storage.transaction():
+            # check if the user exists
+            if not self.storage.user_exists(user_id):
+                return -3
+            # check if user already checked in，内存中的状态只包括本进程办理的入住，
+            # 再在写事务中查一次存储，其他进程刚办理的入住也能看到
+            if self.rooms.by_user(user_id) is not None or self.storage.occupied_room(user_id) is not None:
+                return -2
+            # get current time
+            start_time = self.clock.now_ms()
+            # claim a room that isn't busy
+            room_id = self._claim_room(user_id, start_time, floor)
+            if room_id is None:
+                return -1
+            # insert user record and open the running total of this stay
+            self.storage.open_stay(user_id, room_id, start_time)
+            self.events.append(start_time, CHECKIN, user_id, room_id)
+            self._refresh_session_room(user_id)
+            log_event(logging.INFO, 'checkin', user_id=user_id, room_id=room_id)
+            return room_id
+
+    def _refresh_session_room(self, user_id):
+        # 提交后按已提交的房间状态更新缓存的会话，与房间状态对其他线程可见的时刻一致；
+        # 外层事务中被回滚的内层入住或退房不会改动会话
+        self.storage.after_commit(lambda: self.sessions.update_room(user_id, self.get_room_id_by_user(user_id)))
+
+    @timed
     def get_cost(self, user_id):
-        c = self.conn.cursor()
-        # get start time from user_record
-        query = "SELECT in_time FROM user_record WHERE user_id = ?"
-        values = (user_id,)
-        c.execute(query, values)
-        in_time = c.fetchone()[0]
-        # get records from ac_usage_record
-        get_records_query = "SELECT start_time, cost FROM ac_usage_record WHERE user_id = ?"
-        c.execute(get_records_query, values)
-        records = c.fetchall()
-        total_cost = 0
-        for record in records:
-            start_time, cost = record
-            # make sure the record is after the user checkin time
-            if start_time >= in_time:
-                total_cost += cost
-        # get room's current status
-        query = "SELECT id, ac_on, start_time, temperature, fan_speed, mode FROM rooms WHERE user_id = ?"
-        c.execute(query, values)
-        room = c.fetchone()
-        if room is None:
+        # 房间状态和累计费用从存储的同一个快照中读取：提交之后、内存状态更新之前，
+        # 内存中的房间状态与已提交的累计费用对不上
+        state = self.storage.stay_state(user_id)
+        if state is None:
             return -1
-        room_id, ac_on, start_time, temperature, fan_speed, mode = room
-        # get current time
-        get_time_query = "SELECT datetime('now')"
-        c.execute(get_time_query)
-        end_time = c.fetchone()[0]
-        if ac_on == 1:
-            cost = calculate_cost(start_time, end_time, temperature, fan_speed, mode)
-            total_cost += cost
+        room, stay_cost = state
+        return self._stay_cost(room, self.clock.now_ms(), stay_cost)
+
+    def _stay_cost(self, room, end_time, stay_cost):
+        # stay_cost 为本次入住已结束时段的累计费用，与 room 来自同一个快照
+        total_cost = stay_cost if stay_cost is not None else 0
+        if room.ac_on == 1:
+            cost = price_segment(room.start_time, end_time, room.temperature, room.fan_speed, room.mode)
+            total_cost += cost + room.cost_offset
         return total_cost
 
+    def verify_stay_totals(self):
+        return self.storage.verify_stay_totals()
+
+    def rebuild_stay_totals(self):
+        with self.storage.transaction():
+            return self.storage.rebuild_stay_totals()
+
+    @timed
+    def live_cost_snapshot(self):
+        """所有正在运行的空调当前这一段的费用，{room_id: cost}，一次批量计算"""
+        running = [room for room in self.rooms if room.busy and room.ac_on == 1]
+        if not running:
+            return {}
+        now = self.clock.now_ms()
+        costs = batch_costs([room.start_time for room in running], [now] * len(running),
+                            [room.temperature for room in running],
+                            [fan_speed_code(room.fan_speed) for room in running],
+                            [mode_code(room.mode) for room in running])
+        return {room.id: float(cost) + room.cost_offset for room, cost in zip(running, costs)}
+
+    @timed
     def checkout(self, user_id):
-        c = self.conn.cursor()
-        # check the room status
-        query = "SELECT busy, ac_on FROM rooms WHERE user_id = ?"
-        values = (user_id,)
-        c.execute(query, values)
-        room = c.fetchone()
-        if room is None or room[0] == 0:
-            return -1
-        room_id, ac_on = room
-        if ac_on == 1:
-            # turn off the ac
-            self.turn_off_ac(room_id)
-        # get the user checkin time
-        query = "SELECT start_time FROM rooms WHERE user_id = ?"
-        c.execute(query, values)
-        # get the last record
-        # start_time = c.fetchone()[0]
-        # get records from ac_usage_record
-        # get_records_query = "SELECT * FROM ac_usage_record WHERE user_id = ?"
-        # c.execute(get_records_query, values)
-        # records = c.fetchall()
-        # invoices = []
-        # total_cost = 0
-        # for record in records:
-        #     user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost = record
-        #     total_cost += cost
-        #     settings = Settings(temperature = temperature, fan_speed = fan_speed, mode = mode)
-        #     invoices.append(
-        #         Invoice(room_id = room_id, start_time = start_time, end_time = end_time, settings = settings,
-        #                 cost = cost))
-        # delete user record
-        total_cost, invoices = self.generate_bill(user_id)
-        delete_user_record_query = "DELETE FROM user_record WHERE user_id = ?"
-        c.execute(delete_user_record_query, values)
-
-        # update the room
-        update_room_query = "UPDATE rooms SET busy = 0, user_id = -1, start_time = '', ac_on = 0 WHERE user_id = ?"
-        c.execute(update_room_query, values)
-        self.conn.commit()
-        return total_cost, invoices
-
+        with self.storage.transaction():
+            # check the room status
+            room = self.rooms.by_user(user_id)
+            if room is None or room.busy == 0:
+                return -1
+            room_id = room.id
+            # get current time, the ac is turned off and the stay ends at the same moment
+            out_time = self.clock.now_ms()
+            if room.ac_on == 1:
+                # turn off the ac, the room row is reset below
+                self._end_segment(room, out_time)
+            # records of this stay, filtered by the checkin time in SQL
+            invoices = self._invoices(self.storage.stay_bill(user_id))
+            # delete user record and close the running total of this stay, which is the total cost
+            total_cost = self.storage.close_stay(user_id, out_time)
+            if total_cost is None:
+                total_cost = sum(invoice.cost for invoice in invoices)
+            self.events.append(out_time, CHECKOUT, user_id, room_id)
+
+            # update the room
+            self._update_rooms([room_id], busy=0, user_id=-1, start_time=None, ac_on=0)
+            if self.scheduler is not None:
+                self._schedule_ready()
+                self._apply_decisions(self.scheduler.release(room_id, out_time), out_time)
+            self.allocator.push(room_id)
+            self.storage.on_rollback(lambda: self.allocator.discard(room_id))
+            self._refresh_session_room(user_id)
+            log_event(logging.INFO, 'checkout', user_id=user_id, room_id=room_id, cost=total_cost)
+            return total_cost, invoices
+
+    @timed
     def turn_on_ac(self, room_id):
-        c = self.conn.cursor()
-        # check the room status
-        query = "SELECT busy, ac_on, start_time, temperature, fan_speed, mode FROM rooms WHERE id = ?"
-        values = (room_id,)
-        c.execute(query, values)
-        room = c.fetchone()
-        if room is None or room[0] == 0:
-            return -1, invalid_ac_setting
-        busy, ac_on, start_time, temperature, fan_speed, mode = room
-        if ac_on == 1:
-            return -2, invalid_ac_setting
-        settings = Settings(temperature=temperature, fan_speed=fan_speed, mode=mode)
-        # get current time
-        get_time_query = "SELECT datetime('now')"
-        c.execute(get_time_query)
-        start_time = c.fetchone()[0]
-        # update the room
-        update_room_query = "UPDATE rooms SET ac_on = 1, start_time = ? WHERE id = ?"
-        values = (start_time, room_id)
-        c.execute(update_room_query, values)
-        self.conn.commit()
-        return 0, settings
-
+        with self.storage.transaction():
+            # check the room status
+            room = self.rooms.get(room_id)
+            if room is None or room.busy == 0:
+                return -1, invalid_ac_setting
+            if room.ac_on != 0:
+                return -2, invalid_ac_setting
+            # get current time
+            start_time = self.clock.now_ms()
+            if self.scheduler is not None:
+                return self._request_service(room, start_time), room.settings
+            # update the room
+            self._open_segments([room_id], start_time)
+            self.events.append(start_time, POWER_ON, room.user_id, room_id, room.settings)
+            return 0, room.settings
+
+    def _request_service(self, room, now):
+        # 提出送风请求，返回 0 表示正在送风，1 表示在排队；
+        # 请求的优先级取房间当前的风速，调度器开始送风时才打开使用时段
+        self._schedule_ready()
+        decisions = self.scheduler.request(room.id, self.scheduler.priority(room.fan_speed), now)
+        serving = room.id in self.scheduler.serving
+        if room.ac_on == 0 and not serving:
+            self._update_rooms([room.id], ac_on=AC_WAITING, start_time=now)
+            self.events.append(now, QUEUED, room.user_id, room.id, room.settings)
+        self._apply_decisions(decisions, now)
+        return 0 if serving else 1
+
+    @timed
     def turn_off_ac(self, room_id):
-        c = self.conn.cursor()
-        settings = invalid_ac_setting
-        # make sure the room is busy
-        query = "SELECT busy, ac_on ,user_id,start_time,temperature,fan_speed,mode FROM rooms WHERE id = ?"
-        values = (room_id,)
-        c.execute(query, values)
-        room = c.fetchone()
-        if room is None or room[0] == 0:
-            return -1, settings
-        busy, ac_on, user_id, start_time, temperature, fan_speed, mode = room
-        if ac_on == 0:
-            return -2, settings
-        # get current time
-        get_time_query = "SELECT datetime('now')"
-        c.execute(get_time_query)
-        end_time = c.fetchone()[0]
-        print(start_time, end_time, temperature, fan_speed, mode)
-        # calculate the cost
-        cost = calculate_cost(start_time, end_time, temperature, fan_speed, mode)
-        # insert the record
-        self.insert_ac_usage_record(user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)
-        # update the room
-        update_room_query = "UPDATE rooms SET ac_on = 0 WHERE id = ?"
-        values = (room_id,)
-        c.execute(update_room_query, values)
-        self.conn.commit()
-        settings = Settings(temperature=temperature, fan_speed=fan_speed, mode=mode)
-        return 0, settings
-
+        with self.storage.transaction():
+            settings = invalid_ac_setting
+            # make sure the room is busy
+            room = self.rooms.get(room_id)
+            if room is None or room.busy == 0:
+                return -1, settings
+            if room.ac_on == 0:
+                return -2, settings
+            # get current time
+            end_time = self.clock.now_ms()
+            if room.ac_on == 1:
+                self._end_segment(room, end_time)
+            else:
+                # 还在排队，没有打开的使用时段
+                self.events.append(end_time, POWER_OFF, room.user_id, room_id)
+            # update the room
+            self._update_rooms([room_id], ac_on=0)
+            if self.scheduler is not None:
+                self._schedule_ready()
+                self._apply_decisions(self.scheduler.release(room_id, end_time), end_time)
+            return 0, room.settings
+
+    def _end_segment(self, room, end_time):
+        # 结束当前使用时段，由调用方提供事务并修改房间状态，不再嵌套 SAVEPOINT
+        record = self._close_segments([room], end_time)[0]
+        log_event(logging.DEBUG, 'ac_segment', room_id=room.id, start_time=room.start_time, end_time=end_time,
+                  temperature=room.temperature, fan_speed=room.fan_speed, mode=room.mode, cost=record[-1])
+        self.events.append(end_time, POWER_OFF, room.user_id, room.id)
+
+    @timed
     def set_ac(self, room_id, settings: Settings):
-        c = self.conn.cursor()
-        # check the room status
-        query = "SELECT busy, ac_on FROM rooms WHERE id = ?"
-        values = (room_id,)
-        c.execute(query, values)
-        room = c.fetchone()
-        if room is None or room[0] == 0:
-            return -1, invalid_ac_setting
-        busy, ac_on = room
-        if ac_on == 0:
-            return -2, invalid_ac_setting
-        # get current time
-        get_time_query = "SELECT datetime('now')"
-        c.execute(get_time_query)
-        current_time = c.fetchone()[0]
-        # get the previous setting
-        query = "SELECT id, user_id,start_time, temperature, fan_speed, mode FROM rooms WHERE id = ?"
-        c.execute(query, values)
-        room = c.fetchone()
-        if room is None:
-            return -3, invalid_ac_setting
-        room_id, user_id, start_time, temperature, fan_speed, mode = room
-        # insert the record
-        self.insert_ac_usage_record(user_id, room_id, start_time, current_time, temperature, fan_speed, mode,
-                                    calculate_cost(start_time, current_time, temperature, fan_speed, mode))
-        # update the room
-        update_room_query = "UPDATE rooms SET temperature = ?, fan_speed = ?, mode = ? WHERE id = ?"
-        values = (settings.temperature, settings.fan_speed, settings.mode, room_id)
-        c.execute(update_room_query, values)
-
-        self.conn.commit()
-        return 0, settings
-
+        with self.storage.transaction():
+            # check the room status, the previous setting comes from the same snapshot
+            room = self.rooms.get(room_id)
+            if room is None or room.busy == 0:
+                return -1, invalid_ac_setting
+            if room.ac_on == 0:
+                return -2, invalid_ac_setting
+            # get current time
+            current_time = self.clock.now_ms()
+            if room.ac_on == AC_WAITING:
+                # 排队中只修改设置，按新的风速重新排队
+                self._update_rooms([room_id], temperature=settings.temperature, fan_speed=settings.fan_speed,
+                                   mode=settings.mode)
+                self.events.append(current_time, QUEUED, room.user_id, room_id, settings)
+                return self._request_service(self.rooms.get(room_id), current_time), settings
+            if self.coalesce_ms > 0 and settings == room.settings:
+                # 设置没有变化，当前时段继续
+                return 0, settings
+            if self.coalesce_ms > 0 and self._mergeable(room, current_time, settings):
+                self._merge_settings(room, current_time, settings)
+            else:
+                # insert the record
+                self._close_segments([room], current_time)
+                # update the room, the next segment starts now
+                self._open_segments([room_id], current_time, temperature=settings.temperature,
+                                    fan_speed=settings.fan_speed, mode=settings.mode)
+                self.events.append(current_time, SETTINGS, room.user_id, room_id, settings)
+            if self.scheduler is not None:
+                # 风速降低后可能被等待中的请求抢占
+                return self._request_service(self.rooms.get(room_id), current_time), settings
+            return 0, settings
+
+    def _mergeable(self, room, current_time, settings):
+        # 汇总表和报表按模式和风速分组，合并后的时段记在最终的设置下，所以只合并窗口内只改温度的修改；
+        # 时段还没有经过任何时间时，什么设置都可以直接替换
+        if current_time == room.start_time:
+            return True
+        return (current_time - room.start_time < self.coalesce_ms
+                and settings.fan_speed == room.fan_speed and settings.mode == room.mode)
+
+    def _merge_settings(self, room, current_time, settings):
+        # 修改当前时段的设置而不结束它。时段的费用按 start_time 起的当前设置计价，
+        # 所以把已经过去的这一段按新旧设置计价的差额记在 cost_offset 中，总费用与不合并时相同。
+        # 省下的只是使用记录的插入：每次修改仍然写一次 rooms 的 UPDATE 和一行 ac_events。
+        # 时段结束后的使用记录只保存最后的温度，费用则包括 cost_offset 中折算的之前各个温度，
+        # 所以报表中这一行的温度和费用不能互相推算；逐次的温度保存在事件日志中
+        offset = room.cost_offset + (
+            price_segment(room.start_time, current_time, room.temperature, room.fan_speed, room.mode)
+            - price_segment(room.start_time, current_time, settings.temperature, settings.fan_speed, settings.mode))
+        self._update_rooms([room.id], temperature=settings.temperature, fan_speed=settings.fan_speed,
+                           mode=settings.mode, cost_offset=offset)
+        self.events.append(current_time, SETTINGS_MERGED, room.user_id, room.id, settings)
+
+    def select_rooms(self, room_ids=None, first=None, last=None):
+        """批量操作的目标房间：给定的房间号列表，加上 [first, last] 范围内已有的房间"""
+        selected = dict.fromkeys(room_ids or ())
+        if first is not None or last is not None:
+            first = first if first is not None else 1
+            last = last if last is not None else float('inf')
+            selected.update(dict.fromkeys(sorted(room.id for room in self.rooms if first <= room.id <= last)))
+        return list(selected)
+
+    @timed
+    def turn_off_many(self, room_ids):
+        """
+        批量关闭空调，全部房间在同一个事务中完成，返回 {房间号: 状态}，状态含义与 turn_off_ac 相同。
+        """
+        with self.storage.transaction():
+            statuses, rooms = self._running_rooms(room_ids)
+            end_time = self.clock.now_ms()
+            self._close_segments([room for room in rooms if room.ac_on == 1], end_time)
+            self._update_rooms([room.id for room in rooms], ac_on=0)
+            for room in rooms:
+                self.events.append(end_time, POWER_OFF, room.user_id, room.id)
+            if self.scheduler is not None:
+                self._schedule_ready()
+                for room in rooms:
+                    self._apply_decisions(self.scheduler.release(room.id, end_time), end_time)
+            return statuses
+
+    @timed
+    def set_many(self, room_ids, settings: Settings):
+        """
+        批量修改空调设置，全部房间在同一个事务中完成，返回 {房间号: 状态}，状态含义与 set_ac 相同。
+        """
+        with self.storage.transaction():
+            statuses, rooms = self._running_rooms(room_ids)
+            current_time = self.clock.now_ms()
+            serving = [room for room in rooms if room.ac_on == 1]
+            waiting = [room for room in rooms if room.ac_on != 1]
+            self._close_segments(serving, current_time)
+            self._open_segments([room.id for room in serving], current_time, temperature=settings.temperature,
+                                fan_speed=settings.fan_speed, mode=settings.mode)
+            for room in serving:
+                self.events.append(current_time, SETTINGS, room.user_id, room.id, settings)
+            self._update_rooms([room.id for room in waiting], temperature=settings.temperature,
+                               fan_speed=settings.fan_speed, mode=settings.mode)
+            for room in waiting:
+                self.events.append(current_time, QUEUED, room.user_id, room.id, settings)
+            if self.scheduler is not None:
+                # 送风的房间先全部换成新设置，再按新的风速逐个调度
+                for room in rooms:
+                    statuses[room.id] = self._request_service(self.rooms.get(room.id), current_time)
+            return statuses
+
+    def _running_rooms(self, room_ids):
+        # 返回各房间的状态以及其中空调正在运行的房间快照
+        statuses = {}
+        rooms = []
+        for room_id in room_ids:
+            room = self.rooms.get(room_id)
+            if room is None or room.busy == 0:
+                statuses[room_id] = -1
+            elif room.ac_on == 0:
+                statuses[room_id] = -2
+            else:
+                statuses[room_id] = 0
+                rooms.append(room)
+        return statuses, rooms
+
+    def _close_segments(self, rooms, end_time):
+        # 结束这些房间当前的使用时段，写入使用记录并累加入住费用
+        records = [(room.user_id, room.id, room.start_time, end_time, room.temperature, room.fan_speed, room.mode,
+                    price_segment(room.start_time, end_time, room.temperature, room.fan_speed, room.mode)
+                    + room.cost_offset)
+                   for room in rooms]
+        self.storage.close_segments(records)
+        return records
+
+    def _open_segments(self, room_ids, start_time, **settings):
+        # 新时段没有合并过的设置修改
+        self.storage.open_segments(room_ids, start_time, cost_offset=0.0, **settings)
+        for room_id in room_ids:
+            self._put_room(room_id, ac_on=1, start_time=start_time, cost_offset=0.0, **settings)
+
+    def _update_rooms(self, room_ids, **fields):
+        # 多个房间修改为相同的值，先写存储再更新内存，事务回滚时恢复原来的状态
+        self.storage.update_rooms(room_ids, **fields)
+        for room_id in room_ids:
+            self._put_room(room_id, **fields)
+
+    @timed
     def check_status(self, room_id):
-        c = self.conn.cursor()
-        query = r"""SELECT busy, ac_on, user_id, start_time, temperature,fan_speed, mode FROM rooms WHERE id = ?"""
-        print(room_id)
-        values = (room_id,)
-        c.execute(query, values)
-        room = c.fetchone()
-        print(room)
+        room = self.rooms.get(room_id)
         if room is None:
             return None
-        busy, ac_on, user_id, start_time, temperature, fan_speed, mode = room
-        settings = Settings(temperature=temperature, fan_speed=fan_speed, mode=mode)
-        return busy, ac_on, user_id, start_time, settings
+        return room.busy, room.ac_on, room.user_id, room.start_time, room.settings
+
+    def verify_room_state(self):
+        """检查内存中的房间状态与 rooms 表是否一致，返回不一致的房间号"""
+        return self.rooms.verify(self.storage.load_rooms())
+
+    def _put_room(self, room_id, **fields):
+        self._stage_room(room_id, self.rooms.get(room_id).replace(**fields))
+        self._rooms_changed((room_id,))
+
+    def _stage_room(self, room_id, room):
+        # 事务中的房间状态只在当前线程可见，提交后再对其他线程可见，回滚时丢弃；
+        # room 为 None 时删除房间
+        if not self.rooms.staging:
+            # 第一次修改时登记，嵌套事务回滚后重新登记
+            self.storage.on_rollback(self.rooms.discard_staged)
+            self.storage.after_commit(self.rooms.commit_staged)
+        old = self.rooms.stage(room_id, room)
+        self.storage.on_rollback(lambda: self.rooms.stage(room_id, old))
+
+    def _rooms_changed(self, room_ids):
+        # 没有订阅者时不记录
+        if self.bus.active:
+            self.changes.add(room_ids)
+
+    def _publish_rooms(self, room_ids):
+        # 在提交事务的线程中执行。生成和发布在同一把锁内，后发布的变更总是更新的状态
+        with self._publish_lock:
+            now = self.clock.now_ms()
+            rooms = [room for room in map(self.rooms.get, room_ids) if room is not None]
+            stay_costs = self.storage.stay_costs([room.user_id for room in rooms if room.busy])
+            try:
+                self.bus.publish(self._room_states([(room, stay_costs.get(room.user_id)) for room in rooms], now))
+            except Exception as e:
+                # 事务已经提交，不能让调用方以为失败；订阅者漏掉了这条变更，断开后重新取快照
+                log_event(logging.ERROR, 'publish_failed', room_ids=room_ids, error=str(e))
+                self.bus.disconnect_all()
+
+    def _room_states(self, rooms, now):
+        # 推送给订阅者的房间状态，rooms 为 [(RoomState, 累计费用)]，cost 与 get_cost 相同，
+        # 空调开着时在下一次变更之前持续增长
+        return [{'room_id': room.id, 'busy': room.busy, 'ac_on': room.ac_on, 'user_id': room.user_id,
+                 'start_time': room.start_time, 'settings': room.settings,
+                 'cost': self._stay_cost(room, now, stay_cost) if room.busy else None}
+                for room, stay_cost in rooms]
+
+    def room_snapshot(self):
+        """
+        全部房间的当前状态，以及此前最后一条变更的编号，订阅者只需应用编号更大的变更。
+        与 get_cost 一样从存储的同一个快照中读取；快照可能已经包含编号更大的变更，重复应用结果相同
+        """
+        with self._publish_lock:
+            now = self.clock.now_ms()
+            rooms = sorted(self.storage.load_room_costs(), key=lambda pair: pair[0].id)
+            return self.bus.seq, self._room_states(rooms, now)
+
+    def _claim_room(self, user_id, start_time, floor=None):
+        """
+        占用一个空闲房间，返回房间号，没有空房时返回 None。
+        以存储中的房间状态为准，分配器中过期的房间会被跳过。
+        """
+        while True:
+            room_id = self.allocator.pop(floor)
+            if room_id is None:
+                break
+            self.storage.on_rollback(lambda room_id=room_id: self.allocator.push(room_id))
+            if self.storage.claim_room(room_id, user_id, start_time):
+                self._put_room(room_id, busy=1, user_id=user_id, start_time=start_time)
+                return room_id
+        # 分配器已空，再直接查一次存储，兜底其他进程释放的房间
+        room = self.storage.claim_any_room(user_id, start_time)
+        if room is None:
+            return None
+        room_id = room.id
+        self._stage_room(room_id, room)
+        self._rooms_changed((room_id,))
+        return room_id
 
     # 查询统计报表，统计房间的使用详单
-    def generate_report(self):
-        c = self.conn.cursor()
-        # # 查询房间的空调使用记录，并计算总消费
-        # query = r"""
-        # SELECT SUM(cost) FROM ac_usage_record WHERE room_id = ?
-        # """
-        # c.execute(query, (room_id,))
-        # total_cost = c.fetchone()[0]
-        # 查询房间的空调使用记录
-        query = r"""
-        SELECT user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost
-        FROM ac_usage_record"""
-        c.execute(query)
-        usage_records = c.fetchall()
-        report_items = []
-        for record in usage_records:
-            user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost = record
-            settings = Settings(temperature=temperature, fan_speed=fan_speed, mode=mode)
-            report_item = ReportItem(room_id=room_id, user_id=user_id, start_time=start_time, end_time=end_time,
-                                     cost=cost, settings=settings)
-            report_items.append(report_item)
-        return report_items
+    @timed
+    def generate_report(self, after_id=0, limit=None, start_time=None, end_time=None, room_id=None, user_id=None):
+        return [ReportItem(**report_fields(record))
+                for record in self.report_rows(after_id, limit, start_time, end_time, room_id, user_id)]
+
+    @timed
+    def report_rows(self, after_id=0, limit=None, start_time=None, end_time=None, room_id=None, user_id=None):
+        """按 id 分页查询空调使用记录，返回原始的行，见 reports.select_report_rows"""
+        return self.storage.report_rows(after_id, limit, start_time, end_time, room_id, user_id)
+
+    def iter_report(self, chunk_size=1000, after_id=0, **filters):
+        """逐块读取报表，每块单独查询，内存占用与历史记录总量无关"""
+        while True:
+            rows = self.report_rows(after_id, chunk_size, **filters)
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            after_id = rows[-1][0]
+
+    # 按房间、日期、周或设置汇总的报表，先把新记录计入汇总表
+    @timed
+    def generate_summary(self, group='day', start_day=None, end_day=None, room_id=None):
+        with self.storage.transaction():
+            self.storage.refresh_rollups()
+            rows = self.storage.summary_rows(group, start_day, end_day, room_id)
+        return summary_items(group, rows)
+
+    def read_summary(self, group='day', start_day=None, end_day=None, room_id=None):
+        """与 generate_summary 结果相同，但不刷新汇总表，尚未计入的记录在查询时加上，可以在读线程中调用"""
+        return summary_items(group, self.storage.summary_rows(group, start_day, end_day, room_id, pending=True))
+
+    def refresh_rollups(self):
+        with self.storage.transaction():
+            return self.storage.refresh_rollups()
+
+    def rebuild_rollups(self):
+        with self.storage.transaction():
+            return self.storage.rebuild_rollups()
+
+    def verify_rollups(self):
+        return self.storage.verify_rollups()
+
+    def verify_events(self):
+        """重放事件日志并与使用记录比较，见 events.verify_replay"""
+        return verify_replay(self.storage)
+
+    def rebuild_from_events(self):
+        """按当前计价规则重放事件日志，重建使用记录、入住累计费用和汇总表"""
+        with self.storage.transaction():
+            return rebuild_from_events(self.storage)
+
+    def run_maintenance(self, policy):
+        """按 policy 合并并归档已退房的入住的使用记录，见 maintenance.run_maintenance"""
+        return run_maintenance(self.storage, policy, self.clock.now_ms())
+
+    @timed
+    def tick_scheduler(self):
+        """执行到期的时间片轮转，返回调度决定 [(房间号, 是否送风)]，没有启用调度时返回空列表"""
+        if self.scheduler is None:
+            return []
+        with self.storage.transaction():
+            now = self.clock.now_ms()
+            self._schedule_ready()
+            decisions = self.scheduler.tick(now)
+            self._apply_decisions(decisions, now)
+            return decisions
+
+    def tick_scheduler_if_due(self):
+        """有到期的时间片时执行 tick_scheduler，否则返回空列表；与写操作一样只能在写线程中调用"""
+        if self.scheduler is None:
+            return []
+        self._schedule_ready()
+        deadline = self.scheduler.next_deadline()
+        if deadline is None or deadline > self.clock.now_ms():
+            return []
+        return self.tick_scheduler()
+
+    def scheduler_state(self):
+        """最后一次提交后送风队列的状态，见 ServiceScheduler.state，可以在读线程中调用；没有启用调度时返回 None"""
+        if self.scheduler is None:
+            return None
+        return self._schedule_view.state(self.clock.now_ms())
 
     # 提供消费账单和详单
+    @timed
     def generate_bill(self, user_id):
-        c = self.conn.cursor()
-        query = r"""
-        SELECT room_id, start_time, end_time, temperature, fan_speed, mode, cost
-        FROM ac_usage_record
-        WHERE user_id = ?"""
-        c.execute(query, (user_id,))
-        bill = c.fetchall()
-
-        everything = "SELECT * FROM user_record"
-        c.execute(everything)
-        print(c.fetchall())
+        # only return records after the user checkin time, filtered in SQL
+        invoices = self._invoices(self.storage.stay_bill(user_id))
+        return sum(invoice.cost for invoice in invoices), invoices
 
-        # get in time from user_record
-        query = "SELECT in_time FROM user_record WHERE user_id = ?"
-        print(user_id)
-
-        values = (user_id,)
-        c.execute(query, values)
-        in_time = c.fetchone()
-        if in_time is None:
-            return 0, []
-        in_time = in_time[0]
-        print(in_time)
-        # only return records after the user checkin time
+    @staticmethod
+    def _invoices(bill):
         invoices = []
-        total_cost = 0
         for bill_item in bill:
             room_id, start_time, end_time, temperature, fan_speed, mode, cost = bill_item
-            if start_time < in_time:
-                continue
             settings = Settings(temperature=temperature, fan_speed=fan_speed, mode=mode)
-            invoice = Invoice(room_id=room_id, start_time=start_time, end_time=end_time, settings=settings,
-                              cost=cost)
+            invoice = Invoice(room_id=room_id, start_time=format_time(start_time), end_time=format_time(end_time),
+                              settings=settings, cost=cost)
             invoices.append(invoice)
-            total_cost += cost
-        return total_cost, invoices
+        return invoices
 
     # 插入用户信息
     def insert_user(self, username, password, phone):
-        c = self.conn.cursor()
-        insert_user_query = r"""INSERT INTO users (username, password, phone) VALUES (?, ?, ?)"""
-        c.execute(insert_user_query, (username, password, phone))
-        self.conn.commit()
+        with self.storage.transaction():
+            self.storage.create_user(username, phone, password, None, None)
 
     # 插入房间信息
     def insert_room(self, busy, ac_on, user_id, start_time, temperature, fan_speed, mode):
-        c = self.conn.cursor()
-        insert_room_query = r"""
-        INSERT INTO rooms (busy, ac_on, user_id, start_time, temperature, fan_speed, mode)
-        VALUES (?, ?, ?, ?, ?, ?, ?)"""
-        c.execute(insert_room_query, (busy, ac_on, user_id, start_time, temperature, fan_speed, mode))
-        self.conn.commit()
+        with self.storage.transaction():
+            room_id = self.storage.insert_room(busy, ac_on, user_id, start_time, temperature, fan_speed, mode)
+            self._stage_room(room_id, RoomState(room_id, busy, ac_on, user_id, start_time, temperature, fan_speed, mode))
+            self._rooms_changed((room_id,))
+            if not busy:
+                self.allocator.push(room_id)
+                self.storage.on_rollback(lambda: self.allocator.discard(room_id))
 
     # 插入空调使用记录表
+    @timed
     def insert_ac_usage_record(self, user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost):
-        c = self.conn.cursor()
-        insert_ac_usage_record_query = r"""
-        INSERT INTO ac_usage_record
-        (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
-        c.execute(insert_ac_usage_record_query,
-                  (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost))
-        self.conn.commit()
+        # 同一事务中累加本次入住的费用
+        with self.storage.transaction():
+            self.storage.close_segments([(user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)])
 
     # 插入房间占用信息
     # def insert_room_occupation(self, room_id, user_id):
@@ -400,33 +691,42 @@ class Manager:
     '''
 
     def _create_tables(self):
-        c = self.conn.cursor()
-        c.execute(create_user_table_query)
-        c.execute(create_room_table_query)
-        c.execute(create_ac_usage_record_table_query)
-        # c.execute(create_ac_status_table_query)
-        c.execute(create_user_record_query)
-        self.conn.commit()
+        self.storage.migrate()
 
     def add_rooms(self, count):
-        for i in range(count):
-            self.insert_room(0, 0, -1, "", default_ac_setting.temperature, default_ac_setting.fan_speed,
-                             default_ac_setting.mode)
+        # 在现有最大房间号之后追加
+        with self.storage.transaction():
+            first_id = self.storage.max_room_id() + 1
+            return self.provision(generate_room_specs(count, first_id, self.allocator.rooms_per_floor))
+
+    def provision(self, specs):
+        """按房间定义批量创建房间并加入内存状态，已存在的房间号跳过，返回新建的房间数"""
+        with self.storage.transaction():
+            inserted = self.storage.provision_rooms(specs)
+            for room_id, floor, room_type, temperature, fan_speed, mode in inserted:
+                self._stage_room(room_id, RoomState(room_id, 0, 0, -1, None, temperature, fan_speed, mode, floor,
+                                                    room_type))
+                self.allocator.push(room_id, floor)
+            self.storage.on_rollback(lambda: self._forget_rooms([spec[0] for spec in inserted]))
+            self._rooms_changed([spec[0] for spec in inserted])
+            return len(inserted)
+
+    def _forget_rooms(self, room_ids):
+        for room_id in room_ids:
+            self.allocator.discard(room_id)
 
     def init_rooms(self):
-        # check if the room count is under the minimum
-        c = self.conn.cursor()
-        query = "SELECT COUNT(*) FROM rooms"
-        c.execute(query)
-        room_count = c.fetchone()[0]
-        if room_count < MIN_ROOM_COUNT:
-            self.add_rooms(MIN_ROOM_COUNT - room_count)
+        # 只写存储，随后由 __init__ 整体加载到内存
+        if self.rooms_config is not None:
+            specs = load_room_specs(self.rooms_config, self.allocator.rooms_per_floor)
+        else:
+            specs = generate_room_specs(self.room_count, self.first_room, self.allocator.rooms_per_floor)
+        with self.storage.transaction():
+            return len(self.storage.provision_rooms(specs))
 
+    @timed
     def get_user_id_by_name(self, username):
-        c = self.conn.cursor()
-        query = "SELECT id FROM users WHERE username = ?"
-        c.execute(query, (username,))
-        user_id = c.fetchone()
+        user_id = self.storage.get_user_id(username)
         if user_id is None:
             return -1
-        return user_id[0]
+        return user_id
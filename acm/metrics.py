@@ -0,0 +1,177 @@
+"""
+运行指标与结构化日志。
+
+指标保存在进程内，由 /metrics 以 Prometheus 文本格式输出，p99 等分位数由 Prometheus 按桶计算。
+日志统一使用 "acm" 下的 logger，log_event 在对应级别未开启时直接返回，不做任何格式化。
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('acm')
+
+# 秒，覆盖从内存读取到 bcrypt 校验的范围
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = [*zip(labelnames, labelvalues), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """累计分桶的直方图，每组标签各有一份计数"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（未累计，最后一个为 +Inf）, 总和, 次数]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labelvalues):
+        series = self._series.get(labelvalues)
+        return series[2] if series else 0
+
+    def quantile(self, q, *labelvalues):
+        """按桶的上界估计分位数，只用于调试和基准测试"""
+        series = self._series.get(labelvalues)
+        if not series or not series[2]:
+            return None
+        target = q * series[2]
+        seen = 0
+        for bound, count in zip((*self.buckets, float('inf')), series[0]):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labelvalues, (list(counts), total, count))
+                            for labelvalues, (counts, total, count) in self._series.items())
+        for labelvalues, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float('inf')), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'acm_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status')))
+MANAGER_LATENCY = REGISTRY.register(Histogram(
+    'acm_manager_call_duration_seconds', 'Manager method latency', ('method',)))
+MANAGER_ERRORS = REGISTRY.register(Counter(
+    'acm_manager_errors_total', 'Manager method calls that raised', ('method',)))
+SQL_LATENCY = REGISTRY.register(Histogram(
+    'acm_sql_statement_duration_seconds', 'SQL statement latency by statement type', ('statement',)))
+WRITE_BATCH_SIZE = REGISTRY.register(Histogram(
+    'acm_write_batch_size', 'Operations per group commit', (), (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)))
+
+
+def timed(fn):
+    """记录被装饰方法每次调用的耗时，按方法名分组"""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            MANAGER_ERRORS.inc(name)
+            raise
+        finally:
+            MANAGER_LATENCY.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_kind(sql):
+    """SQL 语句的第一个关键字，作为低基数的标签"""
+    words = sql.split(None, 1)
+    return words[0].upper() if words else ""
+
+
+def log_event(level, event, **fields):
+    """
+    输出一行 logfmt 格式的日志：event key=value ...
+    对应级别未开启时只做一次 isEnabledFor 判断。
+    """
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(level, "%s %s", event, " ".join(f"{key}={value!r}" for key, value in fields.items()))
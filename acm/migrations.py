@@ -0,0 +1,157 @@
+"""
+数据库结构版本管理。
+
+当前版本号保存在 ``PRAGMA user_version`` 中，每个迁移只会执行一次，
+已有的 acm.db 会在启动时按顺序原地升级。
+"""
+from functools import partial
+
+from .sql_queries import *
+from .events import seed_events
+from .rollups import refresh_rollups
+from .stays import rebuild_stay_totals
+
+def _to_epoch_ms(column):
+    # 旧数据为 datetime('now') 生成的 UTC 时间字符串，空字符串表示没有时间
+    return (f"CASE WHEN {column} IS NULL OR {column} = '' THEN NULL "
+            f"ELSE CAST(ROUND((julianday({column}) - 2440587.5) * 86400000) AS INTEGER) END")
+
+
+def _rebuild_table(c, table, create_query, columns, converted):
+    """按 SQLite 推荐的方式修改列类型：建新表、拷贝数据、删除旧表、改名"""
+    c.execute(create_query.format(table=f"{table}_new"))
+    select_list = ", ".join(_to_epoch_ms(column) if column in converted else column for column in columns)
+    column_list = ", ".join(columns)
+    c.execute(f"INSERT INTO {table}_new ({column_list}) SELECT {select_list} FROM {table}")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def _epoch_time_columns(c):
+    _rebuild_table(c, "rooms", epoch_room_table_query,
+                   ("id", "busy", "ac_on", "user_id", "start_time", "temperature", "fan_speed", "mode"),
+                   ("start_time",))
+    _rebuild_table(c, "ac_usage_record", epoch_ac_usage_record_table_query,
+                   ("id", "user_id", "room_id", "start_time", "end_time", "temperature", "fan_speed", "mode", "cost"),
+                   ("start_time", "end_time"))
+    _rebuild_table(c, "user_record", epoch_user_record_table_query,
+                   ("user_id", "in_time", "out_time"), ("in_time", "out_time"))
+
+
+# (版本号, 步骤列表)，步骤可以是 SQL 字符串，也可以是接收 cursor 的函数
+MIGRATIONS = [
+    # 1: 初始表结构，老数据库中这些表已经存在
+    (1, [
+        create_user_table_query,
+        create_room_table_query,
+        create_ac_usage_record_table_query,
+        create_user_record_query,
+    ]),
+    # 2: 热点查询的二级索引。这里不收集统计信息，迁移时表还很小，得到的统计信息很快就过时了，
+    # 统计信息由维护任务和关闭连接时的 PRAGMA optimize 更新
+    (2, [
+        create_ac_usage_record_user_index_query,
+        create_ac_usage_record_room_index_query,
+        create_room_user_index_query,
+        create_room_busy_index_query,
+        create_user_name_index_query,
+    ]),
+    # 3: 时间列改为整数毫秒时间戳，重建表后索引需要重新创建
+    (3, [
+        _epoch_time_columns,
+        create_ac_usage_record_user_index_query,
+        create_ac_usage_record_room_index_query,
+        create_room_user_index_query,
+        create_room_busy_index_query,
+    ]),
+    # 4: 每次入住的累计费用，按当前在住的客人回填；这时还没有归档表
+    (4, [
+        create_stay_totals_table_query,
+        partial(rebuild_stay_totals, table='ac_usage_record'),
+    ]),
+    # 5: 使用记录的汇总表，按已有的全部记录回填
+    (5, [
+        create_usage_rollup_table_query,
+        create_usage_rollup_day_index_query,
+        create_rollup_state_table_query,
+        refresh_rollups,
+    ]),
+    # 6: 房间的楼层和房型
+    (6, [
+        add_room_floor_column_query,
+        add_room_type_column_query,
+        backfill_room_floor_query,
+    ]),
+    # 7: 空调事件日志，按当前的入住和空调状态补上初始事件
+    (7, [
+        create_ac_events_table_query,
+        seed_events,
+    ]),
+    # 8: 合并进当前使用时段的设置修改带来的费用差额
+    (8, [
+        add_room_cost_offset_column_query,
+    ]),
+    # 9: 使用记录的归档表和包括归档在内的全部记录的视图
+    (9, [
+        create_ac_usage_archive_table_query,
+        create_ac_usage_archive_user_index_query,
+        create_ac_usage_archive_room_index_query,
+        create_ac_usage_history_view_query,
+        add_stay_archived_column_query,
+        create_stay_archive_index_query,
+    ]),
+    # 10: 每位客人最多占用一个房间；已有数据中同一位客人占用多个房间时迁移失败，需要先退掉多余的房间
+    (10, [
+        create_room_occupant_index_query,
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _enable_incremental_vacuum(conn):
+    # auto_vacuum 只能在建表之前修改，修改后需要 VACUUM 才生效，空库的 VACUUM 不需要时间；
+    # 已有数据的旧库不在这里处理，需要执行一次 python -m acm maintenance vacuum
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+def migrate(conn):
+    """将数据库升级到 SCHEMA_VERSION，返回本次执行的版本号列表"""
+    applied = []
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return applied
+    if get_schema_version(conn) == 0:
+        _enable_incremental_vacuum(conn)
+    for version, steps in MIGRATIONS:
+        c = conn.cursor()
+        # 加写锁后重新读取版本号，避免多个进程重复执行同一迁移
+        c.execute("BEGIN IMMEDIATE")
+        if get_schema_version(conn) >= version:
+            conn.rollback()
+            continue
+        try:
+            for step in steps:
+                if callable(step):
+                    step(c)
+                else:
+                    c.execute(step)
+            # PRAGMA 不支持参数绑定
+            c.execute(f"PRAGMA user_version = {int(version)}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+def query_plan_scans(conn, query, params=()):
+    """返回查询计划中全表扫描的步骤，为空说明查询全部走索引"""
+    rows = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+    return [row[-1] for row in rows if row[-1].startswith("SCAN") and row[-1] != "SCAN CONSTANT ROW"]
@@ -0,0 +1,142 @@
+"""
+房间状态的变更推送。
+
+入住、退房、开关空调、修改设置以及送风调度都会修改房间状态。Manager 在事务中记下修改过的房间，
+最外层事务提交后把这些房间的最新状态作为一条变更发布到 ChangeBus，回滚的修改不会发布；
+AsyncManager 一批操作共用一个事务，所以整批只发布一次。
+
+订阅者在事件循环中消费，每个订阅者有一个有界队列。发布在写线程中进行，只把变更交给各个事件循环，
+不等待订阅者；某个订阅者的队列满了就断开它，慢的客户端不会拖慢写入，也不会占用无限的内存，
+客户端重新连接后从新的快照开始。
+
+变更按发布顺序编号（seq）。快照带有取快照时最后一条变更的编号，快照之后只需应用编号更大的变更；
+每条变更都是房间的完整状态，重复应用结果相同。
+"""
+import asyncio
+import threading
+
+
+class Subscription:
+    """一个订阅者，在订阅时所在的事件循环中用 get() 逐条读取 (seq, changes)"""
+
+    def __init__(self, bus, loop, queue_size):
+        self.bus = bus
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+        # 跟不上或者变更无法发布时被断开，需要重新取快照
+        self.dropped = False
+
+    def _offer(self, message):
+        # 在订阅者的事件循环中执行
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._drop()
+
+    def _drop(self):
+        # 在订阅者的事件循环中执行，丢弃积压的变更，只留下结束标记
+        if self.dropped:
+            return
+        self.dropped = True
+        self.bus.unsubscribe(self)
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self, timeout=None):
+        """下一条变更，被断开后返回 None，timeout 秒内没有变更时抛出 asyncio.TimeoutError"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class ChangeBus:
+    """
+    变更的发布和订阅，publish 可以在任意线程中调用，subscribe 需要在事件循环中调用。
+    每个订阅者最多积压 queue_size 条变更。
+    """
+
+    def __init__(self, queue_size=256):
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        self.queue_size = queue_size
+        # 最后一条变更的编号
+        self.seq = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """有订阅者时才需要生成变更"""
+        return bool(self._subscribers)
+
+    def subscribe(self):
+        subscription = Subscription(self, asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, changes):
+        """发布一条变更，changes 为修改过的房间的状态列表，返回这条变更的编号"""
+        with self._lock:
+            self.seq += 1
+            message = (self.seq, changes)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, message)
+            except RuntimeError:
+                # 订阅者的事件循环已经关闭
+                self.unsubscribe(subscription)
+        return message[0]
+
+    def disconnect_all(self):
+        """断开全部订阅者，变更无法发布时让它们重新取快照"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._subscribers.clear()
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._drop)
+            except RuntimeError:
+                pass
+
+
+class RoomChanges:
+    """
+    事务中修改过的房间号。与 EventLog 一样先保存在当前线程的缓冲区中，
+    最外层事务提交后交给 publish 一次发布。
+    """
+
+    def __init__(self, storage, publish):
+        self.storage = storage
+        self.publish = publish
+        self._local = threading.local()
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def add(self, room_ids):
+        pending = self._pending()
+        count = len(pending)
+        pending.extend(room_ids)
+        self.storage.after_commit(self.flush)
+        # 回滚时丢弃本次记下的房间，嵌套事务只丢弃内层的
+        self.storage.on_rollback(lambda: pending.__delitem__(slice(count, None)))
+
+    def flush(self):
+        pending = self._pending()
+        if pending:
+            room_ids = list(dict.fromkeys(pending))
+            pending.clear()
+            self.publish(room_ids)
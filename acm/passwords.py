@@ -0,0 +1,56 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HasherBusy(Exception):
+    """排队的哈希任务已达上限"""
+
+
+class PasswordHasher:
+    """
+    bcrypt 哈希计算池。
+
+    bcrypt 计算期间会释放 GIL，所以使用专用线程池即可利用多核，也不会阻塞事件循环。
+    rounds 为 bcrypt 工作因子，max_workers 为并发度，
+    max_pending 为等待中的任务上限，超过时 submit 直接抛出 HasherBusy。
+    """
+
+    def __init__(self, rounds=12, max_workers=None, max_pending=64):
+        self.rounds = rounds
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='acm-bcrypt')
+        self._slots = threading.BoundedSemaphore(self.max_workers + max_pending)
+
+    def hash(self, password):
+        # bcrypt 在第一次使用时才导入，导入 acm 不需要加载它
+        import bcrypt
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+        return hashed_password.decode('utf-8'), salt.decode('utf-8')
+
+    def check(self, password, hashed_password):
+        import bcrypt
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def hash_async(self, password):
+        return await asyncio.wrap_future(self.submit(self.hash, password))
+
+    async def check_async(self, password, hashed_password):
+        return await asyncio.wrap_future(self.submit(self.check, password, hashed_password))
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,57 @@
+"""
+计价引擎。
+
+时间统一使用毫秒时间戳，风速和模式先转换为整数编码，
+单段计价不做任何字符串解析，批量计价对整列数据做一次 NumPy 运算。
+NumPy 在第一次批量计价时才导入。
+"""
+# 每小时基础价格
+BASE_RATE = 10
+# 温度以 26 度为基准，每相差一度加收 2%
+BASE_TEMPERATURE = 26
+TEMPERATURE_RATE = 0.02
+MS_PER_HOUR = 3600 * 1000
+
+FAN_SPEEDS = ("low", "mid", "high")
+FAN_SPEED_FACTORS = (1.0, 1.2, 1.5)
+MODES = ("cool", "heat")
+MODE_FACTORS = (1.0, 1.2)
+
+_fan_speed_codes = {name: code for code, name in enumerate(FAN_SPEEDS)}
+_mode_codes = {name: code for code, name in enumerate(MODES)}
+
+
+def fan_speed_code(fan_speed):
+    try:
+        return _fan_speed_codes[fan_speed.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown fan speed: {fan_speed}") from None
+
+
+def mode_code(mode):
+    try:
+        return _mode_codes[mode.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown mode: {mode}") from None
+
+
+def segment_cost(start_ms, end_ms, temperature, fan_code, mode_code):
+    """单段计价"""
+    hours = (end_ms - start_ms) / MS_PER_HOUR
+    return (BASE_RATE * hours * (abs(temperature - BASE_TEMPERATURE) * TEMPERATURE_RATE + 1)
+            * FAN_SPEED_FACTORS[fan_code] * MODE_FACTORS[mode_code])
+
+
+def price_segment(start_ms, end_ms, temperature, fan_speed, mode):
+    """按 Settings 中的字符串计价"""
+    return segment_cost(start_ms, end_ms, temperature, fan_speed_code(fan_speed), mode_code(mode))
+
+
+def batch_costs(start_ms, end_ms, temperatures, fan_codes, mode_codes):
+    """批量计价，参数为等长的数组，返回每一段的费用"""
+    import numpy as np
+    hours = (np.asarray(end_ms, dtype=np.float64) - np.asarray(start_ms, dtype=np.float64)) / MS_PER_HOUR
+    temperature_factor = np.abs(np.asarray(temperatures, dtype=np.float64) - BASE_TEMPERATURE) * TEMPERATURE_RATE + 1
+    return (BASE_RATE * hours * temperature_factor
+            * np.asarray(FAN_SPEED_FACTORS)[np.asarray(fan_codes, dtype=np.intp)]
+            * np.asarray(MODE_FACTORS)[np.asarray(mode_codes, dtype=np.intp)])
@@ -0,0 +1,62 @@
+"""
+批量创建房间。
+
+房间定义为 (id, floor, room_type, temperature, fan_speed, mode)，可以按数量生成，
+也可以从 CSV 或 JSON 文件读取。已存在的房间号会被跳过，重复执行不会产生新的房间，
+全部插入在调用方的同一个事务中用 executemany 完成。
+"""
+import csv
+import json
+
+from .values import default_ac_setting
+
+ROOM_SPEC_FIELDS = ('id', 'floor', 'room_type', 'temperature', 'fan_speed', 'mode')
+
+
+def room_spec(id, floor=None, room_type='standard', temperature=None, fan_speed=None, mode=None,
+              rooms_per_floor=100):
+    """补全缺省值，楼层缺省时按每层 rooms_per_floor 间推算"""
+    id = int(id)
+    return (id,
+            int(floor) if floor not in (None, '') else (id - 1) // rooms_per_floor + 1,
+            room_type or 'standard',
+            int(temperature) if temperature not in (None, '') else default_ac_setting.temperature,
+            fan_speed or default_ac_setting.fan_speed,
+            mode or default_ac_setting.mode)
+
+
+def generate_room_specs(count, first_id=1, rooms_per_floor=100, room_type='standard'):
+    return [room_spec(room_id, room_type=room_type, rooms_per_floor=rooms_per_floor)
+            for room_id in range(first_id, first_id + count)]
+
+
+def load_room_specs(path, rooms_per_floor=100):
+    """
+    读取房间定义文件。
+    CSV 第一行为表头，列名取自 ROOM_SPEC_FIELDS，只有 id 是必需的；
+    JSON 为对象列表，或者带 "rooms" 列表的对象，对象的键与 CSV 列名相同。
+    """
+    with open(path, newline='') as f:
+        if path.endswith('.json'):
+            data = json.load(f)
+            rows = data['rooms'] if isinstance(data, dict) else data
+        else:
+            rows = list(csv.DictReader(f))
+    specs = []
+    for row in rows:
+        unknown = set(row) - set(ROOM_SPEC_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown room fields in {path}: {', '.join(sorted(unknown))}")
+        specs.append(room_spec(rooms_per_floor=rooms_per_floor, **row))
+    return specs
+
+
+def provision_rooms(c, specs):
+    """插入 rooms 表中还没有的房间，返回新插入的房间定义，需要在写事务中调用"""
+    c.execute("SELECT id FROM rooms")
+    existing = {row[0] for row in c.fetchall()}
+    missing = [spec for spec in specs if spec[0] not in existing]
+    c.executemany(r"""
+    INSERT OR IGNORE INTO rooms (id, busy, ac_on, user_id, start_time, floor, room_type, temperature, fan_speed, mode)
+    VALUES (?, 0, 0, -1, NULL, ?, ?, ?, ?, ?)""", missing)
+    return missing
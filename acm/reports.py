@@ -0,0 +1,49 @@
+"""
+空调使用记录的分页查询，Manager 和跨分片读取共用。
+"""
+from .data import Settings
+from .utils import format_time
+
+REPORT_COLUMNS = ('id', 'user_id', 'room_id', 'start_time', 'end_time', 'temperature', 'fan_speed', 'mode', 'cost')
+
+# 热表 ac_usage_record 与归档表 ac_usage_archive 的 UNION ALL，见 maintenance
+USAGE_HISTORY = 'ac_usage_history'
+
+
+def report_fields(record):
+    """select_report_rows 返回的一行转换为 ReportItem 的字段"""
+    record_id, user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost = record
+    return {'id': record_id, 'room_id': room_id, 'user_id': user_id, 'start_time': format_time(start_time),
+            'end_time': format_time(end_time), 'cost': cost,
+            'settings': Settings(temperature=temperature, fan_speed=fan_speed, mode=mode)}
+
+
+def select_report_rows(c, after_id=0, limit=None, start_time=None, end_time=None, room_id=None, user_id=None):
+    """
+    按 id 分页查询空调使用记录（包括已归档的），返回原始的行。
+    after_id 为上一页最后一条记录的 id，时间范围按记录的开始时间过滤，左闭右开。
+    """
+    conditions = ["id > ?"]
+    values = [after_id]
+    if start_time is not None:
+        conditions.append("start_time >= ?")
+        values.append(start_time)
+    if end_time is not None:
+        conditions.append("start_time < ?")
+        values.append(end_time)
+    if room_id is not None:
+        conditions.append("room_id = ?")
+        values.append(room_id)
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        values.append(user_id)
+    query = f"""
+    SELECT {', '.join(REPORT_COLUMNS)}
+    FROM {USAGE_HISTORY}
+    WHERE {' AND '.join(conditions)}
+    ORDER BY id"""
+    if limit is not None:
+        query += " LIMIT ?"
+        values.append(limit)
+    c.execute(query, values)
+    return c.fetchall()
@@ -0,0 +1,135 @@
+"""
+空调使用记录的汇总表（usage_rollup）。
+
+汇总表按 rollup_state 中记录的高水位增量更新，每次只读取 id 更大的新记录。
+使用记录只在写事务中插入，AUTOINCREMENT 保证 id 递增，
+所以在写事务中刷新时不会漏掉尚未提交的较小 id。
+新记录总是写入热表，增量刷新只读 ac_usage_record；重建和校验读包括归档在内的全部记录。
+"""
+from .data import UsageSummaryItem
+from .reports import USAGE_HISTORY
+from .utils import format_time
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+ROLLUP_NAME = 'usage_rollup'
+
+# 分组方式 -> [(结果中的字段名, 分组表达式)]
+# 1970-01-01 是星期四，加 3 后按 7 整除得到以星期一开始的周
+SUMMARY_GROUPS = {
+    'room': [('room_id', 'room_id')],
+    'day': [('day', 'day')],
+    'week': [('day', '(day + 3) / 7 * 7 - 3')],
+    'setting': [('mode', 'mode'), ('fan_speed', 'fan_speed')],
+}
+
+# 与 SUMMARY_GROUPS 相同的分组方式，供不使用 SQL 的存储引擎计算分组键
+# 参数为汇总表的 (room_id, day, mode, fan_speed)
+SUMMARY_KEYS = {
+    'room': lambda room_id, day, mode, fan_speed: (room_id,),
+    'day': lambda room_id, day, mode, fan_speed: (day,),
+    'week': lambda room_id, day, mode, fan_speed: ((day + 3) // 7 * 7 - 3,),
+    'setting': lambda room_id, day, mode, fan_speed: (mode, fan_speed),
+}
+
+
+def refresh_rollups(c, table='ac_usage_record'):
+    """把高水位之后的新记录计入汇总表，返回新计入的记录数，需要在写事务中调用"""
+    c.execute("SELECT last_id FROM rollup_state WHERE name = ?", (ROLLUP_NAME,))
+    row = c.fetchone()
+    last_id = row[0] if row else 0
+    c.execute(f"SELECT MAX(id), COUNT(*) FROM {table} WHERE id > ?", (last_id,))
+    max_id, count = c.fetchone()
+    if not count:
+        return 0
+    # WHERE 子句不可省略，否则 ON CONFLICT 会被解析为 JOIN 的一部分
+    c.execute(f"""
+    INSERT INTO usage_rollup (room_id, day, mode, fan_speed, cost, runtime_ms, segments)
+    SELECT room_id, start_time / ?, mode, fan_speed, SUM(cost), SUM(end_time - start_time), COUNT(*)
+    FROM {table}
+    WHERE id > ? AND id <= ?
+    GROUP BY room_id, start_time / ?, mode, fan_speed
+    ON CONFLICT(room_id, day, mode, fan_speed) DO UPDATE SET
+        cost = cost + excluded.cost,
+        runtime_ms = runtime_ms + excluded.runtime_ms,
+        segments = segments + excluded.segments""", (MS_PER_DAY, last_id, max_id, MS_PER_DAY))
+    c.execute(r"""
+    INSERT INTO rollup_state (name, last_id) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id""", (ROLLUP_NAME, max_id))
+    return count
+
+
+def rebuild_rollups(c):
+    """清空汇总表后从全部记录重新计算"""
+    c.execute("DELETE FROM usage_rollup")
+    c.execute("DELETE FROM rollup_state WHERE name = ?", (ROLLUP_NAME,))
+    return refresh_rollups(c, USAGE_HISTORY)
+
+
+def summary_rows(c, group='day', start_day=None, end_day=None, room_id=None, pending=False):
+    """
+    按 SUMMARY_GROUPS 中的方式分组汇总，日期范围左闭右开。
+    返回 (分组键..., 费用, 运行毫秒数, 段数)，行数只与房间数、天数和设置种类有关。
+    pending 为 True 时在同一条查询中加上高水位之后还没有计入汇总表的记录，不需要写事务，
+    用于读取其他进程拥有的数据库
+    """
+    keys = [expression for _, expression in SUMMARY_GROUPS[group]]
+    conditions = []
+    values = []
+    if start_day is not None:
+        conditions.append("day >= ?")
+        values.append(start_day)
+    if end_day is not None:
+        conditions.append("day < ?")
+        values.append(end_day)
+    if room_id is not None:
+        conditions.append("room_id = ?")
+        values.append(room_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    source = "usage_rollup"
+    if pending:
+        source = f"""(
+        SELECT room_id, day, mode, fan_speed, cost, runtime_ms, segments FROM usage_rollup
+        UNION ALL
+        SELECT room_id, start_time / {MS_PER_DAY}, mode, fan_speed, cost, end_time - start_time, 1
+        FROM ac_usage_record
+        WHERE id > (SELECT COALESCE(MAX(last_id), 0) FROM rollup_state WHERE name = '{ROLLUP_NAME}'))"""
+    c.execute(f"""
+    SELECT {', '.join(keys)}, SUM(cost), SUM(runtime_ms), SUM(segments)
+    FROM {source}
+    {where}
+    GROUP BY {', '.join(keys)}
+    ORDER BY {', '.join(keys)}""", values)
+    return c.fetchall()
+
+
+def summary_items(group, rows):
+    """把 summary_rows 的结果转换为 UsageSummaryItem"""
+    keys = [name for name, _ in SUMMARY_GROUPS[group]]
+    items = []
+    for row in rows:
+        fields = dict(zip(keys, row))
+        if 'day' in fields:
+            fields['day'] = format_time(fields['day'] * MS_PER_DAY)[:10]
+        cost, runtime_ms, segments = row[len(keys):]
+        items.append(UsageSummaryItem(cost=cost, runtime_hours=runtime_ms / 3600000, segments=segments, **fields))
+    return items
+
+
+def verify_rollups(c, tolerance=1e-6):
+    """与高水位之前的原始记录比较，返回不一致的 (room_id, day, mode, fan_speed)"""
+    c.execute("SELECT COALESCE(MAX(last_id), 0) FROM rollup_state WHERE name = ?", (ROLLUP_NAME,))
+    last_id = c.fetchone()[0]
+    c.execute(f"""
+    SELECT room_id, start_time / ?, mode, fan_speed, SUM(cost), SUM(end_time - start_time), COUNT(*)
+    FROM {USAGE_HISTORY} WHERE id <= ?
+    GROUP BY room_id, start_time / ?, mode, fan_speed""", (MS_PER_DAY, last_id, MS_PER_DAY))
+    expected = {row[:4]: row[4:] for row in c.fetchall()}
+    c.execute("SELECT room_id, day, mode, fan_speed, cost, runtime_ms, segments FROM usage_rollup")
+    actual = {row[:4]: row[4:] for row in c.fetchall()}
+    mismatched = []
+    for key in expected.keys() | actual.keys():
+        a, b = expected.get(key), actual.get(key)
+        if a is None or b is None or abs(a[0] - b[0]) > tolerance or a[1:] != b[1:]:
+            mismatched.append(key)
+    return sorted(mismatched)
@@ -0,0 +1,153 @@
+import threading
+
+from .data import Settings
+
+# rooms.ac_on 的取值，0 为关闭，1 为正在送风（有打开的使用时段）；
+# 启用送风调度时，已开启但在排队或被抢占的房间为 AC_WAITING，start_time 为开始等待的时刻
+AC_WAITING = 2
+
+ROOM_COLUMNS = ('id', 'busy', 'ac_on', 'user_id', 'start_time', 'temperature', 'fan_speed', 'mode', 'floor', 'room_type',
+                'cost_offset')
+
+
+class RoomState:
+    """
+    一个房间的状态快照，字段与 rooms 表一一对应。
+    快照创建后不再修改，更新时整体替换，读线程总能拿到一致的状态。
+    cost_offset 是合并进当前使用时段的设置修改带来的费用差额，
+    时段的费用为按当前设置从 start_time 计价再加上这个差额。
+    """
+    __slots__ = ROOM_COLUMNS
+
+    def __init__(self, id, busy, ac_on, user_id, start_time, temperature, fan_speed, mode, floor=None,
+                 room_type='standard', cost_offset=0.0):
+        self.id = id
+        self.busy = busy
+        self.ac_on = ac_on
+        self.user_id = user_id
+        self.start_time = start_time
+        self.temperature = temperature
+        self.fan_speed = fan_speed
+        self.mode = mode
+        self.floor = floor
+        self.room_type = room_type
+        self.cost_offset = cost_offset
+
+    def replace(self, **fields):
+        values = {name: getattr(self, name) for name in ROOM_COLUMNS}
+        values.update(fields)
+        return RoomState(**values)
+
+    def as_row(self):
+        return tuple(getattr(self, name) for name in ROOM_COLUMNS)
+
+    @property
+    def settings(self):
+        return Settings(temperature=self.temperature, fan_speed=self.fan_speed, mode=self.mode)
+
+
+class RoomStore:
+    """
+    内存中的房间状态，启动时从存储中整体加载。
+    所有读操作都从这里返回，写操作由 Manager 先写存储再更新这里。
+
+    事务中的修改用 stage 暂存在当前线程，只有这个线程能看到，事务提交后由 commit_staged 一次应用，
+    回滚时由 discard_staged 丢弃；其他线程（AsyncManager 的读线程）只会读到已提交的状态。
+    """
+
+    def __init__(self):
+        self._rooms = {}
+        # user_id -> room_id，只记录有人入住的房间
+        self._by_user = {}
+        self._local = threading.local()
+
+    def load(self, rooms):
+        self._rooms = {}
+        self._by_user = {}
+        for room in rooms:
+            self.put(room)
+
+    def _staged(self):
+        # room_id -> 暂存的状态，None 表示删除；当前线程没有暂存的修改时为 None
+        return getattr(self._local, 'rooms', None)
+
+    def get(self, room_id):
+        staged = self._staged()
+        if staged is not None and room_id in staged:
+            return staged[room_id]
+        return self._rooms.get(room_id)
+
+    def by_user(self, user_id):
+        staged = self._staged()
+        if staged is not None and user_id in self._local.by_user:
+            room_id = self._local.by_user[user_id]
+        else:
+            room_id = self._by_user.get(user_id)
+        if room_id is None:
+            return None
+        return self.get(room_id)
+
+    @property
+    def staging(self):
+        """当前线程是否有还没提交的修改"""
+        return self._staged() is not None
+
+    def stage(self, room_id, room):
+        """暂存一个房间的新状态，room 为 None 时删除，返回原来的状态"""
+        if self._staged() is None:
+            self._local.rooms = {}
+            # user_id -> room_id，None 表示退房
+            self._local.by_user = {}
+        old = self.get(room_id)
+        if old is not None and old.busy and self.by_user(old.user_id) is old:
+            self._local.by_user[old.user_id] = None
+        self._local.rooms[room_id] = room
+        if room is not None and room.busy:
+            self._local.by_user[room.user_id] = room_id
+        return old
+
+    def commit_staged(self):
+        """把当前线程暂存的修改应用到已提交的状态"""
+        staged = self._staged()
+        self.discard_staged()
+        for room_id, room in (staged or {}).items():
+            if room is None:
+                self.remove(room_id)
+            else:
+                self.put(room)
+
+    def discard_staged(self):
+        self._local.rooms = None
+        self._local.by_user = None
+
+    def put(self, room):
+        old = self._rooms.get(room.id)
+        if old is not None and old.busy and self._by_user.get(old.user_id) == old.id:
+            del self._by_user[old.user_id]
+        self._rooms[room.id] = room
+        if room.busy:
+            self._by_user[room.user_id] = room.id
+        return old
+
+    def remove(self, room_id):
+        room = self._rooms.pop(room_id, None)
+        if room is not None and room.busy and self._by_user.get(room.user_id) == room_id:
+            del self._by_user[room.user_id]
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def __iter__(self):
+        staged = self._staged()
+        if staged is None:
+            return iter(list(self._rooms.values()))
+        rooms = {**self._rooms, **staged}
+        return iter([room for room in rooms.values() if room is not None])
+
+    def verify(self, rooms):
+        """与存储中的房间逐个比较，返回不一致的房间号"""
+        rows = {room.id: room.as_row() for room in rooms}
+        mismatched = [room_id for room_id, row in rows.items()
+                      if room_id not in self._rooms or self._rooms[room_id].as_row() != row]
+        mismatched.extend(room_id for room_id in self._rooms if room_id not in rows)
+        return sorted(mismatched)
@@ -0,0 +1,176 @@
+"""
+中央空调的送风调度。
+
+中央空调同时只能为 capacity 个房间送风。开启空调或修改设置相当于提出送风请求：
+有空闲的服务位时立即送风，否则按优先级排队。优先级由风速决定（高 > 中 > 低），
+同一优先级按开始等待的先后；排队的请求优先级高于正在送风的最低优先级房间时，立即抢占该房间；
+优先级相同时按时间片轮转，送风超过 time_slice_ms 的房间让给等待最久的请求。
+
+只有送风的时间计费：Manager 在开始送风时打开使用时段，被抢占时结束时段。
+排队和被抢占的房间 rooms.ac_on 为 AC_WAITING，start_time 为开始等待的时刻，重启后按此恢复队列。
+
+ServiceScheduler 只维护内存中的队列并给出调度决定，不读写存储。正在送风和正在等待的请求
+各放在一个堆中，每次调度是几次堆操作，O(log n)；被替换或移除的条目只从字典中删去，出堆时跳过。
+"""
+import asyncio
+import heapq
+import itertools
+
+from .pricing import fan_speed_code
+from .rooms import AC_WAITING
+
+
+class ServiceScheduler:
+    """
+    送风调度队列。request、release、tick 返回按顺序执行的调度决定 [(room_id, 是否送风)]，
+    由 Manager 在同一个事务中执行。
+    """
+
+    def __init__(self, capacity=3, time_slice_ms=120_000):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if time_slice_ms <= 0:
+            raise ValueError("time_slice_ms must be positive")
+        self.capacity = capacity
+        self.time_slice_ms = time_slice_ms
+        # room_id -> [优先级, 开始送风的时刻, 序号, room_id]，堆顶为优先级最低、送风最久的房间
+        self.serving = {}
+        # room_id -> [-优先级, 开始等待的时刻, 序号, room_id]，堆顶为优先级最高、等待最久的请求
+        self.waiting = {}
+        self._serving_heap = []
+        self._waiting_heap = []
+        self._seq = itertools.count()
+
+    @staticmethod
+    def priority(fan_speed):
+        return fan_speed_code(fan_speed)
+
+    def load(self, rooms):
+        """按房间状态恢复队列，送风和等待都从 start_time 起计时"""
+        self.serving = {}
+        self.waiting = {}
+        self._serving_heap = []
+        self._waiting_heap = []
+        for room in rooms:
+            if room.busy and room.ac_on == 1:
+                self._serve(room.id, self.priority(room.fan_speed), room.start_time)
+            elif room.busy and room.ac_on == AC_WAITING:
+                self._wait(room.id, self.priority(room.fan_speed), room.start_time)
+
+    def request(self, room_id, priority, now):
+        """开启空调或修改设置。正在送风的房间保留送风的起始时刻，正在等待的保留等待的起始时刻"""
+        entry = self.serving.get(room_id)
+        if entry is not None:
+            if entry[0] != priority:
+                self._serve(room_id, priority, entry[1])
+        else:
+            entry = self.waiting.get(room_id)
+            self._wait(room_id, priority, entry[1] if entry is not None else now)
+        return self._rebalance(now)
+
+    def release(self, room_id, now):
+        """关闭空调或退房，空出的服务位交给排在最前的请求"""
+        self.serving.pop(room_id, None)
+        self.waiting.pop(room_id, None)
+        return self._rebalance(now)
+
+    def tick(self, now):
+        """时间片到期的轮转，以及服务位数变化后的调整"""
+        return self._rebalance(now)
+
+    def next_deadline(self):
+        """下一次需要 tick 的时刻，没有可能轮转的请求时返回 None；会清理堆顶失效的条目，只能在写线程中调用"""
+        if not self.waiting or not self.serving:
+            return None
+        top = self._peek(self._waiting_heap, self.waiting)
+        low = self._peek(self._serving_heap, self.serving)
+        if -top[0] < low[0]:
+            return None
+        if -top[0] > low[0]:
+            return low[1]
+        return low[1] + self.time_slice_ms
+
+    def state(self, now):
+        """队列状态，送风的按优先级从高到低，等待的按出队顺序"""
+        serving = sorted(self.serving.values(), key=lambda entry: (-entry[0], entry[1], entry[2]))
+        waiting = sorted(self.waiting.values())
+        return {
+            'capacity': self.capacity,
+            'time_slice_ms': self.time_slice_ms,
+            'serving': [(entry[3], entry[0], entry[1], now - entry[1]) for entry in serving],
+            'waiting': [(entry[3], -entry[0], entry[1], now - entry[1]) for entry in waiting],
+        }
+
+    def snapshot(self):
+        """只包含当前队列的副本，只用于 state；条目不会被原地修改，复制字典即可交给其他线程读取"""
+        copy = ServiceScheduler(self.capacity, self.time_slice_ms)
+        copy.serving = dict(self.serving)
+        copy.waiting = dict(self.waiting)
+        return copy
+
+    def _rebalance(self, now):
+        decisions = []
+        # 空闲的服务位按队列顺序分配
+        while self.waiting and len(self.serving) < self.capacity:
+            entry = self._pop(self._waiting_heap, self.waiting)
+            self._serve(entry[3], -entry[0], now)
+            decisions.append((entry[3], True))
+        # 服务位减少后多出的房间转入等待
+        while len(self.serving) > self.capacity:
+            entry = self._pop(self._serving_heap, self.serving)
+            self._wait(entry[3], entry[0], now)
+            decisions.append((entry[3], False))
+        # 优先级抢占和同优先级的时间片轮转，每次交换一对
+        while self.waiting and self.serving:
+            top = self._peek(self._waiting_heap, self.waiting)
+            low = self._peek(self._serving_heap, self.serving)
+            priority = -top[0]
+            if priority < low[0] or priority == low[0] and now - low[1] < self.time_slice_ms:
+                break
+            self._pop(self._serving_heap, self.serving)
+            self._pop(self._waiting_heap, self.waiting)
+            self._wait(low[3], low[0], now)
+            self._serve(top[3], priority, now)
+            decisions.append((low[3], False))
+            decisions.append((top[3], True))
+        return decisions
+
+    def _serve(self, room_id, priority, since):
+        self.waiting.pop(room_id, None)
+        entry = [priority, since, next(self._seq), room_id]
+        self.serving[room_id] = entry
+        self._push(self._serving_heap, self.serving, entry)
+
+    def _wait(self, room_id, priority, since):
+        self.serving.pop(room_id, None)
+        entry = [-priority, since, next(self._seq), room_id]
+        self.waiting[room_id] = entry
+        self._push(self._waiting_heap, self.waiting, entry)
+
+    @staticmethod
+    def _push(heap, live, entry):
+        heapq.heappush(heap, entry)
+        if len(heap) > 2 * len(live) + 64:
+            # 失效的条目太多时重建，堆的大小与有效条目数成正比
+            heap[:] = live.values()
+            heapq.heapify(heap)
+
+    @staticmethod
+    def _peek(heap, live):
+        while live.get(heap[0][3]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    @classmethod
+    def _pop(cls, heap, live):
+        entry = cls._peek(heap, live)
+        heapq.heappop(heap)
+        del live[entry[3]]
+        return entry
+
+
+async def scheduler_loop(acm, interval_s=1.0):
+    """每隔 interval_s 秒通过写协程检查一次，有到期的时间片时执行 tick，直到被取消"""
+    while True:
+        await asyncio.sleep(interval_s)
+        await acm.tick_scheduler_if_due()
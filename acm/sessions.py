@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# users.role 的取值，大于等于 STAFF 的会话可以代客人操作、查看全楼的数据
+GUEST = 1
+STAFF = 2
+
+
+class Session:
+    __slots__ = ('user_id', 'role', 'room_id', 'expires_at')
+
+    def __init__(self, user_id, role, room_id, expires_at):
+        self.user_id = user_id
+        self.role = role
+        self.room_id = room_id
+        self.expires_at = expires_at
+
+
+class SessionStore:
+    """
+    登录会话。
+
+    令牌为 "user_id.role.过期时间.随机串.签名"，本身带有校验所需的全部信息，
+    任何持有同一个密钥的进程都能校验，不需要共享状态：分片部署时登录请求可以落在任意 worker 上。
+    密钥取自 ACM_SESSION_SECRET，没有设置时每个进程随机生成，只有签发令牌的进程能校验。
+
+    校验过的会话缓存在按访问顺序排列的 OrderedDict 中，超过 max_sessions 时淘汰最久未使用的。
+    缓存中的房间号在入住/退房时同步更新；缓存未命中时通过 room_of 查询，不访问用户表也不计算 bcrypt。
+    注销只在本进程生效，其他进程在令牌过期前仍然接受它。
+    """
+
+    def __init__(self, secret=None, ttl=3600, max_sessions=10000, room_of=None):
+        if secret is None:
+            secret = os.environ.get('ACM_SESSION_SECRET')
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+        self.secret = secret if secret else secrets.token_bytes(32)
+        # 令牌签发后的有效秒数
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # user_id -> 当前房间号，没有入住时为 -1
+        self.room_of = room_of if room_of is not None else (lambda user_id: -1)
+        self._sessions = OrderedDict()
+        # user_id -> 缓存中该用户的全部令牌，入住/退房时同步更新房间号
+        self._tokens_by_user = {}
+        # 本进程注销的令牌 -> 过期时间
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        digest = hmac.new(self.secret, payload.encode('ascii'), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+    def create(self, user_id, role, room_id):
+        expires_at = int(time.time()) + self.ttl
+        payload = f"{user_id}.{role}.{expires_at}.{secrets.token_urlsafe(12)}"
+        token = f"{payload}.{self._sign(payload)}"
+        with self._lock:
+            self._cache(token, Session(user_id, role, room_id, expires_at))
+        return token
+
+    def _parse(self, token):
+        """签名正确时返回 (user_id, role, expires_at)，否则返回 None"""
+        payload, _, signature = token.rpartition('.')
+        if not payload or not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        # 随机串中不含 '.'，签名正确的令牌一定能按格式解析
+        user_id, role, expires_at, _ = payload.split('.')
+        return int(user_id), int(role), int(expires_at)
+
+    def get(self, token):
+        try:
+            claims = self._parse(token)
+        except (UnicodeEncodeError, ValueError):
+            return None
+        if claims is None:
+            return None
+        user_id, role, expires_at = claims
+        if expires_at < time.time():
+            with self._lock:
+                if token in self._sessions:
+                    self._remove(token)
+            return None
+        with self._lock:
+            if token in self._revoked:
+                return None
+            session = self._sessions.get(token)
+            if session is not None:
+                self._sessions.move_to_end(token)
+                return session
+            # 其他进程签发的令牌，或者已被淘汰出缓存；在锁内查询房间号，不会错过同时进行的 update_room
+            session = Session(user_id, role, self.room_of(user_id), expires_at)
+            self._cache(token, session)
+            return session
+
+    def revoke(self, token):
+        with self._lock:
+            if token in self._sessions:
+                self._revoked[token] = self._sessions[token].expires_at
+                self._remove(token)
+            else:
+                try:
+                    claims = self._parse(token)
+                except (UnicodeEncodeError, ValueError):
+                    claims = None
+                if claims is not None:
+                    self._revoked[token] = claims[2]
+            now = time.time()
+            for expired in [t for t, expires_at in self._revoked.items() if expires_at < now]:
+                del self._revoked[expired]
+
+    def update_room(self, user_id, room_id):
+        with self._lock:
+            for token in self._tokens_by_user.get(user_id, ()):
+                self._sessions[token].room_id = room_id
+
+    def _cache(self, token, session):
+        self._sessions[token] = session
+        self._tokens_by_user.setdefault(session.user_id, set()).add(token)
+        while len(self._sessions) > self.max_sessions:
+            self._remove(next(iter(self._sessions)))
+
+    def _remove(self, token):
+        session = self._sessions.pop(token)
+        tokens = self._tokens_by_user.get(session.user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[session.user_id]
@@ -0,0 +1,375 @@
+"""
+按房间号范围把数据分到多个 sqlite 文件中。
+
+每个分片是一个独立的数据库文件，保存一段连续房间号的房间、使用记录和入住记录，
+各分片的写锁互不影响；用户表统一保存在目录库中，所有分片共用。
+客人按 user_id 取模固定分到一个分片，入住时只在这个分片中选房，
+所以按房间或按客人的请求都能直接算出所在的分片，不需要查表。
+代价是每位客人只能住进全部房间中的 1 / shard_count：客人所在分片的房间住满后，
+即使其他分片还有空房，入住也会失败并抛出 ShardFull（接口返回 409），
+rooms_per_shard 应该按单个分片的入住高峰设置，而不是按全楼平均。
+
+多 worker 部署时每个 worker 只打开自己拥有的分片（见 ShardMap.owned_shards），
+房间状态只缓存在拥有它的进程中；前端按 worker_for_room / worker_for_user 转发请求。
+main.py 中每个 worker 是一个单独启动的进程，由 ACM_WORKER_INDEX / ACM_WORKER_COUNT 指定编号，例如
+
+    ACM_SHARDS=4 ACM_WORKER_INDEX=0 uvicorn main:app --port 8000
+    ACM_SHARDS=4 ACM_WORKER_INDEX=1 uvicorn main:app --port 8001
+
+报表由 ShardReader 直接读取全部分片文件。
+"""
+import os
+import threading
+
+from .acmdb import ACMDatabase
+from .data import ShardReportItem
+from .manager import MIN_ROOM_COUNT, Manager
+from .migrations import SCHEMA_VERSION, get_schema_version
+from .notifications import ChangeBus
+from .passwords import PasswordHasher
+from .reports import report_fields, select_report_rows
+from .rollups import SUMMARY_GROUPS, summary_items, summary_rows
+from .sessions import GUEST, SessionStore
+
+
+class ShardNotOwned(Exception):
+    """请求的房间或客人属于其他 worker 的分片"""
+
+    def __init__(self, shard):
+        super().__init__(f"Shard {shard} is not owned by this process")
+        self.shard = shard
+
+
+class ShardFull(Exception):
+    """客人所在分片的房间已经住满，其他分片可能还有空房"""
+
+    def __init__(self, shard):
+        super().__init__(f"No free room in shard {shard}")
+        self.shard = shard
+
+
+class ShardMap:
+    """
+    分片规则。第 i 个分片保存房间号 [i * rooms_per_shard + 1, (i + 1) * rooms_per_shard]，
+    超出范围的房间号归最后一个分片。文件名为 {base}.shard{i}.db，目录库为 {base}.db。
+    """
+
+    def __init__(self, shard_count, rooms_per_shard=1000, base='acm'):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        if rooms_per_shard < MIN_ROOM_COUNT:
+            # Manager 至少创建 MIN_ROOM_COUNT 间房，更小的范围会与下一个分片重叠
+            raise ValueError(f"rooms_per_shard must be at least {MIN_ROOM_COUNT}")
+        self.shard_count = shard_count
+        self.rooms_per_shard = rooms_per_shard
+        self.base = base
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        """从 ACM_SHARDS、ACM_ROOMS_PER_SHARD、ACM_DB_BASE 读取，没有设置 ACM_SHARDS 时返回 None"""
+        if not environ.get('ACM_SHARDS'):
+            return None
+        return cls(int(environ['ACM_SHARDS']), int(environ.get('ACM_ROOMS_PER_SHARD', 1000)),
+                   environ.get('ACM_DB_BASE', 'acm'))
+
+    @property
+    def directory_path(self):
+        return f"{self.base}.db"
+
+    def path(self, shard):
+        return f"{self.base}.shard{shard}.db"
+
+    def first_room(self, shard):
+        return shard * self.rooms_per_shard + 1
+
+    def shard_of_room(self, room_id):
+        return min(max(room_id - 1, 0) // self.rooms_per_shard, self.shard_count - 1)
+
+    def shard_of_user(self, user_id):
+        return user_id % self.shard_count
+
+    def owned_shards(self, worker_index, worker_count):
+        """worker_index 号 worker 拥有的分片，分片按编号轮流分给各个 worker"""
+        return [shard for shard in range(self.shard_count) if shard % worker_count == worker_index]
+
+    def worker_for_room(self, room_id, worker_count):
+        return self.shard_of_room(room_id) % worker_count
+
+    def worker_for_user(self, user_id, worker_count):
+        return self.shard_of_user(user_id) % worker_count
+
+
+def open_shard(shard_map, shard, users_db=None, **manager_kwargs):
+    """打开一个分片，返回只管理该分片房间号范围的 Manager"""
+    if users_db is None:
+        users_db = ACMDatabase(shard_map.directory_path)
+    manager_kwargs.setdefault('room_count', shard_map.rooms_per_shard)
+    return Manager(db=ACMDatabase(shard_map.path(shard)), users_db=users_db,
+                   first_room=shard_map.first_room(shard), **manager_kwargs)
+
+
+class ShardedManager:
+    """
+    在一个进程中管理多个分片，接口与 Manager 相同。
+    shards 为本进程拥有的分片，访问其他分片的房间或客人时抛出 ShardNotOwned。
+    每个分片有自己的事务，批量操作按分片各提交一次。
+    """
+
+    # 送风调度需要全楼统一的队列，分片部署时不支持
+    scheduler = None
+
+    def __init__(self, shard_map, shards=None, hasher=None, **manager_kwargs):
+        if manager_kwargs.get('scheduler') is not None:
+            raise ValueError("The service scheduler is not supported with sharding")
+        self.shard_map = shard_map
+        self.shards = list(range(shard_map.shard_count)) if shards is None else list(shards)
+        self.users_db = ACMDatabase(shard_map.directory_path)
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+        # 令牌由同一个 ACM_SESSION_SECRET 签名，其他 worker 签发的令牌也能校验
+        self.sessions = SessionStore(room_of=self.get_room_id_by_user)
+        self.bus = ChangeBus()
+        self.managers = {}
+        # 其他分片的只读连接，登录时查询客人所在的房间
+        self._remote = {}
+        for shard in self.shards:
+            manager = open_shard(shard_map, shard, self.users_db, hasher=self.hasher, **manager_kwargs)
+            # 所有分片共用一个会话缓存，入住和退房时更新的是同一份
+            manager.sessions = self.sessions
+            # 变更也发布到同一个 ChangeBus，编号在所有分片间连续
+            manager.bus = self.bus
+            self.managers[shard] = manager
+
+    def _shard(self, shard):
+        manager = self.managers.get(shard)
+        if manager is None:
+            raise ShardNotOwned(shard)
+        return manager
+
+    def for_room(self, room_id):
+        return self._shard(self.shard_map.shard_of_room(room_id))
+
+    def for_user(self, user_id):
+        return self._shard(self.shard_map.shard_of_user(user_id))
+
+    def _any(self):
+        # 用户表在目录库中，任意一个分片的 Manager 都可以处理
+        return self.managers[self.shards[0]]
+
+    def _only(self):
+        if len(self.managers) != 1:
+            raise ValueError("Reports over several shards are read with ShardReader")
+        return self._any()
+
+    @property
+    def storage(self):
+        # AsyncManager 在这个存储上做 group commit，所以只拥有一个分片时才能配合使用
+        return self._only().storage
+
+    def register_user(self, username, phone, password):
+        return self._any().register_user(username, phone, password)
+
+    def create_user(self, username, phone, hashed_password, salt, role=GUEST):
+        # 在分片的写事务中（AsyncManager 的写协程）调用时，目录库的写入随分片的事务一起提交，
+        # 见 SQLiteStorage._users_transaction
+        return self._any().create_user(username, phone, hashed_password, salt, role)
+
+    def get_login_user(self, username):
+        return self._any().get_login_user(username)
+
+    def get_user_id_by_name(self, username):
+        return self._any().get_user_id_by_name(username)
+
+    def login(self, username, password):
+        user = self.get_login_user(username)
+        if user is None or not self.hasher.check(password, user[1]):
+            return -1, -1, -1
+        user_id, hashed_password, role = user
+        return role, self.get_room_id_by_user(user_id), user_id
+
+    def get_room_id_by_user(self, user_id):
+        shard = self.shard_map.shard_of_user(user_id)
+        if shard in self.managers:
+            return self.managers[shard].get_room_id_by_user(user_id)
+        # 登录请求可能落在任意 worker 上，直接读取客人所在分片的 rooms 表；
+        # 分片文件还不存在说明拥有它的 worker 尚未启动，客人不可能已经入住
+        if shard not in self._remote:
+            if not os.path.exists(self.shard_map.path(shard)):
+                return -1
+            self._remote[shard] = ACMDatabase(self.shard_map.path(shard), pool_size=1, readonly=True)
+        with self._remote[shard].cursor() as c:
+            c.execute("SELECT id FROM rooms WHERE user_id = ? AND busy = 1", (user_id,))
+            room = c.fetchone()
+        return room[0] if room else -1
+
+    def checkin(self, user_id, floor=None):
+        shard = self.shard_map.shard_of_user(user_id)
+        room_id = self._shard(shard).checkin(user_id, floor)
+        if room_id == -1:
+            # 客人只能住在自己的分片中，与整栋楼住满区分开
+            raise ShardFull(shard)
+        return room_id
+
+    def get_cost(self, user_id):
+        return self.for_user(user_id).get_cost(user_id)
+
+    def checkout(self, user_id):
+        return self.for_user(user_id).checkout(user_id)
+
+    def generate_bill(self, user_id):
+        return self.for_user(user_id).generate_bill(user_id)
+
+    def turn_on_ac(self, room_id):
+        return self.for_room(room_id).turn_on_ac(room_id)
+
+    def turn_off_ac(self, room_id):
+        return self.for_room(room_id).turn_off_ac(room_id)
+
+    def set_ac(self, room_id, settings):
+        return self.for_room(room_id).set_ac(room_id, settings)
+
+    def check_status(self, room_id):
+        return self.for_room(room_id).check_status(room_id)
+
+    def select_rooms(self, room_ids=None, first=None, last=None):
+        selected = [room_id for room_id in room_ids or () if self.shard_map.shard_of_room(room_id) in self.managers]
+        if first is not None or last is not None:
+            for shard in self.shards:
+                selected.extend(self.managers[shard].select_rooms(None, first, last))
+        return list(dict.fromkeys(selected))
+
+    def _by_shard(self, room_ids):
+        groups = {}
+        for room_id in room_ids:
+            groups.setdefault(self.shard_map.shard_of_room(room_id), []).append(room_id)
+        return groups
+
+    def turn_off_many(self, room_ids):
+        statuses = {}
+        for shard, shard_rooms in self._by_shard(room_ids).items():
+            statuses.update(self._shard(shard).turn_off_many(shard_rooms))
+        return statuses
+
+    def set_many(self, room_ids, settings):
+        statuses = {}
+        for shard, shard_rooms in self._by_shard(room_ids).items():
+            statuses.update(self._shard(shard).set_many(shard_rooms, settings))
+        return statuses
+
+    def generate_report(self, **filters):
+        return self._only().generate_report(**filters)
+
+    def report_rows(self, *args, **filters):
+        return self._only().report_rows(*args, **filters)
+
+    def generate_summary(self, group='day', start_day=None, end_day=None, room_id=None):
+        return self._only().generate_summary(group, start_day, end_day, room_id)
+
+    def live_cost_snapshot(self):
+        costs = {}
+        for manager in self.managers.values():
+            costs.update(manager.live_cost_snapshot())
+        return costs
+
+    def tick_scheduler(self):
+        return []
+
+    def room_snapshot(self):
+        seq = self.bus.seq
+        rooms = []
+        for manager in self.managers.values():
+            rooms.extend(manager.room_snapshot()[1])
+        return seq, rooms
+
+    def scheduler_state(self):
+        return None
+
+    def verify_room_state(self):
+        return {shard: manager.verify_room_state() for shard, manager in self.managers.items()}
+
+    def close(self):
+        for manager in self.managers.values():
+            manager.db.close()
+        for db in self._remote.values():
+            db.close()
+        self.users_db.close()
+
+
+class ShardReader:
+    """
+    跨分片读取报表，不缓存任何房间状态。分片由其他 worker 拥有，只以只读方式打开。
+    分片文件由拥有它的 worker 启动时创建，每次请求时重新查找还没有打开的分片，
+    文件存在并且已经迁移到当前版本才打开。
+    分页游标为 (分片号, 分片内记录 id)，按分片号、再按 id 的顺序返回记录。
+    """
+
+    def __init__(self, shard_map):
+        self.shard_map = shard_map
+        self.dbs = {}
+        self._lock = threading.Lock()
+
+    def _open_shards(self):
+        """已经可以读取的分片，{分片号: ACMDatabase}"""
+        with self._lock:
+            for shard in range(self.shard_map.shard_count):
+                if shard not in self.dbs and os.path.exists(self.shard_map.path(shard)):
+                    db = ACMDatabase(self.shard_map.path(shard), readonly=True)
+                    with db.connection() as conn:
+                        ready = get_schema_version(conn) >= SCHEMA_VERSION
+                    if ready:
+                        self.dbs[shard] = db
+                    else:
+                        # 拥有它的 worker 还在建表，下次请求时再打开
+                        db.close()
+            return dict(self.dbs)
+
+    def report_page(self, cursor=(0, 0), limit=1000, **filters):
+        """返回 (行列表, 下一页游标)，行的第一列为分片号，没有更多记录时游标为 None"""
+        shard, after_id = cursor
+        rows = []
+        # 按房间过滤时只需要读该房间所在的分片
+        room_id = filters.get('room_id')
+        only = self.shard_map.shard_of_room(room_id) if room_id is not None else None
+        dbs = self._open_shards()
+        for current in sorted(dbs):
+            if current < shard or only is not None and current != only:
+                continue
+            with dbs[current].cursor() as c:
+                page = select_report_rows(c, after_id if current == shard else 0, limit - len(rows), **filters)
+            rows.extend((current, *row) for row in page)
+            if len(rows) == limit:
+                return rows, (current, rows[-1][1])
+        return rows, None
+
+    def generate_report(self, cursor=(0, 0), limit=1000, **filters):
+        """与 report_page 相同的分页，返回 (ShardReportItem 列表, 下一页游标)"""
+        rows, cursor = self.report_page(cursor, limit, **filters)
+        return [ShardReportItem(shard=row[0], **report_fields(row[1:])) for row in rows], cursor
+
+    def iter_report(self, chunk_size=1000, **filters):
+        cursor = (0, 0)
+        while cursor is not None:
+            rows, cursor = self.report_page(cursor, chunk_size, **filters)
+            if rows:
+                yield rows
+
+    def generate_summary(self, group='day', start_day=None, end_day=None, room_id=None):
+        """
+        合并各分片的汇总，同一分组键的数值相加。汇总表由拥有分片的 worker 刷新，
+        这里只读取，还没有计入汇总表的新记录在查询时一并累加
+        """
+        keys = len(SUMMARY_GROUPS[group])
+        totals = {}
+        for db in self._open_shards().values():
+            with db.cursor() as c:
+                rows = summary_rows(c, group, start_day, end_day, room_id, pending=True)
+            for row in rows:
+                key = row[:keys]
+                cost, runtime_ms, segments = totals.get(key, (0.0, 0, 0))
+                totals[key] = (cost + row[keys], runtime_ms + row[keys + 1], segments + row[keys + 2])
+        return summary_items(group, [(*key, *values) for key, values in sorted(totals.items())])
+
+    def close(self):
+        with self._lock:
+            for db in self.dbs.values():
+                db.close()
+            self.dbs = {}
@@ -58,3 +58,173 @@ create_user_record_query = r"""
         PRIMARY KEY(user_id, in_time)
     );
 """
+
+# 热点查询所用的二级索引
+create_ac_usage_record_user_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_ac_usage_record_user_start
+    ON ac_usage_record(user_id, start_time);
+"""
+create_ac_usage_record_room_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_ac_usage_record_room_start
+    ON ac_usage_record(room_id, start_time);
+"""
+create_room_user_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_rooms_user
+    ON rooms(user_id);
+"""
+create_room_busy_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_rooms_busy
+    ON rooms(busy, id);
+"""
+# 一位客人同时只能占用一个房间，多个进程同时为同一位客人办理入住时只有一个能成功
+create_room_occupant_index_query = r"""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_rooms_occupant ON rooms(user_id) WHERE busy = 1;
+"""
+create_user_name_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_users_username
+    ON users(username);
+"""
+
+# 时间列使用整数毫秒时间戳的表结构，{table} 为迁移时的临时表名
+epoch_room_table_query = r"""
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        busy INTEGER,
+        ac_on INTEGER,
+        user_id INTEGER,
+        start_time INTEGER,
+        temperature INTEGER,
+        fan_speed TEXT,
+        mode TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    """
+epoch_ac_usage_record_table_query = r"""
+    CREATE TABLE {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        room_id INTEGER,
+        start_time INTEGER,
+        end_time INTEGER,
+        temperature INTEGER,
+        fan_speed TEXT,
+        mode TEXT,
+        cost REAL,
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        FOREIGN KEY(room_id) REFERENCES rooms(id)
+    );
+    """
+epoch_user_record_table_query = r"""
+    CREATE TABLE {table} (
+        user_id INTEGER,
+        in_time INTEGER,
+        out_time INTEGER,
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        PRIMARY KEY(user_id, in_time)
+    );
+    """
+
+# 每次入住的累计费用，随空调使用记录在同一事务中更新，out_time 为空表示尚未退房
+create_stay_totals_table_query = r"""
+    CREATE TABLE IF NOT EXISTS stay_totals(
+        user_id INTEGER,
+        in_time INTEGER,
+        out_time INTEGER,
+        room_id INTEGER,
+        cost REAL NOT NULL DEFAULT 0,
+        segments INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        PRIMARY KEY(user_id, in_time)
+    );
+"""
+
+# 空调使用记录的汇总，按房间、日期（UTC 自 1970-01-01 起的天数）和设置分组，
+# 一段记录整体计入开始时间所在的那一天
+create_usage_rollup_table_query = r"""
+    CREATE TABLE IF NOT EXISTS usage_rollup(
+        room_id INTEGER,
+        day INTEGER,
+        mode TEXT,
+        fan_speed TEXT,
+        cost REAL NOT NULL DEFAULT 0,
+        runtime_ms INTEGER NOT NULL DEFAULT 0,
+        segments INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(room_id, day, mode, fan_speed)
+    );
+"""
+create_usage_rollup_day_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_usage_rollup_day ON usage_rollup(day);
+"""
+# 各汇总表已经计入的最大记录 id
+create_rollup_state_table_query = r"""
+    CREATE TABLE IF NOT EXISTS rollup_state(
+        name TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL DEFAULT 0
+    );
+"""
+
+# 房间所在楼层和房型，已有房间按每层 100 间回填楼层
+add_room_floor_column_query = r"""
+    ALTER TABLE rooms ADD COLUMN floor INTEGER;
+"""
+add_room_type_column_query = r"""
+    ALTER TABLE rooms ADD COLUMN room_type TEXT NOT NULL DEFAULT 'standard';
+"""
+backfill_room_floor_query = r"""
+    UPDATE rooms SET floor = (id - 1) / 100 + 1 WHERE floor IS NULL;
+"""
+add_room_cost_offset_column_query = r"""
+    ALTER TABLE rooms ADD COLUMN cost_offset REAL NOT NULL DEFAULT 0;
+"""
+
+# 只追加的空调事件日志，id 按写入顺序递增，不使用 AUTOINCREMENT 以减少每次插入的开销
+create_ac_events_table_query = r"""
+    CREATE TABLE IF NOT EXISTS ac_events(
+        id INTEGER PRIMARY KEY,
+        time INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        user_id INTEGER,
+        room_id INTEGER,
+        temperature INTEGER,
+        fan_speed TEXT,
+        mode TEXT
+    );
+"""
+
+# 已退房且超过保留期限的入住的使用记录，由维护任务从 ac_usage_record 移入，保留原来的 id
+create_ac_usage_archive_table_query = r"""
+    CREATE TABLE IF NOT EXISTS ac_usage_archive(
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        room_id INTEGER,
+        start_time INTEGER,
+        end_time INTEGER,
+        temperature INTEGER,
+        fan_speed TEXT,
+        mode TEXT,
+        cost REAL
+    );
+"""
+create_ac_usage_archive_user_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_ac_usage_archive_user_start
+    ON ac_usage_archive(user_id, start_time);
+"""
+create_ac_usage_archive_room_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_ac_usage_archive_room_start
+    ON ac_usage_archive(room_id, start_time);
+"""
+# 全部使用记录，报表和重建、校验读这个视图；两张表的 id 不重复，条件会下推到两边各自的索引
+create_ac_usage_history_view_query = r"""
+    CREATE VIEW IF NOT EXISTS ac_usage_history AS
+    SELECT id, user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost FROM ac_usage_archive
+    UNION ALL
+    SELECT id, user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost FROM ac_usage_record;
+"""
+add_stay_archived_column_query = r"""
+    ALTER TABLE stay_totals ADD COLUMN archived INTEGER NOT NULL DEFAULT 0;
+"""
+# 只包含已退房、尚未归档的入住，维护任务按退房时间顺序读取
+create_stay_archive_index_query = r"""
+    CREATE INDEX IF NOT EXISTS idx_stay_totals_unarchived
+    ON stay_totals(out_time) WHERE archived = 0 AND out_time IS NOT NULL;
+"""
@@ -0,0 +1,31 @@
+"""
+每次入住的累计费用（stay_totals 表）的重建与校验，读取包括已归档在内的全部使用记录。
+"""
+from .reports import USAGE_HISTORY
+
+# 一次入住包含的使用记录：开始时间不早于入住时间，已退房的不晚于退房时间
+_stay_records_condition = r"""
+    a.user_id = s.user_id AND a.start_time >= s.in_time AND (s.out_time IS NULL OR a.start_time <= s.out_time)
+"""
+
+
+def rebuild_stay_totals(c, table=USAGE_HISTORY):
+    """从原始使用记录重新计算全部累计值，补上 user_record 中缺失的在住记录"""
+    c.execute(r"""
+    INSERT OR IGNORE INTO stay_totals (user_id, in_time, room_id)
+    SELECT ur.user_id, ur.in_time, r.id
+    FROM user_record ur LEFT JOIN rooms r ON r.user_id = ur.user_id AND r.busy = 1""")
+    c.execute(f"""
+    UPDATE stay_totals AS s SET
+        cost = (SELECT COALESCE(SUM(a.cost), 0) FROM {table} a WHERE {_stay_records_condition}),
+        segments = (SELECT COUNT(*) FROM {table} a WHERE {_stay_records_condition})""")
+    return c.rowcount
+
+
+def verify_stay_totals(c, tolerance=1e-6):
+    """返回累计值与原始记录不一致的入住，(user_id, in_time, 累计费用, 实际费用, 累计段数, 实际段数)"""
+    c.execute(f"""
+    SELECT s.user_id, s.in_time, s.cost, COALESCE(SUM(a.cost), 0), s.segments, COUNT(a.id)
+    FROM stay_totals s LEFT JOIN {USAGE_HISTORY} a ON {_stay_records_condition}
+    GROUP BY s.user_id, s.in_time""")
+    return [row for row in c.fetchall() if abs(row[2] - row[3]) > tolerance or row[4] != row[5]]
@@ -0,0 +1,956 @@
+"""
+Manager 使用的存储引擎。
+
+Storage 定义了 Manager 实际需要的操作：占用房间、开始和结束使用时段、入住累计费用、
+报表查询等，Manager 只通过这些操作读写持久化数据，不直接拼 SQL。
+
+SQLiteStorage   基于 ACMDatabase 的 sqlite 实现，默认使用
+MemoryStorage   只用 dict 和 list 的内存实现，进程退出后数据丢失，
+                用于测试、基准测试和模拟，也可以用来区分延迟中存储和 API 层各占多少
+
+写操作需要在 transaction() 中调用，事务回滚时两种引擎都会撤销其中的全部修改，
+并执行 on_rollback 登记的回调。
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from .acmdb import ACMDatabase
+from .events import EVENT_COLUMNS, EVENT_LOG_NAME
+from .maintenance import archive_stays, reclaim_space, unarchive_stays
+from .migrations import migrate
+from .provisioning import provision_rooms
+from .reports import select_report_rows
+from .rollups import (MS_PER_DAY, SUMMARY_KEYS, rebuild_rollups, refresh_rollups, summary_rows,
+                      verify_rollups)
+from .rooms import ROOM_COLUMNS, RoomState
+from .stays import rebuild_stay_totals, verify_stay_totals
+
+
+class StorageError(Exception):
+    """存储引擎拒绝了写入，例如违反唯一约束"""
+
+
+class Storage:
+    """
+    存储引擎接口。
+
+    使用记录的行为 (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)，
+    报表行的列见 reports.REPORT_COLUMNS，汇总行见 rollups.summary_rows。
+    """
+
+    # 事务
+
+    def transaction(self):
+        """写事务的上下文管理器，可以嵌套，内层失败只撤销内层的修改"""
+        raise NotImplementedError
+
+    def on_rollback(self, callback):
+        """登记当前事务回滚时需要执行的操作，不在事务中时忽略"""
+        raise NotImplementedError
+
+    def before_commit(self, callback):
+        """登记最外层事务提交前执行的操作，同一个回调在一个事务中只执行一次"""
+        raise NotImplementedError
+
+    def after_commit(self, callback):
+        """登记最外层事务提交后执行的操作，同一个回调在一个事务中只执行一次，回滚时不执行"""
+        raise NotImplementedError
+
+    def hold_writer(self):
+        """当前线程此后作为唯一的写线程，见 AsyncManager"""
+
+    def release_writer(self):
+        pass
+
+    def migrate(self):
+        pass
+
+    def close(self):
+        pass
+
+    # 用户
+
+    def create_user(self, username, phone, hashed_password, salt, role=1):
+        """返回新用户的 id，违反约束时抛出 StorageError"""
+        raise NotImplementedError
+
+    def get_login_user(self, username):
+        """返回 (id, password, role)，用户不存在时返回 None"""
+        raise NotImplementedError
+
+    def set_user_role(self, username, role):
+        """修改用户的角色，返回修改的用户数"""
+        raise NotImplementedError
+
+    def get_user_id(self, username):
+        raise NotImplementedError
+
+    def user_exists(self, user_id):
+        raise NotImplementedError
+
+    # 房间
+
+    def load_rooms(self):
+        """全部房间的 RoomState 列表"""
+        raise NotImplementedError
+
+    def occupied_room(self, user_id):
+        """客人已经入住的房间号，没有入住时返回 None。在写事务中调用时以存储中已提交的状态为准，不受其他进程影响"""
+        raise NotImplementedError
+
+    def max_room_id(self):
+        raise NotImplementedError
+
+    def provision_rooms(self, specs):
+        """插入还不存在的房间，房间定义见 provisioning，返回新插入的房间定义"""
+        raise NotImplementedError
+
+    def insert_room(self, busy, ac_on, user_id, start_time, temperature, fan_speed, mode):
+        """插入一个房间，返回房间号"""
+        raise NotImplementedError
+
+    def claim_room(self, room_id, user_id, start_time):
+        """房间空闲时占用它并返回 True，已被占用时返回 False"""
+        raise NotImplementedError
+
+    def claim_any_room(self, user_id, start_time):
+        """占用房间号最小的空闲房间，返回占用后的 RoomState，没有空房时返回 None"""
+        raise NotImplementedError
+
+    def update_rooms(self, room_ids, **fields):
+        """把这些房间的 fields 列修改为相同的值"""
+        raise NotImplementedError
+
+    # 使用时段
+
+    def open_segments(self, room_ids, start_time, **settings):
+        """从 start_time 开始新的使用时段，settings 为新的温度、风速、模式"""
+        self.update_rooms(room_ids, ac_on=1, start_time=start_time, **settings)
+
+    def close_segments(self, records):
+        """写入结束的使用时段，并累加到各自客人本次入住的费用中"""
+        raise NotImplementedError
+
+    def stay_bill(self, user_id):
+        """
+        在住客人本次入住的使用记录，按开始时间排序，
+        (room_id, start_time, end_time, temperature, fan_speed, mode, cost)，不在住时返回空列表
+        """
+        raise NotImplementedError
+
+    def insert_records(self, records):
+        """只写入使用记录，不修改入住累计费用，用于重放"""
+        raise NotImplementedError
+
+    def delete_records_after(self, after_id):
+        raise NotImplementedError
+
+    # 事件日志
+
+    def append_events(self, events):
+        """追加事件，每个事件为 EVENT_COLUMNS 中除 id 以外的列"""
+        raise NotImplementedError
+
+    def event_rows(self, after_id=0, limit=None):
+        """按 id 顺序读取事件，列见 events.EVENT_COLUMNS"""
+        raise NotImplementedError
+
+    def event_log_start(self):
+        """建立事件日志时已有的最大使用记录 id，更早的记录无法重放"""
+        raise NotImplementedError
+
+    # 入住
+
+    def open_stay(self, user_id, room_id, in_time):
+        raise NotImplementedError
+
+    def close_stay(self, user_id, out_time):
+        """结束本次入住，返回累计费用，没有累计记录时返回 None"""
+        raise NotImplementedError
+
+    def stay_cost(self, user_id):
+        """在住客人本次入住已结束时段的累计费用，不在住时返回 None"""
+        raise NotImplementedError
+
+    def stay_costs(self, user_ids):
+        """多位在住客人的 stay_cost，{user_id: cost}，不在住的客人不出现在结果中"""
+        costs = {}
+        for user_id in user_ids:
+            cost = self.stay_cost(user_id)
+            if cost is not None:
+                costs[user_id] = cost
+        return costs
+
+    def stay_state(self, user_id):
+        """
+        在住客人的房间状态和 stay_cost，(RoomState, cost)，不在住时返回 None。
+        两者在同一个快照中读取，不会一个已提交而另一个还没有
+        """
+        raise NotImplementedError
+
+    def load_room_costs(self):
+        """全部房间的 RoomState 和在住客人的 stay_cost，[(RoomState, cost)]，空房的 cost 为 None，同一个快照中读取"""
+        raise NotImplementedError
+
+    def verify_stay_totals(self):
+        raise NotImplementedError
+
+    def rebuild_stay_totals(self):
+        raise NotImplementedError
+
+    # 报表
+
+    def report_rows(self, after_id=0, limit=None, start_time=None, end_time=None, room_id=None, user_id=None):
+        raise NotImplementedError
+
+    def refresh_rollups(self):
+        raise NotImplementedError
+
+    def rebuild_rollups(self):
+        raise NotImplementedError
+
+    def summary_rows(self, group='day', start_day=None, end_day=None, room_id=None, pending=False):
+        """pending 为 True 时加上高水位之后还没有计入汇总表的记录，不需要写事务"""
+        raise NotImplementedError
+
+    def verify_rollups(self):
+        raise NotImplementedError
+
+    # 维护，不区分冷热数据的引擎不需要实现
+
+    def archive_stays(self, horizon_ms, limit):
+        """归档退房早于 horizon_ms 的至多 limit 次入住，见 maintenance，返回 (入住数, 移出的记录数, 归档的记录数)"""
+        return 0, 0, 0
+
+    def reclaim_space(self, vacuum_pages, analysis_limit):
+        """归还空闲空间并更新统计信息，返回归还的页数"""
+        return 0
+
+
+class SQLiteStorage(Storage):
+    """
+    sqlite 存储。users_db 为用户表所在的数据库，分片部署时所有分片共用一个，默认与 db 相同。
+    在事务中调用的写操作直接使用事务的连接，不再额外创建 SAVEPOINT。
+    """
+
+    def __init__(self, db=None, users_db=None):
+        self.db = db if db is not None else ACMDatabase()
+        self.users_db = users_db if users_db is not None else self.db
+        self._writer_conn = None
+
+    @contextmanager
+    def _write_cursor(self):
+        if self.db.in_transaction:
+            with self.db.cursor() as c:
+                yield c
+        else:
+            with self.db.transaction() as c:
+                yield c
+
+    def transaction(self):
+        return self.db.transaction()
+
+    def on_rollback(self, callback):
+        self.db.on_rollback(callback)
+
+    def before_commit(self, callback):
+        self.db.before_commit(callback)
+
+    def after_commit(self, callback):
+        self.db.after_commit(callback)
+
+    def hold_writer(self):
+        if self._writer_conn is None:
+            # 写线程独占一个连接，并且只有 FULL 同步的提交才算落盘
+            self._writer_conn = self.db.connection()
+            conn = self._writer_conn.__enter__()
+            conn.execute("PRAGMA synchronous = FULL")
+
+    def release_writer(self):
+        if self._writer_conn is None:
+            return
+        # 写线程上嵌套获取连接得到的就是独占的那个连接
+        with self.db.connection() as conn:
+            conn.execute(f"PRAGMA synchronous = {self.db.synchronous}")
+        self._writer_conn.__exit__(None, None, None)
+        self._writer_conn = None
+
+    def migrate(self):
+        # 建表和索引都由迁移完成，已是最新版本时不做任何操作
+        with self.db.connection() as conn:
+            migrate(conn)
+        if self.users_db is not self.db:
+            with self.users_db.connection() as conn:
+                migrate(conn)
+
+    def close(self):
+        self.db.close()
+        if self.users_db is not self.db:
+            self.users_db.close()
+
+    def _users_transaction(self):
+        """
+        写用户表的事务。用户表在单独的目录库中（分片部署）并且当前处于房间库的写事务中时，
+        第一次写用户表时开始目录库的事务，在房间库提交前一起提交、回滚时一起回滚，
+        AsyncManager 同一批中的注册只提交一次目录库；每次写入是其中的一个 SAVEPOINT。
+        两个库不能原子地提交，目录库先提交，房间库随后提交失败时新用户仍然保留。
+        """
+        if self.users_db is self.db or self.users_db.in_transaction or not self.db.in_transaction:
+            return self.users_db.transaction()
+        outer = self.users_db.transaction()
+        outer.__enter__()
+        finished = []
+
+        def finish(exc_type=None, exc=None, tb=None):
+            if not finished:
+                finished.append(True)
+                outer.__exit__(exc_type, exc, tb)
+
+        self.db.before_commit(finish)
+        self.db.on_rollback(lambda: finish(StorageError, StorageError("rolled back"), None))
+        return self.users_db.transaction()
+
+    def create_user(self, username, phone, hashed_password, salt, role=1):
+        insert_query = "INSERT INTO users (username, password, salt, phone, role) VALUES (?, ?, ?, ?, ?)"
+        try:
+            with self._users_transaction() as c:
+                c.execute(insert_query, (username, hashed_password, salt, phone, role))
+                return c.lastrowid
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def get_login_user(self, username):
+        with self.users_db.cursor() as c:
+            c.execute("SELECT id, password, role FROM users WHERE username = ?", (username,))
+            return c.fetchone()
+
+    def set_user_role(self, username, role):
+        with self.users_db.transaction() as c:
+            c.execute("UPDATE users SET role = ? WHERE username = ?", (role, username))
+            return c.rowcount
+
+    def get_user_id(self, username):
+        with self.users_db.cursor() as c:
+            c.execute("SELECT id FROM users WHERE username = ?", (username,))
+            user = c.fetchone()
+        return user[0] if user is not None else None
+
+    def user_exists(self, user_id):
+        with self.users_db.cursor() as c:
+            c.execute("SELECT id FROM users WHERE id = ?", (user_id,))
+            return c.fetchone() is not None
+
+    def load_rooms(self):
+        with self.db.cursor() as c:
+            c.execute(f"SELECT {', '.join(ROOM_COLUMNS)} FROM rooms")
+            return [RoomState(*row) for row in c.fetchall()]
+
+    def occupied_room(self, user_id):
+        with self.db.cursor() as c:
+            c.execute("SELECT id FROM rooms WHERE user_id = ? AND busy = 1", (user_id,))
+            row = c.fetchone()
+        return row[0] if row is not None else None
+
+    def max_room_id(self):
+        with self.db.cursor() as c:
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM rooms")
+            return c.fetchone()[0]
+
+    def provision_rooms(self, specs):
+        with self._write_cursor() as c:
+            return provision_rooms(c, specs)
+
+    def insert_room(self, busy, ac_on, user_id, start_time, temperature, fan_speed, mode):
+        with self._write_cursor() as c:
+            insert_room_query = r"""
+            INSERT INTO rooms (busy, ac_on, user_id, start_time, temperature, fan_speed, mode)
+            VALUES (?, ?, ?, ?, ?, ?, ?)"""
+            c.execute(insert_room_query, (busy, ac_on, user_id, start_time, temperature, fan_speed, mode))
+            return c.lastrowid
+
+    def claim_room(self, room_id, user_id, start_time):
+        # 以带 busy = 0 条件的 UPDATE 为准，其他进程已占用的房间会被跳过
+        with self._write_cursor() as c:
+            c.execute(r"""
+            UPDATE rooms SET busy = 1, user_id = ?, start_time = ?
+            WHERE id = ? AND busy = 0
+            RETURNING id""", (user_id, start_time, room_id))
+            return c.fetchone() is not None
+
+    def claim_any_room(self, user_id, start_time):
+        with self._write_cursor() as c:
+            c.execute(f"""
+            UPDATE rooms SET busy = 1, user_id = ?, start_time = ?
+            WHERE id = (SELECT id FROM rooms WHERE busy = 0 ORDER BY id LIMIT 1) AND busy = 0
+            RETURNING {', '.join(ROOM_COLUMNS)}""", (user_id, start_time))
+            room = c.fetchone()
+        return RoomState(*room) if room is not None else None
+
+    def update_rooms(self, room_ids, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        values = tuple(fields.values())
+        with self._write_cursor() as c:
+            if len(room_ids) == 1:
+                c.execute(f"UPDATE rooms SET {assignments} WHERE id = ?", (*values, room_ids[0]))
+            else:
+                c.executemany(f"UPDATE rooms SET {assignments} WHERE id = ?",
+                              [(*values, room_id) for room_id in room_ids])
+
+    def close_segments(self, records):
+        # 使用记录和入住累计费用各用一次 executemany 写入
+        with self._write_cursor() as c:
+            c.executemany(r"""
+            INSERT INTO ac_usage_record
+            (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", records)
+            c.executemany(r"""
+            UPDATE stay_totals SET cost = cost + ?, segments = segments + 1
+            WHERE user_id = ? AND out_time IS NULL""", [(record[-1], record[0]) for record in records])
+
+    def stay_bill(self, user_id):
+        # 入住时间用标量子查询取出，才能作为 (user_id, start_time) 索引的范围条件，
+        # 写成 JOIN 时只按 user_id 读取该客人的全部历史记录再过滤；不在住时子查询为 NULL，结果为空
+        with self.db.cursor() as c:
+            c.execute(r"""
+            SELECT room_id, start_time, end_time, temperature, fan_speed, mode, cost
+            FROM ac_usage_record
+            WHERE user_id = ? AND start_time >= (SELECT in_time FROM user_record WHERE user_id = ?)
+            ORDER BY start_time""", (user_id, user_id))
+            return c.fetchall()
+
+    def insert_records(self, records):
+        with self._write_cursor() as c:
+            c.executemany(r"""
+            INSERT INTO ac_usage_record
+            (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", records)
+
+    def delete_records_after(self, after_id):
+        with self._write_cursor() as c:
+            c.execute("DELETE FROM ac_usage_record WHERE id > ?", (after_id,))
+            c.execute("DELETE FROM ac_usage_archive WHERE id > ?", (after_id,))
+            unarchive_stays(c)
+
+    def append_events(self, events):
+        with self._write_cursor() as c:
+            c.executemany(r"""
+            INSERT INTO ac_events (time, kind, user_id, room_id, temperature, fan_speed, mode)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""", events)
+
+    def event_rows(self, after_id=0, limit=None):
+        query = f"SELECT {', '.join(EVENT_COLUMNS)} FROM ac_events WHERE id > ? ORDER BY id"
+        values = [after_id]
+        if limit is not None:
+            query += " LIMIT ?"
+            values.append(limit)
+        with self.db.cursor() as c:
+            c.execute(query, values)
+            return c.fetchall()
+
+    def event_log_start(self):
+        with self.db.cursor() as c:
+            c.execute("SELECT last_id FROM rollup_state WHERE name = ?", (EVENT_LOG_NAME,))
+            row = c.fetchone()
+        return row[0] if row is not None else 0
+
+    def open_stay(self, user_id, room_id, in_time):
+        with self._write_cursor() as c:
+            c.execute("INSERT INTO user_record (user_id, in_time) VALUES (?, ?)", (user_id, in_time))
+            # 本次入住的累计费用
+            c.execute("INSERT INTO stay_totals (user_id, in_time, room_id) VALUES (?, ?, ?)",
+                      (user_id, in_time, room_id))
+
+    def close_stay(self, user_id, out_time):
+        with self._write_cursor() as c:
+            c.execute("DELETE FROM user_record WHERE user_id = ?", (user_id,))
+            c.execute("UPDATE stay_totals SET out_time = ? WHERE user_id = ? AND out_time IS NULL RETURNING cost",
+                      (out_time, user_id))
+            row = c.fetchone()
+        return row[0] if row is not None else None
+
+    def stay_cost(self, user_id):
+        with self.db.cursor() as c:
+            c.execute("SELECT cost FROM stay_totals WHERE user_id = ? AND out_time IS NULL", (user_id,))
+            row = c.fetchone()
+        return row[0] if row is not None else None
+
+    def stay_costs(self, user_ids):
+        user_ids = list(user_ids)
+        costs = {}
+        with self.db.cursor() as c:
+            # 每条语句的参数个数有上限
+            for i in range(0, len(user_ids), 500):
+                chunk = user_ids[i:i + 500]
+                c.execute(f"SELECT user_id, cost FROM stay_totals WHERE user_id IN ({', '.join('?' * len(chunk))}) "
+                          f"AND out_time IS NULL", chunk)
+                costs.update(c.fetchall())
+        return costs
+
+    def stay_state(self, user_id):
+        # 一条语句在同一个快照中读取
+        with self.db.cursor() as c:
+            # 按 stay_totals 的主键找到本次入住，再按主键读房间；idx_rooms_busy 会匹配大部分房间
+            c.execute(f"""SELECT {', '.join('r.' + column for column in ROOM_COLUMNS)}, s.cost FROM stay_totals s
+                JOIN rooms r ON r.id = s.room_id
+                WHERE s.user_id = ? AND s.out_time IS NULL AND r.user_id = s.user_id AND r.busy = 1""", (user_id,))
+            row = c.fetchone()
+        return (RoomState(*row[:-1]), row[-1]) if row is not None else None
+
+    def load_room_costs(self):
+        with self.db.cursor() as c:
+            c.execute(f"""SELECT {', '.join('r.' + column for column in ROOM_COLUMNS)}, s.cost FROM rooms r
+                LEFT JOIN stay_totals s ON r.busy = 1 AND s.user_id = r.user_id AND s.out_time IS NULL""")
+            return [(RoomState(*row[:-1]), row[-1]) for row in c.fetchall()]
+
+    def verify_stay_totals(self):
+        with self.db.cursor() as c:
+            return verify_stay_totals(c)
+
+    def rebuild_stay_totals(self):
+        with self._write_cursor() as c:
+            return rebuild_stay_totals(c)
+
+    def report_rows(self, after_id=0, limit=None, start_time=None, end_time=None, room_id=None, user_id=None):
+        with self.db.cursor() as c:
+            return select_report_rows(c, after_id, limit, start_time, end_time, room_id, user_id)
+
+    def refresh_rollups(self):
+        with self._write_cursor() as c:
+            return refresh_rollups(c)
+
+    def rebuild_rollups(self):
+        with self._write_cursor() as c:
+            return rebuild_rollups(c)
+
+    def summary_rows(self, group='day', start_day=None, end_day=None, room_id=None, pending=False):
+        with self.db.cursor() as c:
+            return summary_rows(c, group, start_day, end_day, room_id, pending)
+
+    def verify_rollups(self):
+        with self.db.cursor() as c:
+            return verify_rollups(c)
+
+    def archive_stays(self, horizon_ms, limit):
+        with self._write_cursor() as c:
+            return archive_stays(c, horizon_ms, limit)
+
+    def reclaim_space(self, vacuum_pages, analysis_limit):
+        # incremental_vacuum 和 ANALYZE 都要写库，单独使用一个短事务
+        with self.db.transaction() as c:
+            return reclaim_space(c, vacuum_pages, analysis_limit)
+
+
+class MemoryStorage(Storage):
+    """
+    内存存储，表结构与 sqlite 相同，按行保存在 list 中，另建 dict 索引。
+
+    写事务之间用一把锁串行执行，每个写操作都登记自己的撤销操作，回滚时逆序执行。
+    读操作不加锁，可能读到正在进行的事务尚未提交的修改。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        # users 表，id 从 1 开始，第 i 行的 id 为 i + 1
+        self._users = []
+        self._user_ids_by_name = {}
+        self._phones = set()
+        self._rooms = {}
+        # ac_usage_record 表，第 i 行的 id 为 i + 1；按客人和房间建立行号索引
+        self._records = []
+        self._records_by_user = {}
+        self._records_by_room = {}
+        # user_record 表
+        self._in_times = {}
+        # stay_totals 表，每行为 [user_id, in_time, out_time, room_id, cost, segments]
+        self._stays = []
+        self._open_stays = {}
+        # usage_rollup 表，(room_id, day, mode, fan_speed) -> [cost, runtime_ms, segments]
+        self._rollup = {}
+        self._rollup_last_id = 0
+        # ac_events 表，第 i 行的 id 为 i + 1
+        self._events = []
+
+    @contextmanager
+    def transaction(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.depth = depth + 1
+            self._local.undo.append([])
+            try:
+                yield self
+            except BaseException:
+                self._run_undo(self._local.undo.pop())
+                raise
+            else:
+                undo = self._local.undo.pop()
+                self._local.undo[-1].extend(undo)
+            finally:
+                self._local.depth = depth
+            return
+        with self._lock:
+            self._local.depth = 1
+            self._local.undo = [[]]
+            self._local.before_commit = []
+            self._local.after_commit = []
+            try:
+                yield self
+                callbacks = self._local.before_commit
+                i = 0
+                while i < len(callbacks):
+                    callbacks[i]()
+                    i += 1
+                after_commit = self._local.after_commit
+            except BaseException:
+                self._run_undo(self._local.undo[0])
+                raise
+            finally:
+                self._local.depth = 0
+                self._local.undo = None
+                self._local.before_commit = None
+                self._local.after_commit = None
+        for callback in after_commit:
+            callback()
+
+    def on_rollback(self, callback):
+        undo = getattr(self._local, 'undo', None)
+        if undo:
+            undo[-1].append(callback)
+
+    def before_commit(self, callback):
+        callbacks = getattr(self._local, 'before_commit', None)
+        if callbacks is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    def after_commit(self, callback):
+        callbacks = getattr(self._local, 'after_commit', None)
+        if callbacks is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    @staticmethod
+    def _run_undo(callbacks):
+        for callback in reversed(callbacks):
+            callback()
+
+    def create_user(self, username, phone, hashed_password, salt, role=1):
+        with self.transaction():
+            if phone in self._phones:
+                raise StorageError("UNIQUE constraint failed: users.phone")
+            self._users.append((username, hashed_password, salt, phone, role))
+            user_id = len(self._users)
+            self._phones.add(phone)
+            # 与 sqlite 一样，同名用户取 id 最小的一个
+            first = username not in self._user_ids_by_name
+            if first:
+                self._user_ids_by_name[username] = user_id
+            self.on_rollback(lambda: self._forget_user(username, phone, first))
+            return user_id
+
+    def _forget_user(self, username, phone, first):
+        self._users.pop()
+        self._phones.discard(phone)
+        if first:
+            del self._user_ids_by_name[username]
+
+    def get_login_user(self, username):
+        user_id = self._user_ids_by_name.get(username)
+        if user_id is None:
+            return None
+        user = self._users[user_id - 1]
+        return user_id, user[1], user[4]
+
+    def set_user_role(self, username, role):
+        with self.transaction():
+            updated = 0
+            for user_id, user in enumerate(self._users, 1):
+                if user[0] == username:
+                    self._users[user_id - 1] = (*user[:4], role)
+                    self.on_rollback(lambda user_id=user_id, user=user: self._users.__setitem__(user_id - 1, user))
+                    updated += 1
+            return updated
+
+    def get_user_id(self, username):
+        return self._user_ids_by_name.get(username)
+
+    def user_exists(self, user_id):
+        return 0 < user_id <= len(self._users)
+
+    def load_rooms(self):
+        return list(self._rooms.values())
+
+    def occupied_room(self, user_id):
+        stay = self._open_stays.get(user_id)
+        return stay[3] if stay is not None else None
+
+    def max_room_id(self):
+        return max(self._rooms, default=0)
+
+    def _put(self, room):
+        old = self._rooms.get(room.id)
+        self._rooms[room.id] = room
+        if old is None:
+            self.on_rollback(lambda: self._rooms.pop(room.id, None))
+        else:
+            self.on_rollback(lambda: self._rooms.__setitem__(old.id, old))
+
+    def provision_rooms(self, specs):
+        inserted = [spec for spec in specs if spec[0] not in self._rooms]
+        for room_id, floor, room_type, temperature, fan_speed, mode in inserted:
+            self._put(RoomState(room_id, 0, 0, -1, None, temperature, fan_speed, mode, floor, room_type))
+        return inserted
+
+    def insert_room(self, busy, ac_on, user_id, start_time, temperature, fan_speed, mode):
+        room_id = self.max_room_id() + 1
+        self._put(RoomState(room_id, busy, ac_on, user_id, start_time, temperature, fan_speed, mode))
+        return room_id
+
+    def claim_room(self, room_id, user_id, start_time):
+        room = self._rooms.get(room_id)
+        if room is None or room.busy:
+            return False
+        self._put(room.replace(busy=1, user_id=user_id, start_time=start_time))
+        return True
+
+    def claim_any_room(self, user_id, start_time):
+        free = [room_id for room_id, room in self._rooms.items() if not room.busy]
+        if not free:
+            return None
+        room_id = min(free)
+        self.claim_room(room_id, user_id, start_time)
+        return self._rooms[room_id]
+
+    def update_rooms(self, room_ids, **fields):
+        for room_id in room_ids:
+            room = self._rooms.get(room_id)
+            if room is not None:
+                self._put(room.replace(**fields))
+
+    def close_segments(self, records):
+        count = len(self._records)
+        changed = []
+        for record in records:
+            self._records.append(record)
+            index = len(self._records) - 1
+            self._records_by_user.setdefault(record[0], []).append(index)
+            self._records_by_room.setdefault(record[1], []).append(index)
+            stay = self._open_stays.get(record[0])
+            if stay is not None:
+                changed.append((stay, stay[4], stay[5]))
+                stay[4] += record[-1]
+                stay[5] += 1
+        self.on_rollback(lambda: self._truncate_records(count, changed))
+
+    def _truncate_records(self, count, changed):
+        while len(self._records) > count:
+            record = self._records.pop()
+            self._records_by_user[record[0]].pop()
+            self._records_by_room[record[1]].pop()
+        for stay, cost, segments in reversed(changed):
+            stay[4], stay[5] = cost, segments
+
+    def stay_bill(self, user_id):
+        in_time = self._in_times.get(user_id)
+        if in_time is None:
+            return []
+        records = (self._records[index] for index in self._records_by_user.get(user_id, ()))
+        return sorted((record[1:] for record in records if record[2] >= in_time), key=lambda record: record[1])
+
+    def insert_records(self, records):
+        count = len(self._records)
+        for record in records:
+            self._records.append(record)
+            index = len(self._records) - 1
+            self._records_by_user.setdefault(record[0], []).append(index)
+            self._records_by_room.setdefault(record[1], []).append(index)
+        self.on_rollback(lambda: self._truncate_records(count, []))
+
+    def delete_records_after(self, after_id):
+        # 与 AUTOINCREMENT 不同，删除后新记录的 id 会从 after_id + 1 重新开始
+        removed = self._records[after_id:]
+        self._truncate_records(after_id, [])
+        self.on_rollback(lambda: self.insert_records(removed))
+
+    def append_events(self, events):
+        count = len(self._events)
+        self._events.extend(events)
+        self.on_rollback(lambda: self._events.__delitem__(slice(count, None)))
+
+    def event_rows(self, after_id=0, limit=None):
+        end = len(self._events) if limit is None else min(len(self._events), after_id + limit)
+        return [(index + 1, *self._events[index]) for index in range(after_id, end)]
+
+    def event_log_start(self):
+        return 0
+
+    def open_stay(self, user_id, room_id, in_time):
+        stay = [user_id, in_time, None, room_id, 0.0, 0]
+        self._stays.append(stay)
+        self._open_stays[user_id] = stay
+        self._in_times[user_id] = in_time
+        self.on_rollback(lambda: self._forget_stay(user_id))
+
+    def _forget_stay(self, user_id):
+        self._stays.pop()
+        del self._open_stays[user_id]
+        del self._in_times[user_id]
+
+    def close_stay(self, user_id, out_time):
+        in_time = self._in_times.pop(user_id, None)
+        stay = self._open_stays.pop(user_id, None)
+        if stay is not None:
+            stay[2] = out_time
+        self.on_rollback(lambda: self._reopen_stay(user_id, in_time, stay))
+        return stay[4] if stay is not None else None
+
+    def _reopen_stay(self, user_id, in_time, stay):
+        if in_time is not None:
+            self._in_times[user_id] = in_time
+        if stay is not None:
+            stay[2] = None
+            self._open_stays[user_id] = stay
+
+    def stay_cost(self, user_id):
+        stay = self._open_stays.get(user_id)
+        return stay[4] if stay is not None else None
+
+    def stay_costs(self, user_ids):
+        return {user_id: self._open_stays[user_id][4] for user_id in user_ids if user_id in self._open_stays}
+
+    # 以下两个读操作需要同时读到房间和累计费用，等正在进行的写事务结束
+
+    def stay_state(self, user_id):
+        with self._lock:
+            stay = self._open_stays.get(user_id)
+            room = self._rooms.get(stay[3]) if stay is not None else None
+            if room is None or not room.busy or room.user_id != user_id:
+                return None
+            return room, stay[4]
+
+    def load_room_costs(self):
+        with self._lock:
+            return [(room, self.stay_cost(room.user_id) if room.busy else None) for room in self._rooms.values()]
+
+    def _stay_records(self, stay):
+        # 与 stays._stay_records_condition 相同的条件
+        user_id, in_time, out_time = stay[:3]
+        return [record for record in (self._records[index] for index in self._records_by_user.get(user_id, ()))
+                if record[2] >= in_time and (out_time is None or record[2] <= out_time)]
+
+    def verify_stay_totals(self, tolerance=1e-6):
+        mismatched = []
+        for stay in self._stays:
+            records = self._stay_records(stay)
+            actual = sum(record[-1] for record in records)
+            if abs(stay[4] - actual) > tolerance or stay[5] != len(records):
+                mismatched.append((stay[0], stay[1], stay[4], actual, stay[5], len(records)))
+        return mismatched
+
+    def rebuild_stay_totals(self):
+        for stay in self._stays:
+            records = self._stay_records(stay)
+            old = stay[4], stay[5]
+            stay[4], stay[5] = sum(record[-1] for record in records), len(records)
+            self.on_rollback(lambda stay=stay, old=old: stay.__setitem__(slice(4, 6), old))
+        return len(self._stays)
+
+    def report_rows(self, after_id=0, limit=None, start_time=None, end_time=None, room_id=None, user_id=None):
+        # 有客人或房间条件时只扫描索引中的行号，否则从 after_id 之后顺序扫描
+        if user_id is not None:
+            indexes = self._records_by_user.get(user_id, ())
+        elif room_id is not None:
+            indexes = self._records_by_room.get(room_id, ())
+        else:
+            indexes = range(max(after_id, 0), len(self._records))
+        rows = []
+        for index in indexes:
+            record = self._records[index]
+            if (index < after_id or start_time is not None and record[2] < start_time
+                    or end_time is not None and record[2] >= end_time
+                    or room_id is not None and record[1] != room_id
+                    or user_id is not None and record[0] != user_id):
+                continue
+            rows.append((index + 1, *record))
+            if limit is not None and len(rows) == limit:
+                break
+        return rows
+
+    def _add_to_rollup(self, rollup, records):
+        for user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost in records:
+            totals = rollup.setdefault((room_id, start_time // MS_PER_DAY, mode, fan_speed), [0.0, 0, 0])
+            totals[0] += cost
+            totals[1] += end_time - start_time
+            totals[2] += 1
+
+    def _merge_rollup(self, rollup, records):
+        """
+        把 records 加到 rollup 中，返回修改过的键原来的合计（新增的键为 None）。
+        修改过的键换成新的列表而不是原地修改，正在读取的线程不会看到只加了一半的合计。
+        """
+        added = {}
+        self._add_to_rollup(added, records)
+        previous = {}
+        for key, (cost, runtime_ms, segments) in added.items():
+            old = previous[key] = rollup.get(key)
+            if old is not None:
+                cost, runtime_ms, segments = old[0] + cost, old[1] + runtime_ms, old[2] + segments
+            rollup[key] = [cost, runtime_ms, segments]
+        return previous
+
+    def refresh_rollups(self):
+        last_id = self._rollup_last_id
+        records = self._records[last_id:]
+        if not records:
+            return 0
+        # 只记录这次修改的键原来的合计，回滚时逐个恢复，开销与新记录数成正比
+        previous = self._merge_rollup(self._rollup, records)
+        self._rollup_last_id = last_id + len(records)
+        self.on_rollback(lambda: self._restore_rollup(previous, last_id))
+        return len(records)
+
+    def _restore_rollup(self, previous, last_id):
+        for key, totals in previous.items():
+            if totals is None:
+                del self._rollup[key]
+            else:
+                self._rollup[key] = totals
+        self._rollup_last_id = last_id
+
+    def rebuild_rollups(self):
+        # 重建本来就要遍历全部记录，回滚时直接换回原来的字典
+        def restore(rollup=self._rollup, last_id=self._rollup_last_id):
+            self._rollup = rollup
+            self._rollup_last_id = last_id
+
+        self.on_rollback(restore)
+        self._rollup = {}
+        self._rollup_last_id = 0
+        return self.refresh_rollups()
+
+    def summary_rows(self, group='day', start_day=None, end_day=None, room_id=None, pending=False):
+        key_of = SUMMARY_KEYS[group]
+        # 写线程可能同时在添加新的键，先复制一份再遍历；合计的列表不会被原地修改
+        rollup = dict(self._rollup)
+        if pending:
+            self._merge_rollup(rollup, self._records[self._rollup_last_id:])
+        totals = {}
+        for (room, day, mode, fan_speed), (cost, runtime_ms, segments) in rollup.items():
+            if (start_day is not None and day < start_day or end_day is not None and day >= end_day
+                    or room_id is not None and room != room_id):
+                continue
+            key = key_of(room, day, mode, fan_speed)
+            total = totals.setdefault(key, [0.0, 0, 0])
+            total[0] += cost
+            total[1] += runtime_ms
+            total[2] += segments
+        return [(*key, *totals[key]) for key in sorted(totals)]
+
+    def verify_rollups(self, tolerance=1e-6):
+        expected = {}
+        self._add_to_rollup(expected, self._records[:self._rollup_last_id])
+        mismatched = []
+        for key in expected.keys() | self._rollup.keys():
+            a, b = expected.get(key), self._rollup.get(key)
+            if a is None or b is None or abs(a[0] - b[0]) > tolerance or a[1:] != b[1:]:
+                mismatched.append(key)
+        return sorted(mismatched)
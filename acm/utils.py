@@ -1,34 +1,33 @@
-from datetime import datetime
+from datetime import datetime, timezone
 
-fan_speed_mapping = {
-    "low": 1.0,
-    "mid": 1.2,
-    "high": 1.5
-}
+from .pricing import FAN_SPEEDS, FAN_SPEED_FACTORS, MODES, MODE_FACTORS, price_segment
 
-mode_mapping = {
-    "cool": 1.0,
-    "heat": 1.2
-}
+fan_speed_mapping = dict(zip(FAN_SPEEDS, FAN_SPEED_FACTORS))
+
+mode_mapping = dict(zip(MODES, MODE_FACTORS))
+
+
+def to_epoch_ms(time_text):
+    """把 ISO 格式的时间字符串转换为毫秒时间戳，不带时区的按 UTC 处理"""
+    value = datetime.fromisoformat(time_text.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def format_time(epoch_ms):
+    """把毫秒时间戳格式化为与 datetime('now') 相同的 UTC 时间字符串，没有时间时返回空字符串"""
+    if epoch_ms is None:
+        return ""
+    return datetime.fromtimestamp(epoch_ms / 1000, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
 
 def calculate_cost(start_time, end_time, temperature, fan_speed, mode):
     """
     计价标准：
     end_time-start_time: 每1小时记10
-    temperature: 以28度为基准，每相差一度加收2%
+    temperature: 以26度为基准，每相差一度加收2%
     fan_speed: "低" "中" "高" 依次乘上1.0/1.2/1.5
     mode: "制冷" "制热" 依次乘1.0/1.2
     """
-    # convert string to lower case
-    fan_speed = fan_speed.lower()
-    mode = mode.lower()
-
-    start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-    end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-    time_diff = end_time - start_time
-    time = time_diff.total_seconds() / 3600
-    print(time, temperature, fan_speed_mapping.get(fan_speed), mode_mapping.get(mode))
-    # 计算花费
-    cost = 10 * time * (abs(temperature - 26) * 0.02 + 1) * fan_speed_mapping.get(fan_speed) * mode_mapping.get(mode)
-    return cost
+    return price_segment(to_epoch_ms(start_time), to_epoch_ms(end_time), temperature, fan_speed, mode)
@@ -0,0 +1,133 @@
+"""
+后台维护前后热表的大小、报表结果和热点操作的耗时。
+
+用 ManualClock 模拟若干天的入住：客人住一到几天，期间开关空调、修改设置，
+其中一部分修改与当前设置相同，会产生可以合并的相邻时段。然后按保留期限执行一轮维护，
+比较维护前后的记录数、全部记录的费用之和、按房间的汇总，以及账单和按房间查报表的耗时，
+并检查入住累计、汇总表和事件日志的校验都没有不一致。
+
+    python -m benchmarks.bench_archive --days 60 --rooms 100 --retention-days 7
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import Manager, Settings  # noqa: E402
+from acm.clock import ManualClock  # noqa: E402
+from acm.maintenance import MaintenancePolicy  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+from acm.pricing import FAN_SPEEDS, MODES  # noqa: E402
+from benchmarks.common import write_results  # noqa: E402
+
+START_MS = 1_700_000_000_000
+
+
+def simulate(manager, clock, args, rng):
+    """每个房间每天有 changes 次操作，退房后马上有新客人入住"""
+    guests = {}
+    next_guest = 0
+    for day in range(args.days):
+        for room in range(args.rooms):
+            user_id = guests.get(room)
+            if user_id is not None and rng.random() < 0.3:
+                manager.checkout(user_id)
+                user_id = None
+            if user_id is None:
+                user_id = manager.create_user(f"guest{next_guest}", f"guest{next_guest}", 'x', 'x')
+                next_guest += 1
+                guests[room] = user_id
+                manager.turn_on_ac(manager.checkin(user_id))
+        for _ in range(args.changes):
+            clock.advance(seconds=86400 / args.changes)
+            for user_id in guests.values():
+                room_id = manager.get_room_id_by_user(user_id)
+                status = manager.check_status(room_id)
+                if not status[1]:
+                    manager.turn_on_ac(room_id)
+                elif rng.random() < 0.1:
+                    manager.turn_off_ac(room_id)
+                elif rng.random() < 0.5:
+                    # 与当前设置相同，不合并时会多出一段
+                    manager.set_ac(room_id, status[4])
+                else:
+                    manager.set_ac(room_id, Settings(temperature=rng.randint(18, 28), fan_speed=rng.choice(FAN_SPEEDS),
+                                                     mode=rng.choice(MODES)))
+    return list(guests.values())
+
+
+def measure(manager, guests, args):
+    with manager.db.cursor() as c:
+        c.execute("SELECT COUNT(*) FROM ac_usage_record")
+        hot = c.fetchone()[0]
+        c.execute("SELECT COUNT(*) FROM ac_usage_archive")
+        archived = c.fetchone()[0]
+        c.execute("SELECT COUNT(*), COALESCE(SUM(cost), 0), COALESCE(SUM(end_time - start_time), 0) FROM ac_usage_history")
+        records, cost, runtime_ms = c.fetchone()
+        c.execute("PRAGMA page_count")
+        pages = c.fetchone()[0]
+    bill_ms = []
+    for user_id in guests:
+        start = time.perf_counter()
+        manager.generate_bill(user_id)
+        bill_ms.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    for room_id in range(1, args.rooms + 1):
+        manager.report_rows(limit=100, room_id=room_id)
+    report_ms = (time.perf_counter() - start) * 1000 / args.rooms
+    summary = {item.room_id: item for item in manager.generate_summary('room')}
+    return {'hot': hot, 'archived': archived, 'records': records, 'cost': cost, 'runtime_ms': runtime_ms,
+            'pages': pages, 'bill_ms': statistics.median(bill_ms), 'room_report_ms': report_ms}, summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--changes', type=int, default=10, help='每个房间每天的操作数')
+    parser.add_argument('--retention-days', type=float, default=7)
+    parser.add_argument('--batch', type=int, default=100)
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    clock = ManualClock(START_MS)
+    manager = Manager(room_count=args.rooms, clock=clock, hasher=PasswordHasher(rounds=4))
+    start = time.perf_counter()
+    guests = simulate(manager, clock, args, random.Random(0))
+    simulate_s = time.perf_counter() - start
+    before, summary_before = measure(manager, guests, args)
+    stats = manager.run_maintenance(MaintenancePolicy(retention_days=args.retention_days, batch_stays=args.batch,
+                                                      pause_ms=0))
+    after, summary_after = measure(manager, guests, args)
+
+    problems = {'stays': len(manager.verify_stay_totals()), 'rollups': len(manager.verify_rollups()),
+                'events': len(manager.verify_events()), 'rooms': len(manager.verify_room_state())}
+    same_summary = summary_before.keys() == summary_after.keys() and all(
+        math.isclose(summary_before[room].cost, summary_after[room].cost, rel_tol=1e-9)
+        and summary_before[room].runtime_hours == summary_after[room].runtime_hours for room in summary_before)
+    consistent = (math.isclose(before['cost'], after['cost'], rel_tol=1e-9)
+                  and before['runtime_ms'] == after['runtime_ms'] and same_summary and not any(problems.values()))
+
+    print(f"simulated {args.days} day(s) in {simulate_s:.1f}s")
+    print(f"{'':>8} {'hot':>8} {'archive':>8} {'records':>8} {'pages':>7} {'bill ms':>8} {'room rpt ms':>11}")
+    for name, result in (('before', before), ('after', after)):
+        print(f"{name:>8} {result['hot']:>8} {result['archived']:>8} {result['records']:>8} {result['pages']:>7} "
+              f"{result['bill_ms']:>8.3f} {result['room_report_ms']:>11.3f}")
+    print(f"maintenance: {stats['stays']} stay(s) in {stats['batches']} batch(es), "
+          f"max batch {stats['max_batch_ms']:.1f} ms, total {stats['seconds']:.2f}s, freed {stats['freed_pages']} page(s)")
+    print(f"totals and summaries {'match' if consistent else 'DIFFER'}, verify {problems}")
+    print(write_results('bench_archive', vars(args),
+                        {'before': before, 'after': after, 'maintenance': stats, 'problems': problems,
+                         'consistent': consistent}, args.output))
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
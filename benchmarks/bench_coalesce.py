@@ -0,0 +1,165 @@
+"""
+设置修改合并窗口的写放大和账单一致性。
+
+用同一个随机种子生成客人的操作序列（入住、开关空调、连续快速修改设置、退房），
+分别交给不合并（coalesce_ms=0）和合并窗口为 --window-ms 的 Manager 执行，
+比较每一步的实时费用、退房账单总额以及按模式和风速的汇总，统计两边写入的使用记录数，
+以及 sqlite 存储实际写入的总行数：合并只省去使用记录，每次修改仍然写 rooms 和 ac_events，
+所以总行数的减少比使用记录少得多。内存存储没有行数统计，总行数显示为 -。
+不一致时退出码为 1，可以当作随机化的差分测试反复运行：
+
+    python -m benchmarks.bench_coalesce --seeds 200 --window-ms 5000 --storage sqlite memory
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import Manager, MemoryStorage, Settings  # noqa: E402
+from acm.clock import ManualClock  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+from benchmarks.common import write_results  # noqa: E402
+
+START_MS = 1_700_000_000_000
+FAN_SPEEDS = ('low', 'mid', 'high')
+MODES = ('cool', 'heat')
+
+
+def operations(rng, guests, steps):
+    """随机操作序列 (间隔毫秒, 操作, 客人序号, 参数)，设置修改多数是连续点按"""
+    ops = []
+    settings = Settings(temperature=25, fan_speed='low', mode='cool')
+    for _ in range(steps):
+        guest = rng.randrange(guests)
+        kind = rng.choices(('burst', 'set', 'on', 'off', 'checkout', 'cost'), (40, 20, 10, 10, 5, 15))[0]
+        if kind == 'burst':
+            # 几秒内连按，多数只改温度，间隔可能为 0，最后常常按回原来的设置
+            for _ in range(rng.randint(2, 10)):
+                if rng.random() < 0.7:
+                    settings = Settings(temperature=rng.randint(18, 28), fan_speed=settings.fan_speed,
+                                        mode=settings.mode)
+                else:
+                    settings = Settings(temperature=rng.randint(18, 28), fan_speed=rng.choice(FAN_SPEEDS),
+                                        mode=rng.choice(MODES))
+                ops.append((rng.choice((0, rng.randint(1, 1500))), 'set', guest, settings))
+        elif kind == 'set':
+            if rng.random() < 0.5:
+                settings = Settings(temperature=rng.randint(18, 28), fan_speed=rng.choice(FAN_SPEEDS),
+                                    mode=rng.choice(MODES))
+            ops.append((rng.randint(0, 3_600_000), 'set', guest, settings))
+        else:
+            ops.append((rng.randint(0, 600_000), kind, guest, None))
+    return ops
+
+
+def run(ops, guests, window_ms, storage_name):
+    os.chdir(tempfile.mkdtemp())
+    clock = ManualClock(START_MS)
+    storage = MemoryStorage() if storage_name == 'memory' else None
+    manager = Manager(clock=clock, storage=storage, hasher=PasswordHasher(rounds=4), coalesce_ms=window_ms)
+    users = [manager.create_user(f"guest{i}", f"guest{i}", 'x', 'x') for i in range(guests)]
+    rows_before = rows_written(manager.storage)
+    observed = []
+    set_seconds = 0.0
+    set_calls = 0
+    for delay, kind, guest, settings in ops:
+        clock.advance(seconds=delay / 1000)
+        user_id = users[guest]
+        room_id = manager.get_room_id_by_user(user_id)
+        if room_id == -1:
+            room_id = manager.checkin(user_id)
+        if kind == 'set':
+            start = time.perf_counter()
+            manager.set_ac(room_id, settings)
+            set_seconds += time.perf_counter() - start
+            set_calls += 1
+        elif kind == 'on':
+            manager.turn_on_ac(room_id)
+        elif kind == 'off':
+            manager.turn_off_ac(room_id)
+        elif kind == 'checkout':
+            observed.append(('checkout', user_id, manager.checkout(user_id)[0]))
+            # 下一次入住至少晚一毫秒，同一毫秒退房又入住时两次入住的记录无法区分
+            clock.advance(seconds=0.001)
+        else:
+            observed.append(('cost', user_id, manager.get_cost(user_id)))
+    for user_id in users:
+        if manager.get_room_id_by_user(user_id) != -1:
+            observed.append(('checkout', user_id, manager.checkout(user_id)[0]))
+    problems = {'events': len(manager.verify_events()), 'stays': len(manager.verify_stay_totals()),
+                'rooms': len(manager.verify_room_state())}
+    records = len(manager.storage.report_rows())
+    rows = rows_written(manager.storage)
+    rows = rows - rows_before if rows is not None else None
+    # 按模式和风速的汇总，合并的时段不能把费用记到别的设置下；不合并时零长度的时段单独成组，不参与比较
+    by_setting = {(item.mode, item.fan_speed): (item.cost, item.runtime_hours)
+                  for item in manager.generate_summary('setting') if item.runtime_hours}
+    manager.storage.close()
+    return observed, by_setting, (records, rows), problems, set_seconds / max(set_calls, 1)
+
+
+def rows_written(storage):
+    """sqlite 存储累计插入、修改和删除的行数，内存存储返回 None"""
+    db = getattr(storage, 'db', None)
+    return db.total_changes() if db is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seeds', type=int, default=50, help='随机操作序列的个数')
+    parser.add_argument('--steps', type=int, default=300, help='每个序列的操作数')
+    parser.add_argument('--guests', type=int, default=5)
+    parser.add_argument('--window-ms', type=int, default=5000)
+    parser.add_argument('--storage', nargs='+', choices=('sqlite', 'memory'), default=['memory'])
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    print(f"{'storage':>8} {'records':>8} {'merged':>8} {'ratio':>6} {'rows':>8} {'merged':>8} {'ratio':>6} "
+          f"{'set us':>7} {'merged us':>9} {'failures':>8}")
+    for storage_name in args.storage:
+        records = merged_records = failures = 0
+        rows = merged_rows = 0 if storage_name == 'sqlite' else None
+        set_us = merged_set_us = 0.0
+        for seed in range(args.seeds):
+            ops = operations(random.Random(seed), args.guests, args.steps)
+            expected, expected_settings, count, problems, set_s = run(ops, args.guests, 0, storage_name)
+            actual, actual_settings, merged_count, merged_problems, merged_set_s = run(ops, args.guests,
+                                                                                       args.window_ms, storage_name)
+            records += count[0]
+            merged_records += merged_count[0]
+            if rows is not None:
+                rows += count[1]
+                merged_rows += merged_count[1]
+            set_us += set_s * 1e6 / args.seeds
+            merged_set_us += merged_set_s * 1e6 / args.seeds
+            # 账单总额只允许浮点舍入误差
+            same = len(expected) == len(actual) and all(
+                a[:2] == b[:2] and math.isclose(a[2], b[2], rel_tol=1e-9, abs_tol=1e-9)
+                for a, b in zip(expected, actual)) and expected_settings.keys() == actual_settings.keys() and all(
+                math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+                for key in expected_settings for a, b in zip(expected_settings[key], actual_settings[key]))
+            if not same or any(problems.values()) or any(merged_problems.values()):
+                failures += 1
+                print(f"seed {seed}: totals {'match' if same else 'differ'}, {problems} / {merged_problems}")
+        failed = failed or failures > 0
+        results.append({'storage': storage_name, 'records': records, 'merged_records': merged_records,
+                        'ratio': merged_records / max(records, 1), 'rows': rows, 'merged_rows': merged_rows,
+                        'rows_ratio': merged_rows / max(rows, 1) if rows is not None else None,
+                        'set_us': set_us, 'merged_set_us': merged_set_us, 'failures': failures})
+        row_columns = (f"{rows:>8} {merged_rows:>8} {merged_rows / max(rows, 1):>6.2f}" if rows is not None
+                       else f"{'-':>8} {'-':>8} {'-':>6}")
+        print(f"{storage_name:>8} {records:>8} {merged_records:>8} {merged_records / max(records, 1):>6.2f} "
+              f"{row_columns} {set_us:>7.1f} {merged_set_us:>9.1f} {failures:>8}")
+    print(write_results('bench_coalesce', vars(args), results, args.output))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""
+事件日志的写入开销和重放速度。
+
+先用 ManualClock 驱动指定次数的 set_ac 产生事件和使用记录，统计每次写操作的耗时，
+再分别测量按当前计价规则重放全部事件（verify）和重建使用记录（rebuild）的耗时。
+
+    python -m benchmarks.bench_events --writes 100000 --storage sqlite memory
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import Manager, MemoryStorage, Settings  # noqa: E402
+from acm.clock import ManualClock  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+from benchmarks.common import write_results  # noqa: E402
+
+START_MS = 1_700_000_000_000
+
+
+def bench(storage_name, args):
+    os.chdir(tempfile.mkdtemp())
+    clock = ManualClock(START_MS)
+    storage = MemoryStorage() if storage_name == 'memory' else None
+    manager = Manager(room_count=args.rooms, clock=clock, storage=storage, hasher=PasswordHasher(rounds=4))
+    rooms = []
+    for i in range(args.rooms):
+        user_id = manager.create_user(f"bench{i}", f"bench{i}", 'x', 'x')
+        rooms.append(manager.checkin(user_id))
+        manager.turn_on_ac(rooms[-1])
+    start = time.perf_counter()
+    for i in range(args.writes):
+        clock.advance(seconds=60)
+        manager.set_ac(rooms[i % len(rooms)], Settings(temperature=18 + i % 10, fan_speed='low', mode='cool'))
+    write_s = time.perf_counter() - start
+    events = len(manager.storage.event_rows())
+
+    start = time.perf_counter()
+    mismatched = manager.verify_events()
+    verify_s = time.perf_counter() - start
+    start = time.perf_counter()
+    rebuilt = manager.rebuild_from_events()
+    rebuild_s = time.perf_counter() - start
+    manager.storage.close()
+    return {'storage': storage_name, 'events': events, 'write_us': write_s / args.writes * 1e6,
+            'verify_s': verify_s, 'verify_events_per_s': events / verify_s, 'mismatched': len(mismatched),
+            'rebuild_s': rebuild_s, 'rebuilt_records': rebuilt}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--storage', nargs='+', choices=('sqlite', 'memory'), default=['sqlite', 'memory'])
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'storage':>8} {'events':>8} {'write us':>9} {'verify s':>9} {'events/s':>10} {'rebuild s':>10}")
+    for storage_name in args.storage:
+        result = bench(storage_name, args)
+        results.append(result)
+        print(f"{storage_name:>8} {result['events']:>8} {result['write_us']:>9.1f} {result['verify_s']:>9.2f} "
+              f"{result['verify_events_per_s']:>10.0f} {result['rebuild_s']:>10.2f}")
+    print(write_results('bench_events', vars(args), results, args.output))
+
+
+if __name__ == '__main__':
+    main()
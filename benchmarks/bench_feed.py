@@ -0,0 +1,132 @@
+"""
+房间状态的变更推送与逐个房间轮询的对比。
+
+轮询：看板每次刷新对每个房间各查一次状态和费用（/ac/status、/ac/cost 对应的 check_status、get_cost），
+记录刷新一次全部房间的耗时和调用次数。
+
+推送：subscribers 个订阅者通过 ChangeBus 接收变更，同时执行 writes 次随机的写操作，
+比较有无订阅者时的写入吞吐量、每个订阅者收到的消息数，并检查每个订阅者用快照加变更
+还原出的房间状态与最后的快照一致。
+
+    python -m benchmarks.bench_feed --rooms 300 --subscribers 50 --writes 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import AsyncManager, Manager, MemoryStorage, Settings  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+from acm.pricing import FAN_SPEEDS, MODES  # noqa: E402
+from benchmarks.common import write_results  # noqa: E402
+
+
+def room_key(state):
+    return state['busy'], state['ac_on'], state['user_id'], state['start_time'], state['settings']
+
+
+async def consume(subscription, seq, rooms, done):
+    """按快照和变更维护房间状态，直到 done 被设置并且队列已空"""
+    state = {room['room_id']: room for room in rooms}
+    messages = 0
+    while not (done.is_set() and subscription.queue.empty()):
+        try:
+            message = await subscription.get(0.05)
+        except asyncio.TimeoutError:
+            continue
+        if message is None:
+            return state, messages, True
+        message_seq, changes = message
+        if message_seq > seq:
+            messages += 1
+            for room in changes:
+                state[room['room_id']] = room
+    return state, messages, False
+
+
+async def run(args, subscribers):
+    os.chdir(tempfile.mkdtemp())
+    storage = MemoryStorage() if args.storage == 'memory' else None
+    manager = Manager(room_count=args.rooms, storage=storage, hasher=PasswordHasher(rounds=4))
+    acm = AsyncManager(manager)
+    await acm.start()
+    rng = random.Random(args.seed)
+    users = [await acm.register_user(f"guest{i}", f"guest{i}", 'pw') for i in range(args.rooms)]
+    rooms = {}
+    for user_id in users:
+        rooms[user_id] = await acm.checkin(user_id)
+
+    # 看板刷新一次：每个房间一次状态查询和一次费用查询
+    start = time.perf_counter()
+    for user_id, room_id in rooms.items():
+        await acm.check_status(room_id)
+        await acm.get_cost(user_id)
+    poll_s = time.perf_counter() - start
+
+    done = asyncio.Event()
+    consumers = []
+    for _ in range(subscribers):
+        subscription = acm.subscribe()
+        seq, snapshot = await acm.room_snapshot()
+        consumers.append((subscription, asyncio.create_task(consume(subscription, seq, snapshot, done))))
+
+    async def write(user_id):
+        room_id = rooms[user_id]
+        kind = rng.choices(('on', 'off', 'set'), (30, 20, 50))[0]
+        if kind == 'on':
+            await acm.turn_on_ac(room_id)
+        elif kind == 'off':
+            await acm.turn_off_ac(room_id)
+        else:
+            await acm.set_ac(room_id, Settings(temperature=rng.randint(18, 28), fan_speed=rng.choice(FAN_SPEEDS),
+                                               mode=rng.choice(MODES)))
+
+    start = time.perf_counter()
+    for i in range(0, args.writes, args.concurrency):
+        await asyncio.gather(*(write(rng.choice(users)) for _ in range(min(args.concurrency, args.writes - i))))
+    write_s = time.perf_counter() - start
+    done.set()
+    results = await asyncio.gather(*(task for _, task in consumers))
+    for subscription, _ in consumers:
+        subscription.close()
+    _, final = await acm.room_snapshot()
+    mismatched = sum(1 for state, _, _ in results
+                     for room in final if room_key(state[room['room_id']]) != room_key(room))
+    await acm.close()
+    return {'poll_ms': poll_s * 1000, 'poll_calls': 2 * len(rooms), 'writes_per_s': args.writes / write_s,
+            'published': manager.bus.seq,
+            'messages_per_subscriber': sum(messages for _, messages, _ in results) / max(1, subscribers),
+            'dropped': sum(1 for _, _, dropped in results if dropped), 'mismatched': mismatched}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=300)
+    parser.add_argument('--subscribers', type=int, default=50)
+    parser.add_argument('--writes', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--storage', choices=('sqlite', 'memory'), default='sqlite')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    results = {}
+    for subscribers in (0, args.subscribers):
+        results[subscribers] = result = asyncio.run(run(args, subscribers))
+        print(f"{subscribers:>4} subscriber(s): {result['writes_per_s']:.0f} writes/s, "
+              f"{result['published']} change message(s), {result['messages_per_subscriber']:.0f} per subscriber, "
+              f"{result['dropped']} dropped, {result['mismatched']} mismatched room(s)")
+    poll = results[0]
+    print(f"polling: one refresh of {args.rooms} room(s) is {poll['poll_calls']} call(s), {poll['poll_ms']:.1f} ms")
+    ok = not any(result['mismatched'] for result in results.values())
+    print(write_results('bench_feed', vars(args), {str(key): value for key, value in results.items()}, args.output))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
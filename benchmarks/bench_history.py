@@ -0,0 +1,157 @@
+"""
+历史记录规模对计价、账单和报表的影响。
+
+对每个规模各建一个新数据库，写入指定条数的空调使用记录后，分别测量
+calculate_cost（与历史无关，作为对照）、generate_bill、checkout 和 generate_report 的耗时。
+退房的客人本身也有历史记录，账单只应读取本次入住的记录，耗时不随历史规模增长。
+
+    python -m benchmarks.bench_history --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import Manager  # noqa: E402
+from acm.clock import ManualClock  # noqa: E402
+from acm.pricing import FAN_SPEEDS, MODES, batch_costs, fan_speed_code, mode_code  # noqa: E402
+from acm.utils import calculate_cost  # noqa: E402
+from benchmarks.common import write_results  # noqa: E402
+
+START_MS = 1_700_000_000_000
+SEGMENT_MS = 30 * 60 * 1000
+CHUNK = 100_000
+
+
+def populate(manager, size, users, rng):
+    """写入 size 条属于其他客人的历史记录，按时间顺序排列"""
+    rooms = len(manager.rooms)
+    query = r"""
+    INSERT INTO ac_usage_record (user_id, room_id, start_time, end_time, temperature, fan_speed, mode, cost)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+    for offset in range(0, size, CHUNK):
+        rows = []
+        for i in range(offset, min(size, offset + CHUNK)):
+            start = START_MS + i * 1000
+            rows.append((rng.randint(2, users + 1), rng.randint(1, rooms), start, start + SEGMENT_MS,
+                         rng.randint(18, 30), rng.choice(FAN_SPEEDS), rng.choice(MODES), 5.0))
+        with manager.db.transaction() as c:
+            c.executemany(query, rows)
+
+
+def stay(manager, clock, segments):
+    """客人 1 入住并产生 segments 段使用记录，返回其 user_id"""
+    user_id = manager.create_user('bench', 'bench', 'x', 'x')
+    room_id = manager.checkin(user_id)
+    manager.turn_on_ac(room_id)
+    for i in range(segments):
+        clock.advance(seconds=600)
+        settings = manager.check_status(room_id)[4].model_copy(update={'temperature': 18 + i % 10})
+        manager.set_ac(room_id, settings)
+    return user_id
+
+
+def checkout_times(manager, clock, count, segments):
+    """count 位客人各入住一次后依次退房，返回每次退房的耗时，单位秒"""
+    # 用户 id 从 2 开始，与 populate 写入的历史记录属于同一批客人
+    guests = [manager.create_user(f'guest{i}', f'guest{i}', 'x', 'x') for i in range(count)]
+    for user_id in guests:
+        room_id = manager.checkin(user_id)
+        manager.turn_on_ac(room_id)
+        for i in range(segments):
+            clock.advance(seconds=60)
+            manager.set_ac(room_id, manager.check_status(room_id)[4].model_copy(update={'temperature': 18 + i % 10}))
+    times = []
+    for user_id in guests:
+        start = time.perf_counter()
+        manager.checkout(user_id)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def best_of(fn, repeat):
+    """多次运行取最快的一次，单位秒"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_pricing(rows):
+    number = 20000
+    per_call = timeit.timeit(lambda: calculate_cost('2023-11-14 22:00:00', '2023-11-14 23:30:00', 22, 'high', 'cool'),
+                             number=number) / number
+    rng = random.Random(0)
+    start = [START_MS + i * 1000 for i in range(rows)]
+    end = [s + SEGMENT_MS for s in start]
+    temperatures = [rng.randint(18, 30) for _ in range(rows)]
+    fans = [fan_speed_code(rng.choice(FAN_SPEEDS)) for _ in range(rows)]
+    modes = [mode_code(rng.choice(MODES)) for _ in range(rows)]
+    batch = best_of(lambda: batch_costs(start, end, temperatures, fans, modes), 3)
+    return {'calculate_cost_us': per_call * 1e6, 'batch_costs_rows': rows, 'batch_costs_ms': batch * 1000,
+            'batch_costs_ns_per_row': batch / rows * 1e9}
+
+
+def bench_size(size, args):
+    os.chdir(tempfile.mkdtemp())
+    rng = random.Random(args.seed)
+    clock = ManualClock(START_MS + size * 1000)
+    manager = Manager(clock=clock)
+    start = time.perf_counter()
+    populate(manager, size, args.users, rng)
+    populate_s = time.perf_counter() - start
+    user_id = stay(manager, clock, args.bill_segments)
+
+    results = {'rows': size, 'populate_s': populate_s}
+    results['generate_bill_ms'] = best_of(lambda: manager.generate_bill(user_id), args.repeat) * 1000
+    checkouts = checkout_times(manager, clock, args.checkouts, args.bill_segments)
+    results['checkout_min_ms'] = min(checkouts) * 1000
+    results['checkout_median_ms'] = statistics.median(checkouts) * 1000
+    results['report_first_page_ms'] = best_of(lambda: manager.generate_report(limit=args.page), args.repeat) * 1000
+    results['report_deep_page_ms'] = best_of(
+        lambda: manager.generate_report(after_id=size // 2, limit=args.page), args.repeat) * 1000
+    results['report_room_page_ms'] = best_of(
+        lambda: manager.generate_report(room_id=1, limit=args.page), args.repeat) * 1000
+    if args.full_report:
+        results['report_full_iter_s'] = best_of(lambda: sum(len(rows) for rows in manager.iter_report()), 1)
+    manager.db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--users', type=int, default=1000, help='历史记录分属的客人数')
+    parser.add_argument('--bill-segments', type=int, default=50, help='被测客人本次入住的记录数')
+    parser.add_argument('--checkouts', type=int, default=20, help='测量退房耗时的客人数')
+    parser.add_argument('--page', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--full-report', action='store_true', help='同时测量逐块读取全部记录的耗时')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    pricing = bench_pricing(max(args.sizes))
+    print(f"calculate_cost {pricing['calculate_cost_us']:.2f} us/call, "
+          f"batch_costs {pricing['batch_costs_ns_per_row']:.1f} ns/row")
+    sizes = []
+    print(f"{'rows':>9} {'bill ms':>9} {'checkout':>9} {'first ms':>9} {'deep ms':>9} {'room ms':>9}")
+    for size in args.sizes:
+        results = bench_size(size, args)
+        sizes.append(results)
+        print(f"{size:>9} {results['generate_bill_ms']:>9.3f} {results['checkout_median_ms']:>9.3f} "
+              f"{results['report_first_page_ms']:>9.3f} {results['report_deep_page_ms']:>9.3f} "
+              f"{results['report_room_page_ms']:>9.3f}")
+    print(write_results('bench_history', vars(args), {'pricing': pricing, 'sizes': sizes}, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+登录吞吐量基准测试。
+
+在不同的 bcrypt 并发度下并发登录，统计每秒登录数，
+同时不断调用 check_status，观察哈希负载对其他接口延迟的影响。
+
+    python -m benchmarks.bench_passwords --rounds 10 --logins 64
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import AsyncManager, Manager  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+
+
+async def run(workers, rounds, logins):
+    # 每一轮使用新的数据库
+    os.chdir(tempfile.mkdtemp())
+    hasher = PasswordHasher(rounds=rounds, max_workers=workers, max_pending=logins)
+    manager = AsyncManager(Manager(hasher=hasher))
+    user_id = await manager.register_user('bench', 'bench', 'password')
+    room_id = await manager.checkin(user_id)
+    status_latencies = []
+    done = False
+
+    async def poll_status():
+        while not done:
+            start = time.perf_counter()
+            await manager.check_status(room_id)
+            status_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.001)
+
+    poller = asyncio.create_task(poll_status())
+    start = time.perf_counter()
+    await asyncio.gather(*[manager.login('bench', 'password') for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    done = True
+    await poller
+    await manager.close()
+    hasher.close()
+    status_latencies.sort()
+    p99 = status_latencies[int(len(status_latencies) * 0.99) - 1] if status_latencies else 0.0
+    return logins / elapsed, statistics.median(status_latencies), p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    workers = 1
+    print(f"{'workers':>8} {'logins/s':>10} {'status p50 ms':>14} {'status p99 ms':>14}")
+    while workers <= args.max_workers:
+        throughput, p50, p99 = asyncio.run(run(workers, args.rounds, args.logins))
+        print(f"{workers:>8} {throughput:>10.1f} {p50 * 1000:>14.3f} {p99 * 1000:>14.3f}")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
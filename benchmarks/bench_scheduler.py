@@ -0,0 +1,194 @@
+"""
+送风调度的决策耗时，以及接入 Manager 后的服务约束和计费。
+
+第一部分直接驱动 ServiceScheduler：几千个房间随机开关、改风速，时钟随机前进并轮转，
+统计每次调度的微秒数，并定期检查队列的约束。
+
+第二部分用 ManualClock 模拟一段时间的入住和空调操作，Manager 启用 capacity 个服务位的调度，
+每一步检查：送风的房间数不超过 capacity、等待中的房间优先级不高于任何送风的房间，
+最后检查计费的运行时间不超过 capacity × 经过的时间、事件日志重放一致，
+并换一个服务位数重新打开同一个存储，检查恢复后的队列同样满足约束。
+
+    python -m benchmarks.bench_scheduler --rooms 1000 10000 --capacity 3 --guests 30 --hours 48
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import Manager, MemoryStorage, Settings  # noqa: E402
+from acm.clock import ManualClock  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+from acm.pricing import FAN_SPEEDS, MODES, fan_speed_code  # noqa: E402
+from acm.rooms import AC_WAITING  # noqa: E402
+from acm.scheduler import ServiceScheduler  # noqa: E402
+from benchmarks.common import write_results  # noqa: E402
+
+START_MS = 1_700_000_000_000
+
+
+def queue_problems(scheduler):
+    """队列违反的约束，正常时为空列表"""
+    problems = []
+    if len(scheduler.serving) > scheduler.capacity:
+        problems.append('over capacity')
+    if scheduler.waiting and len(scheduler.serving) < scheduler.capacity:
+        problems.append('idle slot')
+    if scheduler.waiting and scheduler.serving:
+        top = max(-entry[0] for entry in scheduler.waiting.values())
+        low = min(entry[0] for entry in scheduler.serving.values())
+        if top > low:
+            problems.append('priority inversion')
+    return problems
+
+
+def bench_decisions(rooms, capacity, ops, rng):
+    """
+    随机请求、释放和轮转，返回每次调度的耗时（微秒）统计。
+    时间片到期时一次 tick 会轮转很多房间，所以同时给出平均每个调度决定的耗时
+    """
+    scheduler = ServiceScheduler(capacity, 120_000)
+    now = START_MS
+    active = set()
+    timings = {'request': [], 'release': [], 'tick': []}
+    decisions = Counter()
+    problems = Counter()
+    for i in range(ops):
+        now += rng.randint(0, 5_000)
+        room_id = rng.randrange(rooms)
+        kind = rng.choices(('request', 'release', 'tick'), (60, 25, 15))[0]
+        start = time.perf_counter()
+        if kind == 'request':
+            result = scheduler.request(room_id, rng.randrange(3), now)
+            active.add(room_id)
+        elif kind == 'release':
+            result = scheduler.release(room_id, now)
+            active.discard(room_id)
+        else:
+            result = scheduler.tick(now)
+        timings[kind].append((time.perf_counter() - start) * 1e6)
+        decisions[kind] += len(result)
+        if i % 1000 == 0:
+            problems.update(queue_problems(scheduler))
+    return {kind: {'count': len(values), 'mean_us': statistics.fmean(values),
+                   'p99_us': sorted(values)[int(len(values) * 0.99)],
+                   'us_per_decision': sum(values) / max(1, decisions[kind])}
+            for kind, values in timings.items() if values}, {'active': len(active), 'problems': dict(problems)}
+
+
+def room_problems(manager):
+    """按 Manager 的房间状态检查服务约束"""
+    serving = [room for room in manager.rooms if room.busy and room.ac_on == 1]
+    waiting = [room for room in manager.rooms if room.busy and room.ac_on == AC_WAITING]
+    problems = []
+    if len(serving) > manager.scheduler.capacity:
+        problems.append('over capacity')
+    if waiting and serving and (max(fan_speed_code(room.fan_speed) for room in waiting)
+                                > min(fan_speed_code(room.fan_speed) for room in serving)):
+        problems.append('priority inversion')
+    return problems
+
+
+def simulate(args, rng):
+    clock = ManualClock(START_MS)
+    storage = MemoryStorage()
+    manager = Manager(clock=clock, storage=storage, hasher=PasswordHasher(rounds=4),
+                      scheduler=ServiceScheduler(args.capacity, int(args.time_slice_s * 1000)))
+    guests = []
+    for i in range(args.guests):
+        user_id = manager.create_user(f"guest{i}", f"guest{i}", 'x', 'x')
+        manager.checkin(user_id)
+        guests.append(user_id)
+    problems = Counter()
+    # 各优先级送风和等待的累计时间（房间·毫秒）
+    served_ms = Counter()
+    waiting_ms = Counter()
+    end = START_MS + int(args.hours * 3_600_000)
+    steps = 0
+    while clock.now_ms() < end:
+        step_ms = rng.randint(1_000, 60_000)
+        for room in manager.rooms:
+            if room.busy and room.ac_on:
+                counter = served_ms if room.ac_on == 1 else waiting_ms
+                counter[room.fan_speed] += step_ms
+        clock.advance(seconds=step_ms / 1000)
+        manager.tick_scheduler_if_due()
+        user_id = rng.choice(guests)
+        room_id = manager.get_room_id_by_user(user_id)
+        kind = rng.choices(('on', 'off', 'set', 'checkout'), (40, 15, 40, 5))[0]
+        if kind == 'on':
+            manager.turn_on_ac(room_id)
+        elif kind == 'off':
+            manager.turn_off_ac(room_id)
+        elif kind == 'set':
+            manager.set_ac(room_id, Settings(temperature=rng.randint(18, 28), fan_speed=rng.choice(FAN_SPEEDS),
+                                             mode=rng.choice(MODES)))
+        else:
+            manager.checkout(user_id)
+            # 下一位客人晚一秒入住，同一毫秒退房又入住时两次入住的记录无法区分
+            clock.advance(seconds=1)
+            manager.checkin(user_id)
+        problems.update(room_problems(manager))
+        steps += 1
+    elapsed_ms = clock.now_ms() - START_MS
+    billed_ms = sum(row[4] - row[3] for row in manager.report_rows())
+    billed_ms += sum(clock.now_ms() - room.start_time for room in manager.rooms if room.busy and room.ac_on == 1)
+    checks = {'steps': steps, 'problems': dict(problems), 'events': len(manager.verify_events()),
+              'stays': len(manager.verify_stay_totals()), 'rooms': len(manager.verify_room_state()),
+              'billed_hours': billed_ms / 3_600_000, 'capacity_hours': args.capacity * elapsed_ms / 3_600_000}
+    share = {speed: served_ms[speed] / (served_ms[speed] + waiting_ms[speed])
+             for speed in FAN_SPEEDS if served_ms[speed] + waiting_ms[speed]}
+    # 服务位减少后重新打开，恢复的队列应立即满足约束
+    reopened = Manager(clock=clock, storage=storage, hasher=PasswordHasher(rounds=4),
+                       scheduler=ServiceScheduler(max(1, args.capacity - 1), int(args.time_slice_s * 1000)))
+    checks['reopened'] = room_problems(reopened) + queue_problems(reopened.scheduler)
+    checks['reopened_events'] = len(reopened.verify_events())
+    return checks, share
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--ops', type=int, default=100000, help='第一部分每种房间数的调度次数')
+    parser.add_argument('--capacity', type=int, default=3)
+    parser.add_argument('--time-slice-s', type=float, default=120)
+    parser.add_argument('--guests', type=int, default=30)
+    parser.add_argument('--hours', type=float, default=48)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+
+    decisions = {}
+    ok = True
+    for rooms in args.rooms:
+        # 服务位按房间数的十分之一，排队和抢占都会频繁发生
+        timings, state = bench_decisions(rooms, max(1, rooms // 10), args.ops, random.Random(args.seed))
+        decisions[rooms] = {'timings': timings, **state}
+        ok = ok and not state['problems']
+        print(f"{rooms:>6} rooms: " + ', '.join(f"{kind} {result['mean_us']:.1f} us (p99 {result['p99_us']:.1f}, "
+                                                 f"{result['us_per_decision']:.2f} per decision)"
+                                                 for kind, result in timings.items())
+              + f", {state['active']} active, problems {state['problems']}")
+
+    checks, share = simulate(args, random.Random(args.seed))
+    ok = (ok and not checks['problems'] and not checks['reopened'] and not checks['events']
+          and not checks['reopened_events'] and not checks['stays'] and not checks['rooms']
+          and checks['billed_hours'] <= checks['capacity_hours'] + 1e-9)
+    print(f"simulation: {checks['steps']} step(s), billed {checks['billed_hours']:.1f} h of "
+          f"{checks['capacity_hours']:.1f} h capacity")
+    print('served share: ' + ', '.join(f"{speed} {value:.0%}" for speed, value in share.items()))
+    print(f"checks {'pass' if ok else 'FAIL'}: {checks}")
+    print(write_results('bench_scheduler', vars(args),
+                        {'decisions': decisions, 'simulation': checks, 'served_share': share, 'ok': ok}, args.output))
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
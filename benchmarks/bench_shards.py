@@ -0,0 +1,89 @@
+"""
+分片写吞吐量基准测试。
+
+按 1、2、4…… 个进程分别运行，每个进程只打开自己的一个分片，
+为本分片的客人办理入住后不断修改空调设置，统计全部进程合计的每秒写操作数。
+
+    python -m benchmarks.bench_shards --max-processes 8 --writes 5000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import write_results  # noqa: E402
+
+
+def worker(directory, shard_count, shard, guests, writes, synchronous, ready, start):
+    os.chdir(directory)
+    from acm.data import Settings
+    from acm.sharding import ShardMap, open_shard
+
+    shard_map = ShardMap(shard_count, max(guests, 50))
+    manager = open_shard(shard_map, shard)
+    manager.db.synchronous = synchronous
+    # 已借出的连接全部归还并关闭，之后新建的连接使用新的同步级别
+    manager.db.close()
+    # 目录库中为本分片注册客人，user_id 取模后落在本分片
+    users = []
+    while len(users) < guests:
+        name = f"s{shard}-{time.time_ns()}"
+        user_id = manager.create_user(name, name, 'x', 'x')
+        if user_id > 0 and shard_map.shard_of_user(user_id) == shard:
+            users.append(user_id)
+    rooms = [manager.checkin(user_id) for user_id in users]
+    for room_id in rooms:
+        manager.turn_on_ac(room_id)
+    ready.wait()
+    start.wait()
+    begin = time.perf_counter()
+    for i in range(writes):
+        settings = Settings(temperature=18 + i % 10, fan_speed='low', mode='cool')
+        manager.set_ac(rooms[i % len(rooms)], settings)
+    return time.perf_counter() - begin
+
+
+def run(processes, args):
+    directory = tempfile.mkdtemp()
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as sync:
+        ready = sync.Barrier(processes + 1)
+        start = sync.Barrier(processes + 1)
+        with context.Pool(processes) as pool:
+            results = [pool.apply_async(worker, (directory, processes, shard, args.guests, args.writes,
+                                                 args.synchronous, ready, start))
+                       for shard in range(processes)]
+            ready.wait()
+            begin = time.perf_counter()
+            start.wait()
+            [result.get() for result in results]
+            elapsed = time.perf_counter() - begin
+    return processes * args.writes / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--writes', type=int, default=3000, help='每个进程的写操作数')
+    parser.add_argument('--guests', type=int, default=50, help='每个分片的客人数')
+    parser.add_argument('--synchronous', default='NORMAL')
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    results = []
+    processes = 1
+    print(f"{'shards':>7} {'writes/s':>10} {'speedup':>8}")
+    while processes <= args.max_processes:
+        throughput = run(processes, args)
+        results.append({'shards': processes, 'writes_per_s': throughput})
+        print(f"{processes:>7} {throughput:>10.0f} {throughput / results[0]['writes_per_s']:>8.2f}")
+        processes *= 2
+    print(write_results('bench_shards', vars(args), results, args.output))
+
+
+if __name__ == '__main__':
+    main()
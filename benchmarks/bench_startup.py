@@ -0,0 +1,79 @@
+"""
+启动耗时基准测试。
+
+每次测量都在新的子进程中进行，分别统计：
+import    导入 main（不打开数据库）
+cold      在空目录中执行 lifespan 启动，包括建库、迁移和创建房间
+warm      数据库已是最新版本时再次启动
+
+    python -m benchmarks.bench_startup --rooms 50000 --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import write_results  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = r"""
+import time
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start)
+"""
+
+STARTUP_SCRIPT = r"""
+import asyncio, sys, time
+import main
+from acm import Manager
+rooms = int(sys.argv[1])
+# 与 lifespan 相同的启动过程，房间数由参数指定
+async def start():
+    begin = time.perf_counter()
+    manager = await asyncio.to_thread(Manager, rooms)
+    main.app.state.acm = main.ACManager(manager)
+    elapsed = time.perf_counter() - begin
+    await main.app.state.acm.close()
+    return elapsed
+print(asyncio.run(start()))
+"""
+
+
+def measure(script, cwd, *args):
+    env = {**os.environ, 'PYTHONPATH': ROOT}
+    output = subprocess.run([sys.executable, '-c', script, *map(str, args)], cwd=cwd, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def summary(times):
+    return {'min_ms': min(times) * 1000, 'median_ms': statistics.median(times) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    import_times, cold_times, warm_times = [], [], []
+    for _ in range(args.repeat):
+        directory = tempfile.mkdtemp()
+        import_times.append(measure(IMPORT_SCRIPT, directory))
+        cold_times.append(measure(STARTUP_SCRIPT, directory, args.rooms))
+        warm_times.append(measure(STARTUP_SCRIPT, directory, args.rooms))
+    results = {'import': summary(import_times), 'cold': summary(cold_times), 'warm': summary(warm_times)}
+    for name, stats in results.items():
+        print(f"{name:>7} min {stats['min_ms']:>9.1f} ms  median {stats['median_ms']:>9.1f} ms")
+    print(write_results('bench_startup', vars(args), results, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+基准测试共用的统计和结果输出。
+"""
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(sorted_values, q):
+    """最近秩法求分位数，sorted_values 需已排序"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    """延迟列表（秒）的统计，结果以毫秒表示"""
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 0.50) * 1000,
+        'p95_ms': percentile(values, 0.95) * 1000,
+        'p99_ms': percentile(values, 0.99) * 1000,
+        'max_ms': (values[-1] if values else 0.0) * 1000,
+    }
+
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+    except OSError:
+        revision = ''
+    return {
+        'python': sys.version.split()[0],
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'revision': revision,
+    }
+
+
+def write_results(name, params, results, output=None):
+    """把一次运行的参数、环境和结果写成 JSON，返回文件路径"""
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as f:
+        json.dump({'benchmark': name, 'params': params, 'environment': environment(), 'results': results}, f,
+                  indent=2)
+    return output
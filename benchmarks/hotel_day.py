@@ -0,0 +1,163 @@
+"""
+模拟酒店一天的负载测试。
+
+每位客人依次注册、登录、入住（之后的请求带登录返回的令牌），然后按比例随机调节空调、查询状态和费用，最后退房。
+默认在进程内直接调用 main.py 中的 app，指定 --url 时改为请求已经启动的服务（例如本地 uvicorn）。
+输出每个接口的 p50/p95/p99 延迟和整体吞吐量，并把结果写入 JSON 文件。
+
+    python -m benchmarks.hotel_day --rooms 200 --guests 400 --concurrency 32
+    python -m benchmarks.hotel_day --url http://127.0.0.1:8000 --guests 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm.pricing import FAN_SPEEDS, MODES  # noqa: E402
+from benchmarks.common import latency_summary, write_results  # noqa: E402
+
+# 入住期间每个动作的权重
+ACTION_WEIGHTS = {
+    'settings': 35,
+    'status': 25,
+    'cost': 20,
+    'toggle': 20,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, endpoint, json=None, token=None):
+        start = time.perf_counter()
+        headers = {'Authorization': f"Bearer {token}"} if token is not None else None
+        try:
+            response = await client.post(endpoint, json=json, headers=headers)
+        except httpx.HTTPError:
+            self.errors[endpoint] += 1
+            return None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code != 200:
+            self.errors[endpoint] += 1
+            return None
+        return response.json()
+
+
+async def guest_day(client, recorder, rng, guest, actions, think):
+    name = f"guest-{guest}-{rng.getrandbits(32):08x}"
+    registered = await recorder.call(client, '/user/register', {'name': name, 'phone': name, 'password': 'password'})
+    if not registered or registered['user_id'] < 0:
+        return 'register_failed'
+    user_id = registered['user_id']
+    logged_in = await recorder.call(client, '/login', {'name': name, 'password': 'password'})
+    if not logged_in:
+        return 'login_failed'
+    token = logged_in['token']
+    checked_in = await recorder.call(client, '/checkin', {'user_id': user_id}, token)
+    if not checked_in or checked_in['room_id'] < 0:
+        return 'no_room'
+    room_id = checked_in['room_id']
+    await recorder.call(client, '/ac/on', {'room_id': room_id}, token)
+    ac_on = True
+    names, weights = zip(*ACTION_WEIGHTS.items())
+    for action in rng.choices(names, weights, k=actions):
+        if think:
+            await asyncio.sleep(rng.expovariate(1 / think))
+        if action == 'settings':
+            settings = {'temperature': rng.randint(18, 30), 'fan_speed': rng.choice(FAN_SPEEDS),
+                        'mode': rng.choice(MODES)}
+            await recorder.call(client, '/ac/settings', {'room_id': room_id, 'settings': settings}, token)
+        elif action == 'status':
+            await recorder.call(client, '/ac/status', {'room_id': room_id}, token)
+        elif action == 'cost':
+            await recorder.call(client, '/ac/cost', {'user_id': user_id}, token)
+        else:
+            await recorder.call(client, '/ac/off' if ac_on else '/ac/on', {'room_id': room_id}, token)
+            ac_on = not ac_on
+    await recorder.call(client, '/checkout', {'user_id': user_id}, token)
+    return 'completed'
+
+
+async def run(args):
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            return await simulate(client, args)
+    # 进程内运行时使用临时目录中的新数据库，ASGITransport 不会触发 lifespan，需要手动进入
+    os.chdir(tempfile.mkdtemp())
+    if args.storage == 'memory':
+        os.environ['ACM_STORAGE'] = 'memory'
+    import main
+    from acm.passwords import PasswordHasher
+    async with main.lifespan(main.app):
+        manager = main.app.state.acm.manager
+        manager.hasher = PasswordHasher(rounds=args.bcrypt_rounds)
+        if len(manager.rooms) < args.rooms:
+            manager.add_rooms(args.rooms - len(manager.rooms))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://hotel', timeout=60) as client:
+            return await simulate(client, args)
+
+
+async def simulate(client, args):
+
+    recorder = Recorder()
+    outcomes = defaultdict(int)
+    guests = iter(range(args.guests))
+
+    async def worker(index):
+        rng = random.Random(args.seed * 1000003 + index)
+        for guest in guests:
+            outcomes[await guest_day(client, recorder, rng, guest, args.actions, args.think_ms / 1000)] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(index) for index in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        'elapsed_s': elapsed,
+        'requests': requests,
+        'requests_per_s': requests / elapsed if elapsed else 0.0,
+        'guests': dict(outcomes),
+        'endpoints': {endpoint: {**latency_summary(latencies), 'errors': recorder.errors[endpoint]}
+                      for endpoint, latencies in sorted(recorder.latencies.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='已启动服务的地址，不指定时在进程内运行 main.app')
+    parser.add_argument('--rooms', type=int, default=100, help='进程内运行时的房间数')
+    parser.add_argument('--guests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--actions', type=int, default=20, help='每位客人入住期间的动作数')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='动作之间的平均间隔')
+    parser.add_argument('--storage', choices=('sqlite', 'memory'), default='sqlite',
+                        help='进程内运行时的存储引擎，memory 用于区分存储和 API 层各自的延迟')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help='进程内运行时的 bcrypt 工作因子')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果 JSON 路径，默认写入 benchmarks/results/')
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"{results['requests']} requests in {results['elapsed_s']:.2f}s "
+          f"({results['requests_per_s']:.1f} req/s), guests {results['guests']}")
+    print(f"{'endpoint':<16} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, stats in results['endpoints'].items():
+        print(f"{endpoint:<16} {stats['count']:>7} {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['errors']:>7}")
+    print(write_results('hotel_day', vars(args), results, args.output))
+
+
+if __name__ == '__main__':
+    main()
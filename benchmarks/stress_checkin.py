@@ -0,0 +1,87 @@
+"""
+并发入住压力测试。
+
+两个 Manager 实例共享同一个数据库文件（模拟两个进程，各自的分配器互不知情），
+多个线程同时把每位客人的入住请求分别发给两个实例，每位客人只能有一个实例入住成功，
+另一个返回 -2；再退房一部分后重新入住，最后检查没有任何房间被重复分配，内存状态与 rooms 表一致。
+
+    python -m benchmarks.stress_checkin --rooms 2000 --threads 16
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import Manager  # noqa: E402
+from acm.allocator import FreeRoomAllocator  # noqa: E402
+
+
+def check_assignments(manager, expected_users):
+    with manager.db.cursor() as c:
+        c.execute("SELECT id, user_id FROM rooms WHERE busy = 1")
+        rows = c.fetchall()
+    users = [user_id for _, user_id in rows]
+    assert len(users) == len(set(users)), "a user holds more than one room"
+    assert set(users) == set(expected_users), "busy rooms do not match checked-in users"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rooms', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--policy', default='lowest', choices=FreeRoomAllocator.POLICIES)
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+
+    first = Manager(allocator=FreeRoomAllocator(args.policy))
+    with first.db.transaction():
+        first.add_rooms(args.rooms - len(first.rooms))
+        user_ids = [first.create_user(f"guest{i}", f"phone{i}", "-", "-") for i in range(args.rooms + 10)]
+    second = Manager(allocator=FreeRoomAllocator(args.policy))
+    managers = (first, second)
+
+    # 同一位客人的两个请求相邻提交，两个实例几乎同时处理
+    requests = [(manager, user_id) for user_id in user_ids for manager in managers]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = list(pool.map(lambda item: item[0].checkin(item[1]), requests))
+    elapsed = time.perf_counter() - start
+    rooms = []
+    owners = {}
+    for i, user_id in enumerate(user_ids):
+        outcome = results[2 * i:2 * i + 2]
+        succeeded = [k for k, room_id in enumerate(outcome) if room_id > 0]
+        if succeeded:
+            assert len(succeeded) == 1 and -2 in outcome, f"user {user_id} checked in twice: {outcome}"
+            owners[user_id] = managers[succeeded[0]]
+            rooms.append(outcome[succeeded[0]])
+        else:
+            assert outcome == [-1, -1], f"user {user_id} got {outcome}"
+    assert len(rooms) == len(set(rooms)) == args.rooms, "room assigned twice or rooms left over"
+    checked_in = list(owners)
+    check_assignments(first, checked_in)
+    print(f"{len(requests)} check-ins in {elapsed:.3f}s ({len(requests) / elapsed:.0f}/s), "
+          f"one success per user, no double assignment")
+
+    # 由办理入住的实例退房，保证两边的内存状态各自正确
+    leaving = [(owners[user_id], user_id) for i, user_id in enumerate(checked_in) if i % 4 == 0]
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(lambda item: item[0].checkout(item[1]), leaving))
+    left = {user_id for _, user_id in leaving}
+    # 重新入住的请求同样同时发给两个实例
+    returning = sorted(left)
+    with ThreadPoolExecutor(args.threads) as pool:
+        results = list(pool.map(lambda item: item[0].checkin(item[1]),
+                                [(manager, user_id) for user_id in returning for manager in managers]))
+    rooms = [room_id for room_id in results if room_id > 0]
+    assert len(rooms) == len(returning) == results.count(-2) and len(set(rooms)) == len(rooms)
+    check_assignments(first, checked_in)
+    print(f"{len(leaving)} checkouts and re-check-ins, no double assignment")
+
+
+if __name__ == '__main__':
+    main()
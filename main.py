@@ -1,11 +1,86 @@
-from fastapi import FastAPI
+import asyncio
+import csv
+import io
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Path, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from acm import Manager as ACManager
+from acm import AsyncManager as ACManager, Manager, MemoryStorage, PoolTimeout
 from acm.data import *
-
-app = FastAPI()
-acm_db = ACManager()
+from acm.maintenance import MaintenancePolicy, maintenance_loop
+from acm.metrics import HTTP_LATENCY, REGISTRY
+from acm.passwords import HasherBusy
+from acm.rollups import MS_PER_DAY
+from acm.scheduler import ServiceScheduler, scheduler_loop
+from acm.sessions import STAFF
+from acm.sharding import ShardedManager, ShardFull, ShardMap, ShardNotOwned, ShardReader
+from acm.utils import format_time, to_epoch_ms
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 建库、迁移和创建房间放在启动阶段完成，导入 main 不再打开数据库
+    shard_map = ShardMap.from_env()
+    app.state.shard_map = shard_map
+    app.state.shard_reader = None
+    # ACM_COALESCE_MS 为设置修改的合并窗口，默认 0 不合并
+    coalesce_ms = int(os.environ.get("ACM_COALESCE_MS", 0))
+    # ACM_AC_CAPACITY 为中央空调同时送风的房间数，设置后开启送风调度，ACM_TIME_SLICE_S 为同优先级轮转的时间片
+    capacity = int(os.environ.get("ACM_AC_CAPACITY") or 0)
+    scheduler = None
+    if capacity > 0:
+        if shard_map is not None:
+            raise RuntimeError("ACM_AC_CAPACITY is not supported with sharding")
+        scheduler = ServiceScheduler(capacity, int(float(os.environ.get("ACM_TIME_SLICE_S", 120)) * 1000))
+    if shard_map is None:
+        # ACM_STORAGE=memory 时数据只保存在内存中，用于模拟和测量 API 层本身的开销
+        storage = MemoryStorage() if os.environ.get("ACM_STORAGE") == "memory" else None
+        manager = await asyncio.to_thread(Manager, storage=storage, coalesce_ms=coalesce_ms, scheduler=scheduler)
+    else:
+        # 登录可能落在任意 worker 上，所有 worker 必须用同一个密钥签名和校验令牌
+        if not os.environ.get("ACM_SESSION_SECRET"):
+            raise RuntimeError("ACM_SESSION_SECRET must be set when sharding is enabled")
+        # 写协程在一个数据库上做 group commit，所以每个 worker 恰好拥有一个分片
+        worker_count = int(os.environ.get("ACM_WORKER_COUNT", shard_map.shard_count))
+        shards = shard_map.owned_shards(int(os.environ.get("ACM_WORKER_INDEX", 0)), worker_count)
+        if len(shards) != 1:
+            raise RuntimeError(f"Each worker must own exactly one shard, got {shards}")
+        manager = await asyncio.to_thread(ShardedManager, shard_map, shards, coalesce_ms=coalesce_ms)
+        app.state.shard_reader = ShardReader(shard_map)
+    # ACM_FEED_QUEUE 为 /ac/feed 每个订阅者最多积压的变更数，超过后断开这个订阅者
+    manager.bus.queue_size = int(os.environ.get("ACM_FEED_QUEUE", 256))
+    app.state.acm = ACManager(manager)
+    # 不按房间过滤的 /ac/feed 订阅者收到的变更相同，最近的变更编码后缓存在这里，见 encoded_change
+    app.state.encoded_changes = {}
+    # ACM_MAINTENANCE_INTERVAL 大于 0 时定期归档已退房的入住的使用记录
+    policy = MaintenancePolicy.from_env()
+    maintenance = asyncio.create_task(maintenance_loop(manager.storage, policy)) if policy is not None else None
+    # 时间片到期时轮转送风的房间
+    ticker = asyncio.create_task(scheduler_loop(app.state.acm)) if scheduler is not None else None
+    try:
+        yield
+    finally:
+        if maintenance is not None:
+            maintenance.cancel()
+        if ticker is not None:
+            ticker.cancel()
+        # 等待写协程提交完队列中剩余的操作
+        await app.state.acm.close()
+        if app.state.shard_reader is not None:
+            app.state.shard_reader.close()
+
+
+def get_manager(request: Request):
+    return request.app.state.acm
+
+
+app = FastAPI(lifespan=lifespan)
 
 # 设置CORS白名单
 origins = ["*"
@@ -21,6 +96,26 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # 按路由模板分组，避免路径参数产生过多的标签
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(time.perf_counter() - start, request.method,
+                             route.path if route is not None else "unmatched", status)
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
@@ -32,14 +127,18 @@ async def say_hello(name: str):
 
 
 @app.post("/user/register", response_model=UserRegisterResponse)
-async def register_user(user_request: UserRegisterRequest):
+async def register_user(user_request: UserRegisterRequest, acm_db: ACManager = Depends(get_manager)):
     # 将用户注册逻辑放在这里，包括密码哈希等操作
     # 返回包含用户ID的响应
     # user_id = "123456789"  # 替换为实际的用户ID生成逻辑
     # return {"user_id": user_id}
     # 创建 ACMDatabase 类的实例
     # 调用 register_user 方法
-    user_id = acm_db.register_user(user_request.name, user_request.phone, user_request.password)
+    try:
+        user_id = await acm_db.register_user(user_request.name, user_request.phone, user_request.password)
+    except HasherBusy:
+        # 哈希队列已满，让客户端稍后重试
+        raise HTTPException(status_code=503, detail="Too many pending password operations")
     if user_id is not None:
         return {"user_id": user_id}
     else:
@@ -47,23 +146,74 @@ async def register_user(user_request: UserRegisterRequest):
 
 
 @app.post("/login", response_model=UserLoginResponse)
-def login_user(user_request: UserLoginRequest):
-    role, room_id, user_id = acm_db.login(user_request.name, user_request.password)
+async def login_user(user_request: UserLoginRequest, acm_db: ACManager = Depends(get_manager)):
+    try:
+        role, room_id, user_id = await acm_db.login(user_request.name, user_request.password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Too many pending password operations")
     if role == -1:
-        return {"status": -1, "room_id": -1, "user_id": -1}
-    else:
-        return {"status": role, "room_id": room_id, "user_id": user_id}
+        # 用户不存在和密码错误返回同样的结果
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    # 之后的请求凭令牌验证，不再计算 bcrypt
+    token = acm_db.sessions.create(user_id, role, room_id)
+    return {"status": role, "room_id": room_id, "user_id": user_id, "token": token}
+
+
+def get_token(authorization: Optional[str] = Header(None)):
+    if authorization is None or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing session token")
+    return authorization[len("Bearer "):]
+
+
+def get_session(token: str = Depends(get_token), acm_db: ACManager = Depends(get_manager)):
+    session = acm_db.sessions.get(token)
+    if session is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired session token")
+    return session
+
+
+def require_user(user_id, session):
+    # 客人只能为自己办理入住、退房和查询费用，工作人员可以代任何客人操作
+    if session.role < STAFF and session.user_id != user_id:
+        raise HTTPException(status_code=403, detail="Session does not belong to this user")
+
+
+def require_room(room_id, session):
+    # 客人只能操作会话中缓存的、自己入住的房间，工作人员可以操作任何房间
+    if session.role < STAFF and session.room_id != room_id:
+        raise HTTPException(status_code=403, detail="Session is not checked in to this room")
+
+
+def require_staff(session=Depends(get_session)):
+    # 批量操作、调度队列、全楼的费用、推送和报表只对工作人员开放
+    if session.role < STAFF:
+        raise HTTPException(status_code=403, detail="Staff session required")
+    return session
+
+
+@app.get("/session", response_model=UserLoginResponse)
+async def get_current_session(token: str = Depends(get_token), session=Depends(get_session)):
+    # 刷新登录状态，直接从会话缓存返回
+    return {"status": session.role, "room_id": session.room_id, "user_id": session.user_id, "token": token}
+
+
+@app.post("/logout")
+async def logout(token: str = Depends(get_token), acm_db: ACManager = Depends(get_manager)):
+    acm_db.sessions.revoke(token)
+    return {"status": 0}
 
 
 @app.post("/checkin", response_model=CheckInResponse)
-def check_in(check_in_request: CheckInRequest):
+async def check_in(check_in_request: CheckInRequest, acm_db: ACManager = Depends(get_manager),
+                   session=Depends(get_session)):
     # 将签到逻辑放在这里，包括根据用户ID获取房间ID等操作
     # 返回包含房间ID的响应
     # room_id = 1  # 替换为实际的房间ID生成逻辑
     # return {"room_id": room_id}
     # 创建 ACMDatabase 类的实例
     # 调用 checkin 方法
-    room_id = acm_db.checkin(check_in_request.user_id)
+    require_user(check_in_request.user_id, session)
+    room_id = await acm_db.checkin(check_in_request.user_id, check_in_request.floor)
     if room_id == -1:
         return {"room_id": -1}
     else:
@@ -71,7 +221,8 @@ def check_in(check_in_request: CheckInRequest):
 
 
 @app.post("/checkout", response_model=CheckoutResponse)
-def checkout(checkout_request: CheckoutRequest):
+async def checkout(checkout_request: CheckoutRequest, acm_db: ACManager = Depends(get_manager),
+                   session=Depends(get_session)):
     # 结账逻辑放在这里，包括根据用户ID计算费用、生成详单等操作
     # 返回包含待支付金额和详单的响应
     # cost = 100.0  # 替换为实际的费用计算逻辑
@@ -83,13 +234,17 @@ def checkout(checkout_request: CheckoutRequest):
     # ]  # 替换为实际的详单生成逻辑
 
     # 调用 checkout 方法
-    print(checkout_request.user_id)
-    cost, invoices = acm_db.checkout(checkout_request.user_id)
+    require_user(checkout_request.user_id, session)
+    result = await acm_db.checkout(checkout_request.user_id)
+    if result == -1:
+        raise HTTPException(status_code=404, detail="User is not checked in")
+    cost, invoices = result
     return {"cost": cost, "invoices": invoices}
 
 
 @app.post("/ac/on", response_model=ACSwitchResponse)
-def turn_on_ac(ac_on_request: RoomRequest):
+async def turn_on_ac(ac_on_request: RoomRequest, acm_db: ACManager = Depends(get_manager),
+                     session=Depends(get_session)):
     # 开启空调逻辑放在这里，包括根据房间ID执行相应操作，如设置参数等
     # 返回包含操作状态和空调参数的响应
     # room_id = ac_on_request.room_id
@@ -97,16 +252,18 @@ def turn_on_ac(ac_on_request: RoomRequest):
     # settings = Settings(temperature = 25, fan_speed = "High", mode = "Cool")  # 替换为实际的空调参数
     # return {"status": status, "settings": settings}
     room_id = ac_on_request.room_id
+    require_room(room_id, session)
     # 创建 ACMDatabase 类的实例
 
     # 调用 turn_on_ac 方法
-    status, settings = acm_db.turn_on_ac(room_id)
+    status, settings = await acm_db.turn_on_ac(room_id)
     # 根据返回的状态构建响应
     return {"status": status, "settings": settings.dict()}
 
 
 @app.post("/ac/off", response_model=ACSwitchResponse)
-def turn_off_ac(ac_off_request: RoomRequest):
+async def turn_off_ac(ac_off_request: RoomRequest, acm_db: ACManager = Depends(get_manager),
+                      session=Depends(get_session)):
     # 关闭空调逻辑放在这里，包括根据房间ID执行相应操作，如设置参数等
     # 返回包含操作状态和空调参数的响应
     # room_id = ac_off_request.room_id
@@ -115,14 +272,16 @@ def turn_off_ac(ac_off_request: RoomRequest):
     # return {"status": status, "settings": settings}
     # 解析请求体数据
     room_id = ac_off_request.room_id
+    require_room(room_id, session)
     # 调用 turn_off_ac 方法
-    status, settings = acm_db.turn_off_ac(room_id)
+    status, settings = await acm_db.turn_off_ac(room_id)
     # 根据返回的状态构建响应
     return {"status": status, "settings": settings.dict()}
 
 
 @app.post("/ac/settings", response_model=ACSwitchResponse)
-def set_ac(ac_set_request: ACSettingRequest):
+async def set_ac(ac_set_request: ACSettingRequest, acm_db: ACManager = Depends(get_manager),
+                 session=Depends(get_session)):
     # 设置空调参数逻辑放在这里，包括根据房间ID和参数执行相应操作
     # 返回包含操作状态和空调参数的响应
     # room_id = ac_set_request.room_id
@@ -133,41 +292,267 @@ def set_ac(ac_set_request: ACSettingRequest):
     # 从请求中获取房间ID和设置
     room_id = ac_set_request.room_id
     settings = ac_set_request.settings
+    require_room(room_id, session)
     # 调用set_ac方法
-    status, new_settings = acm_db.set_ac(room_id, settings)
+    status, new_settings = await acm_db.set_ac(room_id, settings)
     # 根据返回的状态构建响应
     return {"status": status, "settings": new_settings.dict()}
 
 
 @app.post("/ac/cost", response_model=RoomCostResponse)
-def get_cost(room_query_request: UserRegisterResponse):
+async def get_cost(room_query_request: UserRegisterResponse, acm_db: ACManager = Depends(get_manager),
+                   session=Depends(get_session)):
+    require_user(room_query_request.user_id, session)
     # 创建 ACMDatabase 类的实例
-    print(room_query_request.user_id)
-    cost = acm_db.get_cost(room_query_request.user_id)  # 调用 get_cost 方法
+    cost = await acm_db.get_cost(room_query_request.user_id)  # 调用 get_cost 方法
     return {"cost": cost}
 
 
+@app.get("/ac/cost/snapshot", response_model=Dict[int, float], dependencies=[Depends(require_staff)])
+async def get_live_costs(acm_db: ACManager = Depends(get_manager)):
+    # 全部正在运行的空调当前这一段的费用
+    return await acm_db.live_cost_snapshot()
+
+
+async def bulk_room_ids(acm_db, request: BulkRoomRequest):
+    if not request.room_ids and request.first_room is None and request.last_room is None:
+        raise HTTPException(status_code=422, detail="room_ids or first_room/last_room is required")
+    return await acm_db.select_rooms(request.room_ids, request.first_room, request.last_room)
+
+
+@app.post("/ac/bulk/off", response_model=BulkACResponse, dependencies=[Depends(require_staff)])
+async def turn_off_many(request: BulkRoomRequest, acm_db: ACManager = Depends(get_manager)):
+    # 所有房间在同一个事务中关闭，status 含义与 /ac/off 相同
+    statuses = await acm_db.turn_off_many(await bulk_room_ids(acm_db, request))
+    return {"results": [{"room_id": room_id, "status": status} for room_id, status in statuses.items()]}
+
+
+@app.post("/ac/bulk/settings", response_model=BulkACResponse, dependencies=[Depends(require_staff)])
+async def set_many(request: BulkACSettingRequest, acm_db: ACManager = Depends(get_manager)):
+    statuses = await acm_db.set_many(await bulk_room_ids(acm_db, request), request.settings)
+    return {"results": [{"room_id": room_id, "status": status} for room_id, status in statuses.items()]}
+
+
+@app.get("/ac/queue", response_model=ACQueueResponse, dependencies=[Depends(require_staff)])
+async def get_ac_queue(acm_db: ACManager = Depends(get_manager)):
+    # 送风调度的队列，没有设置 ACM_AC_CAPACITY 时不存在
+    state = await acm_db.scheduler_state()
+    if state is None:
+        raise HTTPException(status_code=404, detail="Service scheduling is disabled")
+    rooms = {key: [{"room_id": room_id, "priority": priority, "since": format_time(since), "elapsed_ms": elapsed}
+                   for room_id, priority, since, elapsed in state[key]] for key in ("serving", "waiting")}
+    return {"capacity": state["capacity"], "time_slice_ms": state["time_slice_ms"], **rooms}
+
+
 @app.post("/ac/status", response_model=RoomStatusResponse)
-def get_ac_status(room_query_request: RoomRequest):
+async def get_ac_status(room_query_request: RoomRequest, acm_db: ACManager = Depends(get_manager),
+                        session=Depends(get_session)):
+    require_room(room_query_request.room_id, session)
     # 创建 ACMDatabase 类的实例
-    busy, ac_on, user_id, start_time, settings = acm_db.check_status(room_query_request.room_id)
+    busy, ac_on, user_id, start_time, settings = await acm_db.check_status(room_query_request.room_id)
     # 这里假设 RoomStatusResponse 是你定义的空调状态数据模型
-    return {"busy": busy, "ac_on": ac_on, "user_id": user_id, "start_time": start_time, "settings": settings.dict()}
+    return {"busy": busy, "ac_on": ac_on, "user_id": user_id, "start_time": format_time(start_time),
+            "settings": settings.dict()}
+
+
+# 没有变更时每隔这么多秒发送一行注释，保持连接并及时发现断开的客户端
+FEED_KEEPALIVE_S = 15
+
+
+def room_state_dict(state):
+    return {**state, "start_time": format_time(state["start_time"]), "settings": state["settings"].dict()}
+
+
+def sse_message(event, seq, rooms):
+    return f"event: {event}\nid: {seq}\ndata: {json.dumps([room_state_dict(state) for state in rooms])}\n\n"
+
+
+# 编码后缓存的最近变更条数
+ENCODED_CHANGES_LIMIT = 256
+
+
+def encoded_change(cache, seq, changes):
+    # 同一条变更只编码一次，所有不按房间过滤的订阅者共用
+    message = cache.get(seq)
+    if message is None:
+        message = cache[seq] = sse_message("change", seq, changes)
+        if len(cache) > ENCODED_CHANGES_LIMIT:
+            del cache[next(iter(cache))]
+    return message
+
+
+@app.get("/ac/feed", dependencies=[Depends(require_staff)])
+async def room_feed(request: Request, room_id: Optional[int] = None, acm_db: ACManager = Depends(get_manager)):
+    """
+    房间状态的变更推送（Server-Sent Events），代替逐个房间轮询 /ac/status 和 /ac/cost。
+    连接后先收到一条 snapshot，之后每次提交修改了房间状态就收到一条 change，只包含修改过的房间；
+    给出 room_id 时只推送这个房间。跟不上的连接收到 dropped 后被断开，重新连接会得到新的快照。
+    """
+    # 先订阅再取快照，快照之后的变更不会漏掉，编号不大于快照的变更跳过
+    subscription = acm_db.subscribe()
+    try:
+        seq, rooms = await acm_db.room_snapshot()
+    except BaseException:
+        subscription.close()
+        raise
+
+    def selected(rooms):
+        return [state for state in rooms if room_id is None or state["room_id"] == room_id]
+
+    async def events():
+        try:
+            yield sse_message("snapshot", seq, selected(rooms))
+            while True:
+                try:
+                    message = await subscription.get(FEED_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                message_seq, changes = message
+                if message_seq <= seq:
+                    continue
+                if room_id is None:
+                    yield encoded_change(request.app.state.encoded_changes, message_seq, changes)
+                elif selected(changes):
+                    yield sse_message("change", message_seq, selected(changes))
+        finally:
+            subscription.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def report_filters(start: Optional[str] = None, end: Optional[str] = None, room_id: Optional[int] = None,
+                   user_id: Optional[int] = None):
+    # 时间参数为 ISO 格式字符串，按记录开始时间过滤，左闭右开
+    return {"start_time": to_epoch_ms(start) if start else None, "end_time": to_epoch_ms(end) if end else None,
+            "room_id": room_id, "user_id": user_id}
+
+
+@app.get("/ac/reports", response_model=List[ReportItem], dependencies=[Depends(require_staff)])
+async def get_report_item(response: Response, after_id: int = 0, limit: int = Query(1000, ge=1, le=10000),
+                          filters: dict = Depends(report_filters), acm_db: ACManager = Depends(get_manager)):
+    # 按 id 分页，下一页的 after_id 通过 X-Next-After-Id 返回
+    reports = await acm_db.generate_report(after_id=after_id, limit=limit, **filters)
+    if len(reports) == limit:
+        response.headers["X-Next-After-Id"] = str(reports[-1].id)
+    return reports
 
 
-@app.get("/ac/reports", response_model=List[ReportItem])
-def get_report_item():
-    # 创建 ACMDatabase 类的实例
-    reports = acm_db.generate_report()
-    # 这里假设 ReportItem 是你定义的报表数据模型
+REPORT_FIELDS = ["id", "user_id", "room_id", "start_time", "end_time", "temperature", "fan_speed", "mode", "cost"]
+
+
+@app.get("/ac/reports/stream", dependencies=[Depends(require_staff)])
+async def stream_reports(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), after_id: int = 0,
+                         filters: dict = Depends(report_filters), acm_db: ACManager = Depends(get_manager)):
+    # 逐块读取并输出，内存占用与历史记录总量无关
+    async def ndjson_lines():
+        async for rows in acm_db.iter_report(after_id=after_id, **filters):
+            yield "".join(json.dumps(report_row_dict(row)) + "\n" for row in rows)
+
+    async def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(REPORT_FIELDS)
+        async for rows in acm_db.iter_report(after_id=after_id, **filters):
+            writer.writerows(report_row_dict(row).values() for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    if format == "csv":
+        return StreamingResponse(csv_lines(), media_type="text/csv")
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/ac/reports/summary/{group}", response_model=List[UsageSummaryItem],
+         dependencies=[Depends(require_staff)])
+async def get_usage_summary(group: str = Path(pattern="^(room|day|week|setting)$"), start: Optional[str] = None,
+                            end: Optional[str] = None, room_id: Optional[int] = None,
+                            acm_db: ACManager = Depends(get_manager)):
+    # 从汇总表查询，日期范围左闭右开，不足一天的结束时间向上取整
+    start_day = to_epoch_ms(start) // MS_PER_DAY if start else None
+    end_day = -(-to_epoch_ms(end) // MS_PER_DAY) if end else None
+    return await acm_db.generate_summary(group, start_day, end_day, room_id)
+
+
+@app.exception_handler(ShardNotOwned)
+async def misdirected(request: Request, exc: ShardNotOwned):
+    # 请求应该发给拥有该分片的 worker
+    return JSONResponse(status_code=421, content={"detail": str(exc), "shard": exc.shard})
+
+
+@app.exception_handler(ShardFull)
+async def shard_full(request: Request, exc: ShardFull):
+    # 客人所在分片没有空房，与不分片时整栋楼住满返回的 room_id = -1 区分开
+    return JSONResponse(status_code=409, content={"detail": str(exc), "shard": exc.shard})
+
+
+@app.exception_handler(PoolTimeout)
+async def pool_exhausted(request: Request, exc: PoolTimeout):
+    # 数据库连接全部被占用，让客户端稍后重试
+    return JSONResponse(status_code=503, content={"detail": "Database connections are exhausted"})
+
+
+def get_shard_map(request: Request):
+    if request.app.state.shard_map is None:
+        raise HTTPException(status_code=404, detail="Sharding is not enabled")
+    return request.app.state.shard_map
+
+
+@app.get("/shards/route")
+async def route_shard(room_id: Optional[int] = None, user_id: Optional[int] = None,
+                      shard_map: ShardMap = Depends(get_shard_map)):
+    # 供前端转发使用：房间或客人所在的分片，以及拥有该分片的 worker
+    if (room_id is None) == (user_id is None):
+        raise HTTPException(status_code=422, detail="Exactly one of room_id and user_id is required")
+    shard = shard_map.shard_of_room(room_id) if room_id is not None else shard_map.shard_of_user(user_id)
+    worker_count = int(os.environ.get("ACM_WORKER_COUNT", shard_map.shard_count))
+    return {"shard": shard, "worker": shard % worker_count}
+
+
+@app.get("/ac/reports/all/summary/{group}", response_model=List[UsageSummaryItem],
+         dependencies=[Depends(require_staff)])
+async def get_all_shards_summary(request: Request, group: str = Path(pattern="^(room|day|week|setting)$"),
+                                 start: Optional[str] = None, end: Optional[str] = None,
+                                 room_id: Optional[int] = None, shard_map: ShardMap = Depends(get_shard_map)):
+    # 合并全部分片的汇总表
+    start_day = to_epoch_ms(start) // MS_PER_DAY if start else None
+    end_day = -(-to_epoch_ms(end) // MS_PER_DAY) if end else None
+    return await asyncio.to_thread(request.app.state.shard_reader.generate_summary, group, start_day, end_day,
+                                   room_id)
+
+
+@app.get("/ac/reports/all", response_model=List[ShardReportItem], dependencies=[Depends(require_staff)])
+async def get_all_shards_report(request: Request, response: Response, shard: int = Query(0, ge=0), after_id: int = 0,
+                                limit: int = Query(1000, ge=1, le=10000), filters: dict = Depends(report_filters),
+                                shard_map: ShardMap = Depends(get_shard_map)):
+    # 按分片号、再按分片内的记录 id 分页读取全部分片，下一页的游标通过 X-Next-Shard 和 X-Next-After-Id 返回
+    reports, cursor = await asyncio.to_thread(request.app.state.shard_reader.generate_report, (shard, after_id),
+                                              limit, **filters)
+    if cursor is not None:
+        response.headers["X-Next-Shard"] = str(cursor[0])
+        response.headers["X-Next-After-Id"] = str(cursor[1])
     return reports
 
 
+def report_row_dict(row):
+    item = dict(zip(REPORT_FIELDS, row))
+    item["start_time"] = format_time(item["start_time"])
+    item["end_time"] = format_time(item["end_time"])
+    return item
+
+
 class UserIdResponse(BaseModel):
     user_id: int
 
 
 @app.post("/user/get_id_by_name", response_model=UserIdResponse)
-def get_user_id_by_name(user_request: GetUserIdRequest):
-    user_id = acm_db.get_user_id_by_name(user_request.name)
+async def get_user_id_by_name(user_request: GetUserIdRequest, acm_db: ACManager = Depends(get_manager)):
+    user_id = await acm_db.get_user_id_by_name(user_request.name)
     return {"user_id": user_id}
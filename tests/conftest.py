@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acm import ACMDatabase, Manager, MemoryStorage, SQLiteStorage  # noqa: E402
+from acm.clock import ManualClock  # noqa: E402
+from acm.passwords import PasswordHasher  # noqa: E402
+
+START_MS = 1_700_000_000_000
+
+
+@pytest.fixture
+def clock():
+    return ManualClock(START_MS)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'acm.db')
+
+
+@pytest.fixture(params=['sqlite', 'memory'])
+def manager(request, clock, db_path):
+    """两种存储各运行一次"""
+    storage = SQLiteStorage(ACMDatabase(db_path)) if request.param == 'sqlite' else MemoryStorage()
+    manager = Manager(clock=clock, storage=storage, hasher=PasswordHasher(rounds=4))
+    yield manager
+    storage.close()
+
+
+@pytest.fixture
+def sqlite_manager(clock, db_path):
+    manager = Manager(clock=clock, storage=SQLiteStorage(ACMDatabase(db_path)), hasher=PasswordHasher(rounds=4))
+    yield manager
+    manager.storage.close()
+
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """内存存储的应用，bcrypt 只做很少的轮数"""
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('ACM_STORAGE', 'memory')
+    with TestClient(main.app) as client:
+        client.app.state.acm.manager.hasher = PasswordHasher(rounds=4)
+        yield client
@@ -0,0 +1,19 @@
+from acm.sessions import GUEST
+
+
+def check_in_guests(manager, count):
+    """注册并入住 count 位客人，返回 [(user_id, room_id)]"""
+    guests = []
+    for i in range(count):
+        user_id = manager.create_user(f"guest{i}", f"phone{i}", 'x', 'x')
+        guests.append((user_id, manager.checkin(user_id)))
+    return guests
+
+
+def login(client, name, role=GUEST):
+    """注册并登录，返回 (user_id, 请求头)"""
+    user_id = client.post('/user/register', json={'name': name, 'phone': name, 'password': 'pw'}).json()['user_id']
+    if role != GUEST:
+        client.app.state.acm.manager.storage.set_user_role(name, role)
+    token = client.post('/login', json={'name': name, 'password': 'pw'}).json()['token']
+    return user_id, {'Authorization': f"Bearer {token}"}
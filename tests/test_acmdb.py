@@ -0,0 +1,123 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from acm import ACMDatabase, PoolTimeout
+from acm.migrations import migrate
+
+
+def test_new_connection_does_not_wait_for_writer(db_path):
+    db = ACMDatabase(db_path, busy_timeout=1000)
+    with db.connection() as conn:
+        migrate(conn)
+    started = threading.Event()
+    release = threading.Event()
+
+    def write():
+        with db.transaction() as c:
+            c.execute("INSERT INTO users (username, phone) VALUES ('writer', '1')")
+            started.set()
+            release.wait(5)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    started.wait(5)
+    result = {}
+
+    def read():
+        # 新线程从池中新建连接，WAL 模式下读不等待写事务
+        start = time.perf_counter()
+        with db.cursor() as c:
+            c.execute("SELECT COUNT(*) FROM users")
+            result['count'] = c.fetchone()[0]
+        result['seconds'] = time.perf_counter() - start
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    reader.join(5)
+    release.set()
+    writer.join(5)
+    db.close()
+    assert result['count'] == 0
+    assert result['seconds'] < 0.5
+
+
+def test_new_database_uses_incremental_vacuum(db_path):
+    db = ACMDatabase(db_path)
+    with db.connection() as conn:
+        migrate(conn)
+    db.close()
+    assert sqlite3.connect(db_path).execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_migrations_do_not_collect_statistics(db_path):
+    db = ACMDatabase(db_path)
+    with db.connection() as conn:
+        migrate(conn)
+        # 迁移时表还很小，这时收集的统计信息很快就过时了
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0] == 0
+    db.close()
+
+
+def test_close_updates_statistics_of_queried_tables(db_path):
+    db = ACMDatabase(db_path)
+    with db.connection() as conn:
+        migrate(conn)
+    with db.transaction() as c:
+        c.executemany("INSERT INTO users (username, phone) VALUES (?, ?)",
+                      [(f"guest{i}", f"phone{i}") for i in range(5000)])
+    with db.cursor() as c:
+        c.execute("SELECT id FROM users WHERE username = ?", ('guest1',))
+        c.fetchall()
+    db.close()
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1 WHERE tbl = 'users'").fetchone()[0] > 0
+    plan = conn.execute("EXPLAIN QUERY PLAN SELECT id FROM users WHERE username = ?", ('guest1',)).fetchall()
+    assert 'idx_users_username' in plan[0][-1]
+
+
+def test_failed_commit_runs_undo_callbacks(db_path):
+    db = ACMDatabase(db_path)
+    undone, committed = [], []
+    with db.connection() as conn:
+        # 延迟检查的外键在提交时才报错
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("CREATE TABLE parent (id INTEGER PRIMARY KEY)")
+        conn.execute("CREATE TABLE child (parent_id INTEGER REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)")
+        with pytest.raises(sqlite3.IntegrityError):
+            with db.transaction() as c:
+                c.execute("INSERT INTO child VALUES (1)")
+                db.on_rollback(lambda: undone.append(1))
+                db.after_commit(lambda: committed.append(1))
+        assert (undone, committed) == ([1], [])
+        assert not conn.in_transaction
+        # 连接可以继续使用
+        with db.transaction() as c:
+            c.execute("INSERT INTO parent VALUES (1)")
+            c.execute("INSERT INTO child VALUES (1)")
+        assert conn.execute("SELECT COUNT(*) FROM child").fetchone()[0] == 1
+    db.close()
+
+
+def test_acquire_times_out_when_pool_is_exhausted(db_path):
+    db = ACMDatabase(db_path, pool_size=1, acquire_timeout=0.1)
+    errors = []
+
+    def acquire():
+        try:
+            with db.connection():
+                pass
+        except PoolTimeout as e:
+            errors.append(e)
+
+    with db.connection():
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join(5)
+    assert len(errors) == 1
+    # 归还之后可以再借出
+    acquire()
+    assert len(errors) == 1
+    db.close()
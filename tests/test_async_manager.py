@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+import pytest
+
+from acm import AsyncManager, Manager, MemoryStorage
+from acm.passwords import PasswordHasher
+from acm.scheduler import ServiceScheduler
+from tests.helpers import check_in_guests
+
+
+@pytest.fixture
+def scheduled(clock):
+    """同时只能为一个房间送风，两位客人入住"""
+    manager = Manager(clock=clock, storage=MemoryStorage(), hasher=PasswordHasher(rounds=4),
+                      scheduler=ServiceScheduler(capacity=1, time_slice_ms=60_000))
+    return manager, [room_id for _, room_id in check_in_guests(manager, 2)]
+
+
+def test_reads_do_not_wait_for_the_writer(sqlite_manager, clock):
+    # 内存存储的部分读操作要等正在进行的写事务结束，见 MemoryStorage.stay_state
+    manager = sqlite_manager
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    manager.turn_on_ac(room_id)
+    clock.advance(seconds=60)
+    manager.turn_off_ac(room_id)
+    release = threading.Event()
+
+    async def run():
+        acm = AsyncManager(manager)
+        # 写协程被一个长时间的写操作占住，读操作照常完成
+        blocked = asyncio.ensure_future(acm._write(release.wait, 5))
+        await asyncio.sleep(0.05)
+        try:
+            return await asyncio.wait_for(asyncio.gather(
+                acm.room_snapshot(), acm.scheduler_state(), acm.generate_summary('room'),
+                acm.check_status(room_id), acm.get_cost(user_id)), 2)
+        finally:
+            release.set()
+            await blocked
+            await acm.close()
+
+    (seq, rooms), state, summary, status, cost = asyncio.run(run())
+    assert [room['room_id'] for room in rooms if room['busy']] == [room_id]
+    assert state is None
+    # 汇总表还没有刷新，尚未计入的记录在查询时加上
+    assert [(item.room_id, item.segments) for item in summary] == [(room_id, 1)]
+    assert status[:2] == (1, 0)
+    assert cost == pytest.approx(manager.generate_bill(user_id)[0])
+    assert manager.verify_rollups() == []
+    assert manager.refresh_rollups() == 0
+
+
+def test_scheduler_state_shows_the_committed_queue(scheduled):
+    manager, (first, second) = scheduled
+    with manager.storage.transaction():
+        manager.turn_on_ac(first)
+        with pytest.raises(RuntimeError):
+            with manager.storage.transaction():
+                manager.turn_on_ac(second)
+                raise RuntimeError
+        # 提交之前读到的是上一次提交后的队列
+        assert manager.scheduler_state()['serving'] == []
+    state = manager.scheduler_state()
+    assert ([room[0] for room in state['serving']], state['waiting']) == ([first], [])
+    manager.turn_on_ac(second)
+    assert [room[0] for room in manager.scheduler_state()['waiting']] == [second]
+
+
+def test_writes_after_close_fail(scheduled):
+    manager, (first, second) = scheduled
+
+    async def run():
+        acm = AsyncManager(manager)
+        earlier = asyncio.ensure_future(acm.turn_on_ac(first))
+        await asyncio.sleep(0)
+        closing = asyncio.ensure_future(acm.close())
+        await asyncio.sleep(0)
+        # close 开始之后的写操作立即失败，不会排在结束标记之后一直等待
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(acm.turn_on_ac(second), 2)
+        await closing
+        assert (await earlier)[0] == 0
+
+    asyncio.run(run())
+    assert (manager.check_status(first)[1], manager.check_status(second)[1]) == (1, 0)
+
+
+def test_close_fails_writes_left_in_the_queue(scheduled):
+    manager, (first, _) = scheduled
+
+    async def run():
+        acm = AsyncManager(manager)
+        await acm.start()
+        # 写协程异常退出后，排队的调用方由 close 唤醒，而不是一直等待
+        acm._writer.cancel()
+        pending = asyncio.ensure_future(acm.turn_on_ac(first))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.CancelledError):
+            await acm.close()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(pending, 2)
+
+    asyncio.run(run())
+    assert manager.check_status(first)[1] == 0
@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import random
+
+import pytest
+
+from acm import Manager
+from acm.clock import ManualClock
+from benchmarks import bench_history, hotel_day
+
+
+@pytest.mark.parametrize('storage', ['sqlite', 'memory'])
+def test_hotel_day_completes_without_errors(storage, tmp_path, monkeypatch):
+    # run 会切换工作目录并设置 ACM_STORAGE，结束后由 monkeypatch 还原
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('ACM_STORAGE', raising=False)
+    args = argparse.Namespace(url=None, rooms=10, guests=12, concurrency=4, actions=10, think_ms=0.0,
+                              storage=storage, bcrypt_rounds=4, seed=0)
+    results = asyncio.run(hotel_day.run(args))
+    assert results['guests'] == {'completed': 12}
+    assert {endpoint: stats['errors'] for endpoint, stats in results['endpoints'].items() if stats['errors']} == {}
+    assert results['endpoints']['/checkout']['count'] == 12
+
+
+def test_history_bill_reads_only_the_current_stay(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    clock = ManualClock(bench_history.START_MS + 5000 * 1000)
+    manager = Manager(clock=clock)
+    bench_history.populate(manager, 5000, 50, random.Random(0))
+    user_id = bench_history.stay(manager, clock, 7)
+    # 历史记录属于其他客人，账单只有本次入住已结束的 7 段
+    assert len(manager.generate_bill(user_id)[1]) == 7
+    clock.advance(seconds=600)
+    total, invoices = manager.checkout(user_id)
+    assert len(invoices) == 8
+    assert total == pytest.approx(sum(invoice.cost for invoice in invoices))
+    manager.db.close()
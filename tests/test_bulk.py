@@ -0,0 +1,89 @@
+import pytest
+
+from acm.sessions import STAFF
+from tests.helpers import check_in_guests, login
+
+SETTINGS = {'temperature': 19, 'fan_speed': 'high', 'mode': 'cool'}
+
+
+@pytest.fixture
+def hotel(client):
+    """三位客人入住，前两位开着空调；返回 (入住的房间号, 工作人员的请求头)"""
+    manager = client.app.state.acm.manager
+    rooms = [room_id for _, room_id in check_in_guests(manager, 3)]
+    _, staff = login(client, 'front desk', STAFF)
+    for room_id in rooms[:2]:
+        assert client.post('/ac/on', json={'room_id': room_id}, headers=staff).json()['status'] == 0
+    return rooms, staff
+
+
+def results(response):
+    assert response.status_code == 200
+    return {item['room_id']: item['status'] for item in response.json()['results']}
+
+
+def status(client, room_id, headers):
+    return client.post('/ac/status', json={'room_id': room_id}, headers=headers).json()
+
+
+def test_management_endpoints_require_staff(client):
+    _, guest = login(client, 'guest')
+    for method, endpoint, body in [('post', '/ac/bulk/off', {'room_ids': [1]}),
+                                   ('post', '/ac/bulk/settings', {'room_ids': [1], 'settings': SETTINGS}),
+                                   ('get', '/ac/cost/snapshot', None), ('get', '/ac/queue', None),
+                                   ('get', '/ac/feed', None), ('get', '/ac/reports', None),
+                                   ('get', '/ac/reports/stream', None), ('get', '/ac/reports/summary/room', None),
+                                   ('get', '/ac/reports/all', None), ('get', '/ac/reports/all/summary/room', None)]:
+        request = getattr(client, method)
+        kwargs = {'json': body} if body is not None else {}
+        assert request(endpoint, **kwargs).status_code == 401
+        assert request(endpoint, headers=guest, **kwargs).status_code == 403
+
+
+def test_bulk_off_selects_ids_and_range(client, hotel):
+    rooms, staff = hotel
+    first, last = min(rooms), max(rooms)
+    assert client.post('/ac/bulk/off', json={}, headers=staff).status_code == 422
+    # 列表中的房间在前，范围内的房间按房间号排在后面，重复的只操作一次
+    response = client.post('/ac/bulk/off', json={'room_ids': [rooms[1], 10_000], 'first_room': first,
+                                                  'last_room': last}, headers=staff)
+    statuses = results(response)
+    assert list(statuses)[:2] == [rooms[1], 10_000]
+    assert sorted(statuses)[:-1] == list(range(first, last + 1))
+    # 开着空调的关闭，入住但没开空调的为 -2，空房间和不存在的房间为 -1
+    expected = {room_id: -1 for room_id in statuses}
+    expected.update({rooms[0]: 0, rooms[1]: 0, rooms[2]: -2})
+    assert statuses == expected
+    assert all(status(client, room_id, staff)['ac_on'] == 0 for room_id in rooms)
+
+
+def test_bulk_settings_reports_each_room(client, hotel):
+    rooms, staff = hotel
+    statuses = results(client.post('/ac/bulk/settings', json={'room_ids': rooms, 'settings': SETTINGS},
+                                   headers=staff))
+    assert statuses == {rooms[0]: 0, rooms[1]: 0, rooms[2]: -2}
+    for room_id in rooms[:2]:
+        assert status(client, room_id, staff)['settings'] == SETTINGS
+    assert status(client, rooms[2], staff)['settings'] != SETTINGS
+
+
+@pytest.mark.parametrize('endpoint, body', [('/ac/bulk/off', {}), ('/ac/bulk/settings', {'settings': SETTINGS})])
+def test_failed_room_rolls_back_the_whole_batch(client, hotel, monkeypatch, endpoint, body):
+    rooms, staff = hotel
+    manager = client.app.state.acm.manager
+    before = [status(client, room_id, staff) for room_id in rooms]
+    append = manager.events.append
+
+    def fail_on_second_room(time, kind, user_id, room_id, settings=None):
+        if room_id == rooms[1]:
+            raise RuntimeError("event log unavailable")
+        append(time, kind, user_id, room_id, settings)
+
+    monkeypatch.setattr(manager.events, 'append', fail_on_second_room)
+    with pytest.raises(RuntimeError):
+        client.post(endpoint, json={'room_ids': rooms, **body}, headers=staff)
+    monkeypatch.setattr(manager.events, 'append', append)
+    # 第一个房间已经写入的修改随整个事务撤销
+    assert [status(client, room_id, staff) for room_id in rooms] == before
+    assert manager.verify_room_state() == []
+    assert manager.verify_stay_totals() == []
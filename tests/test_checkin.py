@@ -0,0 +1,54 @@
+import sqlite3
+import threading
+
+import pytest
+
+from acm import ACMDatabase, Manager, SQLiteStorage
+from acm.passwords import PasswordHasher
+
+
+@pytest.fixture
+def managers(clock, db_path):
+    """共享同一个数据库文件的两个实例，模拟两个进程"""
+    managers = [Manager(clock=clock, storage=SQLiteStorage(ACMDatabase(db_path)), hasher=PasswordHasher(rounds=4))
+                for _ in range(2)]
+    yield managers
+    for manager in managers:
+        manager.storage.close()
+
+
+def test_same_user_checks_in_through_one_instance_only(managers, clock):
+    first, second = managers
+    user_ids = [first.create_user(f"guest{i}", f"phone{i}", 'x', 'x') for i in range(20)]
+    results = {}
+    barrier = threading.Barrier(2 * len(user_ids))
+
+    def checkin(manager, user_id):
+        barrier.wait()
+        results[manager, user_id] = manager.checkin(user_id)
+
+    threads = [threading.Thread(target=checkin, args=(manager, user_id))
+               for user_id in user_ids for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    for user_id in user_ids:
+        outcome = sorted(results[manager, user_id] for manager in managers)
+        assert outcome[0] == -2 and outcome[1] > 0
+    # 已经在另一个实例入住的客人，不能再从这个实例入住
+    owner = {user_id: next(m for m in managers if results[m, user_id] > 0) for user_id in user_ids}
+    other = next(m for m in managers if m is not owner[user_ids[0]])
+    assert other.checkin(user_ids[0]) == -2
+    assert owner[user_ids[0]].checkout(user_ids[0])[0] >= 0
+    clock.advance(seconds=1)
+    assert other.checkin(user_ids[0]) > 0
+
+
+def test_database_rejects_second_room_for_occupied_user(sqlite_manager):
+    user_id = sqlite_manager.create_user('guest', 'phone', 'x', 'x')
+    assert sqlite_manager.checkin(user_id) > 0
+    with pytest.raises(sqlite3.IntegrityError):
+        with sqlite_manager.db.transaction() as c:
+            c.execute("UPDATE rooms SET busy = 1, user_id = ? WHERE id = (SELECT MIN(id) FROM rooms WHERE busy = 0)",
+                      (user_id,))
@@ -0,0 +1,61 @@
+import pytest
+
+from acm import Settings
+from tests.helpers import check_in_guests
+
+
+def use_ac(manager, clock, room_id, temperatures):
+    """开空调后依次调到每个温度，每次间隔十分钟，空调保持开启"""
+    manager.turn_on_ac(room_id)
+    for temperature in temperatures:
+        clock.advance(seconds=600)
+        manager.set_ac(room_id, Settings(temperature=temperature, fan_speed='mid', mode='heat'))
+    clock.advance(seconds=600)
+
+
+def test_checkout_total_matches_bill(manager, clock):
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    use_ac(manager, clock, room_id, (20, 22, 30))
+    running = manager.get_cost(user_id)
+    total, invoices = manager.checkout(user_id)
+    # 退房时关闭正在运行的一段，账单包括这一段
+    assert len(invoices) == 4
+    assert total == pytest.approx(sum(invoice.cost for invoice in invoices))
+    assert total == pytest.approx(running)
+    assert manager.get_room_id_by_user(user_id) == -1
+    assert manager.checkout(user_id) == -1
+    assert manager.verify_stay_totals() == []
+
+
+def test_bill_only_contains_the_current_stay(manager, clock):
+    [(user_id, room_id), (other_id, other_room)] = check_in_guests(manager, 2)
+    use_ac(manager, clock, room_id, (20, 21))
+    use_ac(manager, clock, other_room, (25,))
+    first_total, _ = manager.checkout(user_id)
+    clock.advance(seconds=1)
+    room_id = manager.checkin(user_id)
+    use_ac(manager, clock, room_id, (24,))
+    total, invoices = manager.checkout(user_id)
+    assert len(invoices) == 2
+    assert total == pytest.approx(sum(invoice.cost for invoice in invoices))
+    assert total != pytest.approx(first_total)
+    assert manager.verify_stay_totals() == []
+
+
+def test_failed_checkout_leaves_the_stay_open(manager, clock):
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    use_ac(manager, clock, room_id, (20,))
+    running = manager.get_cost(user_id)
+    with pytest.raises(RuntimeError):
+        with manager.storage.transaction():
+            assert manager.checkout(user_id) != -1
+            raise RuntimeError
+    assert manager.get_room_id_by_user(user_id) == room_id
+    assert manager.check_status(room_id)[:2] == (1, 1)
+    assert manager.get_cost(user_id) == pytest.approx(running)
+    total, invoices = manager.checkout(user_id)
+    assert len(invoices) == 2
+    assert total == pytest.approx(running)
+    assert total == pytest.approx(sum(invoice.cost for invoice in invoices))
+    assert manager.verify_stay_totals() == []
+    assert manager.verify_room_state() == []
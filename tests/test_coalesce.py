@@ -0,0 +1,122 @@
+import random
+
+import pytest
+
+from acm import Manager, MemoryStorage, Settings
+from acm.clock import ManualClock
+from acm.passwords import PasswordHasher
+from acm.pricing import price_segment
+from benchmarks.bench_coalesce import operations, run
+from tests.conftest import START_MS
+from tests.helpers import check_in_guests
+
+LOW = Settings(temperature=25, fan_speed='low', mode='cool')
+
+
+def coalescing_manager(clock, window_ms=5000):
+    return Manager(clock=clock, storage=MemoryStorage(), hasher=PasswordHasher(rounds=4), coalesce_ms=window_ms)
+
+
+def by_setting(manager):
+    # 不合并时会写入零长度的时段，这样的分组没有费用，不参与比较
+    return {(item.mode, item.fan_speed): pytest.approx(item.runtime_hours * 3600) for item in
+            manager.generate_summary('setting') if item.runtime_hours}
+
+
+def test_temperature_taps_merge_into_open_segment(clock):
+    manager = coalescing_manager(clock)
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    manager.turn_on_ac(room_id)
+    # 时段还没有经过时间，直接替换设置
+    manager.set_ac(room_id, LOW)
+    for temperature in (24, 23, 22):
+        clock.advance(seconds=1)
+        manager.set_ac(room_id, Settings(temperature=temperature, fan_speed='low', mode='cool'))
+    clock.advance(seconds=60)
+    manager.turn_off_ac(room_id)
+    assert len(manager.report_rows()) == 1
+    assert by_setting(manager) == {('cool', 'low'): 63}
+
+
+def test_merged_taps_still_write_room_and_event_rows(sqlite_manager, clock):
+    sqlite_manager.coalesce_ms = 5000
+    [(_, room_id)] = check_in_guests(sqlite_manager, 1)
+    sqlite_manager.turn_on_ac(room_id)
+    sqlite_manager.set_ac(room_id, LOW)
+    start = clock.now_ms()
+    events = len(sqlite_manager.storage.event_rows())
+    rows = sqlite_manager.db.total_changes()
+    for temperature in (24, 23, 22):
+        clock.advance(seconds=1)
+        sqlite_manager.set_ac(room_id, Settings(temperature=temperature, fan_speed='low', mode='cool'))
+    # 不写使用记录，但每次点按都更新 rooms 并追加一条事件
+    assert sqlite_manager.report_rows() == []
+    assert len(sqlite_manager.storage.event_rows()) == events + 3
+    assert sqlite_manager.db.total_changes() - rows == 3 * 2
+    clock.advance(seconds=60)
+    sqlite_manager.turn_off_ac(room_id)
+    # 记录只保存最后的温度，费用包括之前各个温度的部分
+    [record] = sqlite_manager.report_rows()
+    assert record[5] == 22
+    pieces = [(0, 1, 25), (1, 2, 24), (2, 3, 23), (3, 63, 22)]
+    assert record[-1] == pytest.approx(sum(price_segment(start + a * 1000, start + b * 1000, temperature, 'low', 'cool')
+                                           for a, b, temperature in pieces))
+
+
+def test_fan_speed_change_closes_segment(clock):
+    manager = coalescing_manager(clock)
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    manager.turn_on_ac(room_id)
+    manager.set_ac(room_id, LOW)
+    clock.advance(seconds=2)
+    manager.set_ac(room_id, Settings(temperature=25, fan_speed='high', mode='cool'))
+    clock.advance(seconds=60)
+    manager.turn_off_ac(room_id)
+    # 改风速之前的两秒记在低风速下
+    assert by_setting(manager) == {('cool', 'low'): 2, ('cool', 'high'): 60}
+
+
+def bills(window_ms, steps):
+    """在同一个时钟序列上执行 steps，返回实时费用、退房账单和按设置的汇总"""
+    clock = ManualClock(START_MS)
+    manager = coalescing_manager(clock, window_ms)
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    observed = []
+    for delay_ms, settings in steps:
+        clock.advance(seconds=delay_ms / 1000)
+        if settings is None:
+            manager.turn_on_ac(room_id)
+        else:
+            manager.set_ac(room_id, settings)
+        observed.append(manager.get_cost(user_id))
+    clock.advance(seconds=60)
+    observed.append(manager.checkout(user_id)[0])
+    return observed, by_setting(manager)
+
+
+def test_settings_changes_inside_window_bill_the_same(clock):
+    steps = [(0, None), (0, LOW), (800, Settings(temperature=22, fan_speed='low', mode='cool')),
+             (900, Settings(temperature=22, fan_speed='high', mode='cool')),
+             (0, Settings(temperature=28, fan_speed='high', mode='heat')),
+             (1200, Settings(temperature=27, fan_speed='high', mode='heat')),
+             (400, Settings(temperature=25, fan_speed='low', mode='cool'))]
+    expected, expected_settings = bills(0, steps)
+    actual, actual_settings = bills(5000, steps)
+    assert actual == pytest.approx(expected, rel=1e-9, abs=1e-9)
+    assert actual_settings == expected_settings
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_coalesced_bills_match_uncoalesced(seed, monkeypatch, tmp_path):
+    # 与 benchmarks/bench_coalesce 相同的随机操作序列，包括快速连按中修改风速和模式
+    monkeypatch.chdir(tmp_path)
+    ops = operations(random.Random(seed), 3, 150)
+    expected, expected_settings, (records, _), problems, _ = run(ops, 3, 0, 'memory')
+    actual, actual_settings, (merged_records, _), merged_problems, _ = run(ops, 3, 5000, 'memory')
+    assert [item[:2] for item in actual] == [item[:2] for item in expected]
+    assert [item[2] for item in actual] == pytest.approx([item[2] for item in expected], rel=1e-9, abs=1e-9)
+    assert actual_settings.keys() == expected_settings.keys()
+    for key, values in expected_settings.items():
+        assert actual_settings[key] == pytest.approx(values, rel=1e-9, abs=1e-9)
+    assert not any(problems.values()) and not any(merged_problems.values())
+    assert merged_records <= records
@@ -0,0 +1,29 @@
+from tests.helpers import check_in_guests
+from tests.test_rooms import read_in_thread
+
+
+def test_cost_read_between_commit_and_publish(manager, clock):
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    manager.turn_on_ac(room_id)
+    clock.advance(seconds=600)
+    running = manager.get_cost(user_id)
+    assert running > 0
+    seen = []
+    with manager.storage.transaction():
+        # 先登记的回调先执行：事务已经提交，内存中的房间状态还没有更新
+        manager.storage.after_commit(lambda: seen.append(read_in_thread(manager.get_cost, user_id)))
+        manager.turn_off_ac(room_id)
+    assert seen == [running]
+    assert manager.get_cost(user_id) == running
+
+
+def test_snapshot_cost_matches_get_cost(manager, clock):
+    guests = check_in_guests(manager, 3)
+    for _, room_id in guests[:2]:
+        manager.turn_on_ac(room_id)
+    clock.advance(seconds=300)
+    manager.turn_off_ac(guests[0][1])
+    clock.advance(seconds=300)
+    _, rooms = manager.room_snapshot()
+    costs = {room['user_id']: room['cost'] for room in rooms if room['busy']}
+    assert costs == {user_id: manager.get_cost(user_id) for user_id, _ in guests}
@@ -0,0 +1,124 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from acm import AsyncManager, Manager, MemoryStorage
+from acm.passwords import PasswordHasher
+from tests.helpers import check_in_guests
+
+
+@pytest.fixture
+def hotel(clock):
+    """两位客人入住，返回 (manager, [房间号])"""
+    manager = Manager(clock=clock, storage=MemoryStorage(), hasher=PasswordHasher(rounds=4))
+    return manager, [room_id for _, room_id in check_in_guests(manager, 2)]
+
+
+def parse(message):
+    """SSE 消息 -> (event, id, data)"""
+    fields = dict(line.split(': ', 1) for line in message.strip().split('\n'))
+    return fields['event'], int(fields['id']) if 'id' in fields else None, json.loads(fields['data'])
+
+
+async def open_feed(acm, room_id=None):
+    """直接调用 /ac/feed 的处理函数，返回逐条产生 SSE 消息的异步迭代器"""
+    import main
+
+    request = SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(encoded_changes={})))
+    response = await main.room_feed(request, room_id, acm)
+    return response.body_iterator
+
+
+async def next_message(feed):
+    return parse(await asyncio.wait_for(feed.__anext__(), 2))
+
+
+def test_snapshot_comes_before_changes(hotel):
+    manager, (first, second) = hotel
+
+    async def run():
+        acm = AsyncManager(manager)
+        feed = await open_feed(acm)
+        event, seq, rooms = await next_message(feed)
+        assert event == 'snapshot'
+        assert {room['room_id']: room['ac_on'] for room in rooms if room['busy']} == {first: 0, second: 0}
+        await acm.turn_on_ac(first)
+        await acm.turn_on_ac(second)
+        changes = [await next_message(feed) for _ in range(2)]
+        assert [(event, change_seq) for event, change_seq, _ in changes] == [('change', seq + 1), ('change', seq + 2)]
+        assert [[(room['room_id'], room['ac_on']) for room in rooms] for _, _, rooms in changes] == \
+               [[(first, 1)], [(second, 1)]]
+        await feed.aclose()
+        await acm.close()
+
+    asyncio.run(run())
+    assert not manager.bus.active
+
+
+def test_room_filter_only_sends_that_room(hotel):
+    manager, (first, second) = hotel
+
+    async def run():
+        acm = AsyncManager(manager)
+        feed = await open_feed(acm, room_id=second)
+        event, seq, rooms = await next_message(feed)
+        assert (event, [room['room_id'] for room in rooms]) == ('snapshot', [second])
+        # 只修改了其他房间的变更不发送
+        await acm.turn_on_ac(first)
+        await acm.turn_on_ac(second)
+        event, change_seq, rooms = await next_message(feed)
+        assert (event, change_seq, [(room['room_id'], room['ac_on']) for room in rooms]) == \
+               ('change', seq + 2, [(second, 1)])
+        await feed.aclose()
+        await acm.close()
+
+    asyncio.run(run())
+
+
+def test_changes_already_in_the_snapshot_are_skipped(hotel):
+    manager, (first, second) = hotel
+
+    async def run():
+        acm = AsyncManager(manager)
+        room_snapshot = acm.room_snapshot
+
+        async def snapshot_after_change():
+            # 订阅之后、取快照之前提交的变更，快照中已经包含
+            await acm.turn_on_ac(first)
+            return await room_snapshot()
+
+        acm.room_snapshot = snapshot_after_change
+        feed = await open_feed(acm)
+        event, seq, rooms = await next_message(feed)
+        assert event == 'snapshot'
+        assert {room['room_id']: room['ac_on'] for room in rooms if room['busy']} == {first: 1, second: 0}
+        await acm.turn_on_ac(second)
+        event, change_seq, rooms = await next_message(feed)
+        assert (event, change_seq, [room['room_id'] for room in rooms]) == ('change', seq + 1, [second])
+        await feed.aclose()
+        await acm.close()
+
+    asyncio.run(run())
+
+
+def test_slow_subscriber_is_dropped(hotel):
+    manager, (first, second) = hotel
+    manager.bus.queue_size = 1
+
+    async def run():
+        acm = AsyncManager(manager)
+        feed = await open_feed(acm)
+        assert (await next_message(feed))[0] == 'snapshot'
+        # 不读取变更，积压超过 queue_size 后被断开
+        await acm.turn_on_ac(first)
+        await acm.turn_on_ac(second)
+        await asyncio.sleep(0)
+        assert (await next_message(feed))[0] == 'dropped'
+        with pytest.raises(StopAsyncIteration):
+            await feed.__anext__()
+        await acm.close()
+
+    asyncio.run(run())
+    assert not manager.bus.active
@@ -0,0 +1,92 @@
+import pytest
+
+from acm import MaintenancePolicy, Settings
+from acm.maintenance import merge_segments, run_maintenance
+from tests.helpers import check_in_guests
+
+POLICY = MaintenancePolicy(retention_days=30, batch_stays=2, pause_ms=0)
+
+
+def stay(manager, clock, room_id):
+    """开关空调时不改设置，关掉后同一毫秒再打开，产生首尾相接、可以合并的时段"""
+    manager.turn_on_ac(room_id)
+    for _ in range(3):
+        clock.advance(seconds=600)
+        manager.turn_off_ac(room_id)
+        manager.turn_on_ac(room_id)
+    clock.advance(seconds=600)
+    manager.set_ac(room_id, Settings(temperature=20, fan_speed='low', mode='heat'))
+    clock.advance(seconds=600)
+    manager.turn_off_ac(room_id)
+
+
+def count(manager, table):
+    with manager.db.cursor() as c:
+        c.execute(f"SELECT COUNT(*) FROM {table}")
+        return c.fetchone()[0]
+
+
+def pages(manager, limit):
+    rows, after_id = [], 0
+    while True:
+        page = manager.report_rows(after_id=after_id, limit=limit)
+        rows.extend(page)
+        if len(page) < limit:
+            return rows
+        after_id = page[-1][0]
+
+
+@pytest.fixture
+def history(sqlite_manager, clock):
+    """三位客人退房一个多月后，第四位客人还在住"""
+    guests = check_in_guests(sqlite_manager, 4)
+    for user_id, room_id in guests:
+        stay(sqlite_manager, clock, room_id)
+    for user_id, _ in guests[:3]:
+        sqlite_manager.checkout(user_id)
+    clock.advance(seconds=31 * 24 * 3600)
+    return guests
+
+
+def summaries(manager):
+    return {group: [item.model_dump() for item in manager.generate_summary(group)]
+            for group in ('room', 'day', 'week', 'setting')}
+
+
+def test_archived_history_reads_like_merged_hot_table(sqlite_manager, clock, history):
+    before = sqlite_manager.report_rows()
+    summary = summaries(sqlite_manager)
+    stats = run_maintenance(sqlite_manager.storage, POLICY, clock.now_ms())
+    assert (stats['stays'], stats['batches']) == (3, 2)
+    after = sqlite_manager.report_rows()
+    # 视图中的记录就是合并后的原记录，保留第一段的 id
+    archived = [row for row in before if row[1] != history[3][0]]
+    hot = [row for row in before if row[1] == history[3][0]]
+    assert after == sorted(list(merge_segments(archived)) + hot)
+    assert len(after) < len(before)
+    assert count(sqlite_manager, 'ac_usage_record') == len(hot)
+    assert count(sqlite_manager, 'ac_usage_archive') == stats['archived'] == len(after) - len(hot)
+    assert pages(sqlite_manager, 3) == after
+    # 汇总只有段数变少，费用和运行时间不变
+    for group, items in summaries(sqlite_manager).items():
+        expected = summary[group]
+        assert [{**item, 'segments': 0, 'cost': pytest.approx(item['cost'])} for item in items] == \
+               [{**item, 'segments': 0} for item in expected]
+        assert sum(item['segments'] for item in items) == len(after)
+    assert sqlite_manager.verify_stay_totals() == []
+    assert sqlite_manager.verify_rollups() == []
+    assert sqlite_manager.verify_events() == []
+
+
+def test_archiving_leaves_current_stay_alone(sqlite_manager, clock, history):
+    user_id, room_id = history[3]
+    bill = sqlite_manager.generate_bill(user_id)
+    running = sqlite_manager.get_cost(user_id)
+    run_maintenance(sqlite_manager.storage, POLICY, clock.now_ms())
+    # 第二次没有可以归档的入住
+    assert run_maintenance(sqlite_manager.storage, POLICY, clock.now_ms())['stays'] == 0
+    assert sqlite_manager.generate_bill(user_id) == bill
+    assert sqlite_manager.get_cost(user_id) == running
+    total, invoices = sqlite_manager.checkout(user_id)
+    assert invoices == bill[1]
+    assert total == pytest.approx(running)
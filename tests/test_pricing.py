@@ -0,0 +1,82 @@
+import itertools
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from acm.pricing import batch_costs, fan_speed_code, mode_code, price_segment, segment_cost
+from acm.sessions import STAFF
+from acm.utils import calculate_cost
+from tests.conftest import START_MS
+from tests.helpers import check_in_guests, login
+
+# 计价引擎之前 utils.calculate_cost 的实现，作为对照
+ORIGINAL_FAN_SPEEDS = {"low": 1.0, "mid": 1.2, "high": 1.5}
+ORIGINAL_MODES = {"cool": 1.0, "heat": 1.2}
+
+
+def original_cost(start_time, end_time, temperature, fan_speed, mode):
+    start_time = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
+    end_time = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
+    time = (end_time - start_time).total_seconds() / 3600
+    return (10 * time * (abs(temperature - 26) * 0.02 + 1)
+            * ORIGINAL_FAN_SPEEDS[fan_speed.lower()] * ORIGINAL_MODES[mode.lower()])
+
+
+def iso(epoch_ms):
+    return (datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(milliseconds=epoch_ms)).isoformat()
+
+
+# 零长度、一毫秒、整秒、整小时前后一毫秒、跨天以及一个月
+DURATIONS_MS = (0, 1, 999, 1000, 59_999, 3_599_999, 3_600_000, 3_600_001, 86_400_000, 30 * 86_400_000)
+TEMPERATURES = (16, 25, 26, 27, 30)
+# 房间表中的设置首字母大写，计价不区分大小写
+FAN_SPEEDS = ('low', 'Mid', 'HIGH')
+MODES = ('cool', 'Heat')
+CASES = list(itertools.product(DURATIONS_MS, TEMPERATURES, FAN_SPEEDS, MODES))
+
+
+@pytest.mark.parametrize('duration, temperature, fan_speed, mode', CASES)
+def test_single_segment_matches_original_formula(duration, temperature, fan_speed, mode):
+    start, end = START_MS + 123, START_MS + 123 + duration
+    expected = original_cost(iso(start), iso(end), temperature, fan_speed, mode)
+    assert price_segment(start, end, temperature, fan_speed, mode) == pytest.approx(expected, rel=1e-12, abs=0)
+    assert segment_cost(start, end, temperature, fan_speed_code(fan_speed), mode_code(mode)) == pytest.approx(
+        expected, rel=1e-12, abs=0)
+    assert calculate_cost(iso(start), iso(end), temperature, fan_speed, mode) == pytest.approx(
+        expected, rel=1e-12, abs=0)
+
+
+def test_batch_matches_original_formula():
+    starts = [START_MS + 7 * i for i in range(len(CASES))]
+    ends = [start + duration for start, (duration, *_) in zip(starts, CASES)]
+    costs = batch_costs(starts, ends, [case[1] for case in CASES], [fan_speed_code(case[2]) for case in CASES],
+                        [mode_code(case[3]) for case in CASES])
+    expected = [original_cost(iso(start), iso(end), temperature, fan_speed, mode)
+                for start, end, (_, temperature, fan_speed, mode) in zip(starts, ends, CASES)]
+    assert costs.tolist() == pytest.approx(expected, rel=1e-12, abs=0)
+
+
+def test_batch_of_nothing_is_empty():
+    assert len(batch_costs([], [], [], [], [])) == 0
+
+
+@pytest.mark.parametrize('fan_speed, mode', [('turbo', 'cool'), ('low', 'dry')])
+def test_unknown_setting_is_rejected(fan_speed, mode):
+    with pytest.raises(ValueError):
+        price_segment(START_MS, START_MS + 1000, 26, fan_speed, mode)
+
+
+@pytest.mark.parametrize('fan_speed, mode', [('turbo', 'cool'), ('low', 'dry')])
+def test_unknown_setting_is_rejected_by_the_api(client, fan_speed, mode):
+    [(_, room_id)] = check_in_guests(client.app.state.acm.manager, 1)
+    _, staff = login(client, 'front desk', STAFF)
+    settings = {'temperature': 24, 'fan_speed': fan_speed, 'mode': mode}
+    assert client.post('/ac/on', json={'room_id': room_id}, headers=staff).json()['status'] == 0
+    assert client.post('/ac/settings', json={'room_id': room_id, 'settings': settings},
+                       headers=staff).status_code == 422
+    assert client.post('/ac/bulk/settings', json={'room_ids': [room_id], 'settings': settings},
+                       headers=staff).status_code == 422
+    # 与默认设置一样，大小写不同的取值可以接受
+    settings = {'temperature': 24, 'fan_speed': 'High', 'mode': 'Heat'}
+    response = client.post('/ac/settings', json={'room_id': room_id, 'settings': settings}, headers=staff)
+    assert response.json() == {'status': 0, 'settings': settings}
@@ -0,0 +1,46 @@
+from acm import ACMDatabase, Manager, Settings, SQLiteStorage
+from acm.migrations import query_plan_scans
+from acm.passwords import PasswordHasher
+
+WRITE_OR_READ = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+
+
+class TracedDatabase(ACMDatabase):
+    """记录每个连接执行的 SQL，参数已经代入"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.statements = []
+
+    def get_connection(self):
+        conn = super().get_connection()
+        conn.set_trace_callback(self.statements.append)
+        return conn
+
+
+def test_hot_path_queries_use_indexes(clock, db_path):
+    db = TracedDatabase(db_path)
+    manager = Manager(clock=clock, storage=SQLiteStorage(db), hasher=PasswordHasher(rounds=4))
+    users = [manager.create_user(f"guest{i}", f"phone{i}", 'x', 'x') for i in range(20)]
+    # 启动时整表加载房间不算热点路径
+    db.statements.clear()
+    for user_id in users[:10]:
+        manager.get_login_user(f"guest{user_id - 1}")
+        room_id = manager.checkin(user_id)
+        manager.turn_on_ac(room_id)
+        clock.advance(seconds=60)
+        manager.set_ac(room_id, Settings(temperature=22, fan_speed='high', mode='cool'))
+        clock.advance(seconds=60)
+        manager.get_cost(user_id)
+        manager.generate_bill(user_id)
+        manager.turn_off_ac(room_id)
+        manager.checkout(user_id)
+    manager.generate_report(limit=10)
+    manager.generate_report(after_id=5, limit=10, room_id=1)
+    manager.generate_report(limit=10, user_id=users[0])
+    statements = {sql for sql in db.statements if sql.lstrip().split(None, 1)[0].upper() in WRITE_OR_READ}
+    assert statements
+    with db.connection() as conn:
+        scans = {sql: query_plan_scans(conn, sql) for sql in statements}
+    db.close()
+    assert {sql: steps for sql, steps in scans.items() if steps} == {}
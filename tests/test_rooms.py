@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+
+from tests.helpers import check_in_guests
+
+
+def read_in_thread(fn, *args):
+    """在另一个线程中执行 fn，模拟 AsyncManager 的读线程"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(fn(*args)))
+    thread.start()
+    thread.join(5)
+    return result[0]
+
+
+def ac_on(manager, room_id):
+    return manager.check_status(room_id)[1]
+
+
+def test_uncommitted_room_state_is_only_visible_to_writer(manager):
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    with manager.storage.transaction():
+        manager.turn_on_ac(room_id)
+        assert ac_on(manager, room_id) == 1
+        assert read_in_thread(ac_on, manager, room_id) == 0
+    assert read_in_thread(ac_on, manager, room_id) == 1
+    assert not manager.rooms.staging
+
+
+def test_rolled_back_room_state_is_never_visible(manager):
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    with pytest.raises(RuntimeError):
+        with manager.storage.transaction():
+            manager.turn_on_ac(room_id)
+            raise RuntimeError
+    assert ac_on(manager, room_id) == 0
+    assert read_in_thread(ac_on, manager, room_id) == 0
+    assert not manager.rooms.staging
+    assert manager.verify_room_state() == []
+
+
+def test_nested_rollback_keeps_earlier_changes(manager):
+    [(_, first), (_, second)] = check_in_guests(manager, 2)
+    with manager.storage.transaction():
+        manager.turn_on_ac(first)
+        with pytest.raises(RuntimeError):
+            with manager.storage.transaction():
+                manager.turn_on_ac(second)
+                raise RuntimeError
+        assert (ac_on(manager, first), ac_on(manager, second)) == (1, 0)
+    assert read_in_thread(lambda: (ac_on(manager, first), ac_on(manager, second))) == (1, 0)
+    assert manager.verify_room_state() == []
+
+
+def test_checkout_is_visible_by_user_after_commit(manager):
+    [(user_id, room_id)] = check_in_guests(manager, 1)
+    with manager.storage.transaction():
+        manager.checkout(user_id)
+        assert manager.get_room_id_by_user(user_id) == -1
+        assert read_in_thread(manager.get_room_id_by_user, user_id) == room_id
+    assert read_in_thread(manager.get_room_id_by_user, user_id) == -1
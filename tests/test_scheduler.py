@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+from acm import AsyncManager, Manager, MemoryStorage
+from acm.passwords import PasswordHasher
+from acm.rooms import AC_WAITING
+from acm.scheduler import ServiceScheduler, scheduler_loop
+from tests.helpers import check_in_guests
+
+
+def test_scheduler_loop_checks_deadline_on_writer(clock):
+    scheduler = ServiceScheduler(capacity=1, time_slice_ms=1000)
+    manager = Manager(clock=clock, storage=MemoryStorage(), hasher=PasswordHasher(rounds=4), scheduler=scheduler)
+    [(_, first), (_, second)] = check_in_guests(manager, 2)
+    manager.turn_on_ac(first)
+    manager.turn_on_ac(second)
+    assert (manager.check_status(first)[1], manager.check_status(second)[1]) == (1, AC_WAITING)
+    threads = []
+    next_deadline = scheduler.next_deadline
+
+    def record_thread():
+        threads.append(threading.current_thread().name)
+        return next_deadline()
+
+    scheduler.next_deadline = record_thread
+
+    async def run():
+        acm = AsyncManager(manager)
+        await acm.start()
+        ticker = asyncio.create_task(scheduler_loop(acm, interval_s=0.01))
+        await asyncio.sleep(0.05)
+        clock.advance(seconds=1)
+        await asyncio.sleep(0.05)
+        ticker.cancel()
+        await acm.close()
+
+    asyncio.run(run())
+    assert threads and all(name.startswith('acm-writer') for name in threads)
+    assert (manager.check_status(first)[1], manager.check_status(second)[1]) == (AC_WAITING, 1)
@@ -0,0 +1,116 @@
+import threading
+
+from acm.passwords import PasswordHasher
+from acm.sessions import GUEST, STAFF, SessionStore
+from tests.helpers import login
+
+
+def test_guest_endpoints_require_a_session(client):
+    user_id, _ = login(client, 'guest')
+    for endpoint, body in [('/checkin', {'user_id': user_id}), ('/checkout', {'user_id': user_id}),
+                           ('/ac/cost', {'user_id': user_id}), ('/ac/on', {'room_id': 1}),
+                           ('/ac/off', {'room_id': 1}), ('/ac/status', {'room_id': 1}),
+                           ('/ac/settings', {'room_id': 1, 'settings': {'temperature': 24, 'fan_speed': 'low',
+                                                                        'mode': 'cool'}})]:
+        assert client.post(endpoint, json=body).status_code == 401
+        assert client.post(endpoint, json=body, headers={'Authorization': 'Bearer forged.token'}).status_code == 401
+
+
+def test_session_only_controls_its_own_user_and_room(client):
+    user_id, headers = login(client, 'guest')
+    other_id, other_headers = login(client, 'other')
+    room_id = client.post('/checkin', json={'user_id': user_id}, headers=headers).json()['room_id']
+    assert room_id > 0
+    assert client.post('/checkin', json={'user_id': other_id}, headers=headers).status_code == 403
+    assert client.post('/ac/on', json={'room_id': room_id}, headers=other_headers).status_code == 403
+    assert client.post('/ac/cost', json={'user_id': user_id}, headers=other_headers).status_code == 403
+    # 入住后会话中缓存的房间号随之更新，不需要重新登录
+    assert client.post('/ac/on', json={'room_id': room_id}, headers=headers).json()['status'] == 0
+    assert client.post('/ac/status', json={'room_id': room_id}, headers=headers).json()['ac_on'] == 1
+    assert client.post('/checkout', json={'user_id': user_id}, headers=headers).status_code == 200
+    assert client.post('/ac/off', json={'room_id': room_id}, headers=headers).status_code == 403
+
+
+def test_guest_cannot_act_for_another_guest(client):
+    user_id, headers = login(client, 'guest')
+    other_id, other_headers = login(client, 'other')
+    room_id = client.post('/checkin', json={'user_id': user_id}, headers=headers).json()['room_id']
+    other_room = client.post('/checkin', json={'user_id': other_id}, headers=other_headers).json()['room_id']
+    assert client.post('/checkout', json={'user_id': user_id}, headers=other_headers).status_code == 403
+    assert client.post('/ac/status', json={'room_id': room_id}, headers=other_headers).status_code == 403
+    assert client.post('/ac/status', json={'room_id': other_room}, headers=other_headers).status_code == 200
+    assert client.post('/ac/settings', json={'room_id': room_id, 'settings': {
+        'temperature': 24, 'fan_speed': 'low', 'mode': 'cool'}}, headers=other_headers).status_code == 403
+
+
+def test_staff_acts_on_behalf_of_guests(client):
+    user_id, _ = login(client, 'guest')
+    _, staff = login(client, 'front desk', STAFF)
+    room_id = client.post('/checkin', json={'user_id': user_id}, headers=staff).json()['room_id']
+    assert room_id > 0
+    assert client.post('/ac/on', json={'room_id': room_id}, headers=staff).json()['status'] == 0
+    status = client.post('/ac/status', json={'room_id': room_id}, headers=staff).json()
+    assert (status['busy'], status['ac_on']) == (1, 1)
+    assert client.post('/ac/cost', json={'user_id': user_id}, headers=staff).status_code == 200
+    assert client.post('/checkout', json={'user_id': user_id}, headers=staff).status_code == 200
+
+
+def test_role_is_set_from_the_command_line(tmp_path):
+    from acm.__main__ import main
+    from acm import ACMDatabase, SQLiteStorage
+
+    storage = SQLiteStorage(ACMDatabase(str(tmp_path / 'acm.db')))
+    storage.migrate()
+    storage.create_user('front desk', 'phone', 'x', 'x')
+    storage.close()
+    assert main(['--db', str(tmp_path / 'acm.db'), 'users', 'role', 'front desk', str(STAFF)]) == 0
+    assert main(['--db', str(tmp_path / 'acm.db'), 'users', 'role', 'nobody', str(STAFF)]) == 1
+    storage = SQLiteStorage(ACMDatabase(str(tmp_path / 'acm.db')))
+    assert storage.get_login_user('front desk')[2] == STAFF
+    storage.close()
+
+
+def test_token_is_checked_without_shared_state():
+    issuer = SessionStore(secret='secret', room_of=lambda user_id: 7)
+    token = issuer.create(3, GUEST, -1)
+    # 另一个进程的缓存里没有这个令牌，只凭签名接受，房间号通过 room_of 查询
+    other = SessionStore(secret='secret', room_of=lambda user_id: 7)
+    session = other.get(token)
+    assert (session.user_id, session.role, session.room_id) == (3, GUEST, 7)
+    assert SessionStore(secret='another secret').get(token) is None
+    # 改动令牌中的角色会使签名失效
+    user_id, role, rest = token.split('.', 2)
+    assert other.get(f"{user_id}.{STAFF}.{rest}") is None
+    assert other.get('not a token') is None
+    other.revoke(token)
+    assert other.get(token) is None
+
+
+def test_expired_token_is_rejected():
+    store = SessionStore(secret='secret', ttl=-1)
+    assert store.get(store.create(3, GUEST, -1)) is None
+
+
+def test_wrong_password_is_rejected(client):
+    login(client, 'guest')
+    assert client.post('/login', json={'name': 'guest', 'password': 'wrong'}).status_code == 401
+    assert client.post('/login', json={'name': 'nobody', 'password': 'pw'}).status_code == 401
+
+
+def test_full_hasher_queue_returns_503(client):
+    login(client, 'guest')
+    # 只有一个计算位并且不允许排队，占住它之后注册和登录都立即返回 503
+    hasher = client.app.state.acm.manager.hasher = PasswordHasher(rounds=4, max_workers=1, max_pending=0)
+    release, released = threading.Event(), threading.Event()
+    busy = hasher.submit(release.wait, 5)
+    # 在 submit 登记的归还计算位的回调之后执行
+    busy.add_done_callback(lambda _: released.set())
+    try:
+        register = {'name': 'late', 'phone': 'late', 'password': 'pw'}
+        assert client.post('/user/register', json=register).status_code == 503
+        assert client.post('/login', json={'name': 'guest', 'password': 'pw'}).status_code == 503
+    finally:
+        release.set()
+    assert released.wait(5)
+    assert client.post('/login', json={'name': 'guest', 'password': 'pw'}).status_code == 200
+    hasher.close()
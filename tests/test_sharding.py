@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+
+from acm.clock import ManualClock
+from acm.passwords import PasswordHasher
+from acm.sessions import STAFF, SessionStore
+from acm import AsyncManager
+from acm.sharding import ShardedManager, ShardFull, ShardMap, ShardReader
+from tests.conftest import START_MS
+
+
+def worker(shard_map, shard, clock):
+    """只拥有一个分片的 worker"""
+    return ShardedManager(shard_map, [shard], hasher=PasswordHasher(rounds=4), clock=clock)
+
+
+def use_ac(manager, clock, name, seconds=600):
+    """注册一位分到这个 worker 的客人，入住并开一段空调，返回 user_id"""
+    shard = manager.shards[0]
+    while True:
+        user_id = manager.create_user(name, name, 'x', 'x')
+        if manager.shard_map.shard_of_user(user_id) == shard:
+            break
+        name += '+'
+    room_id = manager.checkin(user_id)
+    manager.turn_on_ac(room_id)
+    clock.advance(seconds=seconds)
+    manager.turn_off_ac(room_id)
+    return user_id
+
+
+def test_reader_finds_shards_created_after_startup(tmp_path):
+    shard_map = ShardMap(2, rooms_per_shard=100, base=str(tmp_path / 'acm'))
+    clock = ManualClock(START_MS)
+    reader = ShardReader(shard_map)
+    assert reader.report_page() == ([], None)
+    first = worker(shard_map, 0, clock)
+    use_ac(first, clock, 'guest0')
+    assert [row[0] for row in reader.report_page()[0]] == [0]
+    # 第二个 worker 在读取方启动之后才创建分片文件
+    second = worker(shard_map, 1, clock)
+    use_ac(second, clock, 'guest1')
+    assert [row[0] for row in reader.report_page()[0]] == [0, 1]
+    assert sum(item.segments for item in reader.generate_summary('room')) == 2
+    for manager in (first, second):
+        manager.close()
+    reader.close()
+
+
+def test_reader_summary_does_not_write_to_shards(tmp_path):
+    shard_map = ShardMap(1, rooms_per_shard=100, base=str(tmp_path / 'acm'))
+    clock = ManualClock(START_MS)
+    owner = worker(shard_map, 0, clock)
+    use_ac(owner, clock, 'guest0')
+    owner.managers[0].refresh_rollups()
+    # 汇总表刷新之后的新记录
+    use_ac(owner, clock, 'guest1', seconds=1200)
+    reader = ShardReader(shard_map)
+    db = owner.managers[0].db
+    with db.cursor() as c:
+        c.execute("SELECT last_id FROM rollup_state")
+        before = c.fetchall()
+    summary = reader.generate_summary('setting')
+    with db.cursor() as c:
+        c.execute("SELECT last_id FROM rollup_state")
+        assert c.fetchall() == before
+    assert summary == owner.generate_summary('setting')
+    assert all(shard_db.readonly for shard_db in reader.dbs.values())
+    owner.close()
+    reader.close()
+
+
+def test_full_shard_is_reported_separately(tmp_path):
+    shard_map = ShardMap(2, rooms_per_shard=50, base=str(tmp_path / 'acm'))
+    manager = ShardedManager(shard_map, hasher=PasswordHasher(rounds=4), clock=ManualClock(START_MS))
+    guests = {0: [], 1: []}
+    i = 0
+    while len(guests[0]) < 51:
+        user_id = manager.create_user(f"guest{i}", f"guest{i}", 'x', 'x')
+        guests[shard_map.shard_of_user(user_id)].append(user_id)
+        i += 1
+    for user_id in guests[0][:50]:
+        assert shard_map.shard_of_room(manager.checkin(user_id)) == 0
+    # 分片 0 住满，分片 1 的房间全空，分片 0 的客人也不能住进去
+    with pytest.raises(ShardFull) as excinfo:
+        manager.checkin(guests[0][50])
+    assert excinfo.value.shard == 0
+    assert shard_map.shard_of_room(manager.checkin(guests[1][0])) == 1
+    manager.close()
+
+
+def test_registrations_commit_with_the_shard_transaction(tmp_path):
+    shard_map = ShardMap(1, rooms_per_shard=50, base=str(tmp_path / 'acm'))
+    manager = worker(shard_map, 0, ManualClock(START_MS))
+    storage = manager.managers[0].storage
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            manager.create_user('lost', 'lost', 'x', 'x')
+            raise RuntimeError
+    # 分片的事务回滚时，在其中创建的用户一起撤销
+    assert manager.get_user_id_by_name('lost') == -1
+    with storage.transaction():
+        first = manager.create_user('first', 'first', 'x', 'x')
+        # 手机号重复只撤销这一次写入
+        assert manager.create_user('again', 'first', 'x', 'x') == -1
+        second = manager.create_user('second', 'second', 'x', 'x')
+        # 目录库的事务在分片提交前一直没有提交
+        assert manager.users_db.in_transaction
+    assert not manager.users_db.in_transaction
+    assert [manager.get_user_id_by_name(name) for name in ('first', 'again', 'second')] == [first, -1, second]
+
+    async def register():
+        acm = AsyncManager(manager, batch_window=0.05)
+        try:
+            return await asyncio.gather(*(acm.register_user(f"guest{i}", f"guest{i}", 'pw') for i in range(5)))
+        finally:
+            await acm.close()
+
+    user_ids = asyncio.run(register())
+    assert [manager.get_user_id_by_name(f"guest{i}") for i in range(5)] == user_ids
+    assert manager.login('guest3', 'pw')[2] == user_ids[3]
+    manager.close()
+
+
+def sharded_env(monkeypatch, base, worker_index):
+    """两个分片、两个 worker 的部署中第 worker_index 个 worker 的环境变量"""
+    monkeypatch.setenv('ACM_SHARDS', '2')
+    monkeypatch.setenv('ACM_ROOMS_PER_SHARD', '100')
+    monkeypatch.setenv('ACM_DB_BASE', base)
+    monkeypatch.setenv('ACM_WORKER_INDEX', str(worker_index))
+    monkeypatch.setenv('ACM_WORKER_COUNT', '2')
+    monkeypatch.setenv('ACM_SESSION_SECRET', 'test-secret')
+
+
+def test_all_shards_report_endpoint_pages_across_shards(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    base = str(tmp_path / 'acm')
+    shard_map = ShardMap(2, rooms_per_shard=100, base=base)
+    clock = ManualClock(START_MS)
+    workers = [worker(shard_map, shard, clock) for shard in (0, 1)]
+    for i in range(3):
+        for manager in workers:
+            use_ac(manager, clock, f"guest{i}-{manager.shards[0]}")
+    sharded_env(monkeypatch, base, 0)
+    # 持有同一个密钥即可签发工作人员的令牌
+    staff = {'Authorization': f"Bearer {SessionStore(secret='test-secret').create(0, STAFF, -1)}"}
+    pages = []
+    with TestClient(main.app) as client:
+        params = {'limit': 4}
+        while True:
+            response = client.get('/ac/reports/all', params=params, headers=staff)
+            assert response.status_code == 200
+            pages.append([(item['shard'], item['id']) for item in response.json()])
+            if 'X-Next-Shard' not in response.headers:
+                break
+            params = {'limit': 4, 'shard': response.headers['X-Next-Shard'],
+                      'after_id': response.headers['X-Next-After-Id']}
+    for manager in workers:
+        manager.close()
+    assert [len(page) for page in pages] == [4, 2]
+    assert sum(pages, []) == [(0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3)]
+
+
+def test_token_issued_by_one_worker_is_accepted_by_another(tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    base = str(tmp_path / 'acm')
+    shard_map = ShardMap(2, rooms_per_shard=100, base=base)
+    # worker 0 处理登录，客人属于 worker 1 的分片
+    sharded_env(monkeypatch, base, 0)
+    with TestClient(main.app) as client:
+        client.app.state.acm.manager.hasher = PasswordHasher(rounds=4)
+        name = 'guest'
+        while True:
+            user_id = client.post('/user/register', json={'name': name, 'phone': name, 'password': 'pw'}).json()[
+                'user_id']
+            if shard_map.shard_of_user(user_id) == 1:
+                break
+            name += '+'
+        token = client.post('/login', json={'name': name, 'password': 'pw'}).json()['token']
+        headers = {'Authorization': f"Bearer {token}"}
+        assert client.post('/checkin', json={'user_id': user_id}, headers=headers).status_code == 421
+    sharded_env(monkeypatch, base, 1)
+    with TestClient(main.app) as client:
+        room_id = client.post('/checkin', json={'user_id': user_id}, headers=headers).json()['room_id']
+        assert shard_map.shard_of_room(room_id) == 1
+        assert client.post('/ac/on', json={'room_id': room_id}, headers=headers).json()['status'] == 0
+        assert client.get('/session', headers=headers).json()['room_id'] == room_id
+    # 没有配置共同的密钥时不能以分片方式启动
+    monkeypatch.delenv('ACM_SESSION_SECRET')
+    with pytest.raises(RuntimeError):
+        with TestClient(main.app):
+            pass
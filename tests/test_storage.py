@@ -0,0 +1,137 @@
+import random
+
+import pytest
+
+from acm import ACMDatabase, Manager, MemoryStorage, Settings, SQLiteStorage
+from acm.clock import ManualClock
+from acm.passwords import PasswordHasher
+from tests.conftest import START_MS
+from tests.helpers import check_in_guests
+
+
+def workload(storage, seed, steps=600):
+    """同一个随机操作序列，返回每一步的结果和最后的报表、汇总与校验结果"""
+    clock = ManualClock(START_MS)
+    manager = Manager(room_count=20, clock=clock, storage=storage, hasher=PasswordHasher(rounds=4))
+    rng = random.Random(seed)
+    users = [manager.create_user(f"guest{i}", f"phone{i}", 'x', 'x') for i in range(30)]
+    out = []
+    for step in range(steps):
+        clock.advance(seconds=rng.randint(1, 900))
+        user_id = rng.choice(users)
+        room_id = manager.get_room_id_by_user(user_id)
+        op = rng.random()
+        if op < 0.15:
+            out.append(('checkin', manager.checkin(user_id)))
+        elif op < 0.22:
+            result = manager.checkout(user_id)
+            out.append(('checkout', result if result == -1 else (result[0], [i.model_dump() for i in result[1]])))
+        elif room_id > 0 and op < 0.5:
+            out.append(('on', manager.turn_on_ac(room_id)[0]))
+        elif room_id > 0 and op < 0.65:
+            out.append(('off', manager.turn_off_ac(room_id)[0]))
+        elif room_id > 0 and op < 0.9:
+            settings = Settings(temperature=rng.randint(18, 28), fan_speed=rng.choice(['low', 'mid', 'high']),
+                                mode=rng.choice(['cool', 'heat']))
+            out.append(('set', manager.set_ac(room_id, settings)[0]))
+        else:
+            out.append(('cost', manager.get_cost(user_id)))
+        if step % 100 == 50:
+            # 回滚的事务不能在任何一种存储中留下痕迹
+            with pytest.raises(RuntimeError):
+                with manager.storage.transaction():
+                    manager.checkin(users[-1])
+                    manager.turn_off_many(list(range(1, 21)))
+                    raise RuntimeError
+    out.append(('report', manager.report_rows()))
+    out.append(('room report', manager.report_rows(room_id=3, after_id=5, limit=10)))
+    summaries = {group: [item.model_dump() for item in manager.generate_summary(group)]
+                 for group in ('room', 'day', 'week', 'setting')}
+    out.append(('verify', manager.verify_stay_totals(), manager.verify_rollups(), manager.verify_room_state()))
+    storage.close()
+    return out, summaries
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_memory_engine_matches_sqlite(seed, db_path):
+    expected, expected_summaries = workload(SQLiteStorage(ACMDatabase(db_path)), seed)
+    actual, actual_summaries = workload(MemoryStorage(), seed)
+    assert actual == expected
+    assert expected[-1] == ('verify', [], [], [])
+    # 汇总的费用只允许求和顺序带来的误差
+    for group, items in expected_summaries.items():
+        assert len(actual_summaries[group]) == len(items)
+        for a, b in zip(actual_summaries[group], items):
+            assert a == {**b, 'cost': pytest.approx(b['cost'])}
+
+
+def test_rollup_counts_each_record_once(manager, clock):
+    [(_, room_id)] = check_in_guests(manager, 1)
+    manager.turn_on_ac(room_id)
+    for temperature in (20, 21, 22):
+        clock.advance(seconds=60)
+        manager.set_ac(room_id, Settings(temperature=temperature, fan_speed='low', mode='cool'))
+    assert manager.refresh_rollups() == 3
+    # 高水位之前的记录不会再被计入
+    assert manager.refresh_rollups() == 0
+    clock.advance(seconds=60)
+    manager.turn_off_ac(room_id)
+    assert manager.refresh_rollups() == 1
+    assert sum(item.segments for item in manager.generate_summary('room')) == len(manager.report_rows()) == 4
+    assert manager.verify_rollups() == []
+
+
+def test_rolled_back_refresh_restores_high_water_mark(manager, clock):
+    [(_, room_id)] = check_in_guests(manager, 1)
+    manager.turn_on_ac(room_id)
+    clock.advance(seconds=60)
+    manager.turn_off_ac(room_id)
+    assert manager.refresh_rollups() == 1
+    with pytest.raises(RuntimeError):
+        with manager.storage.transaction():
+            manager.turn_on_ac(room_id)
+            clock.advance(seconds=60)
+            manager.turn_off_ac(room_id)
+            assert manager.storage.refresh_rollups() == 1
+            raise RuntimeError
+    # 回滚的记录和汇总一起撤销，之后写入的记录沿用同一个 id，只计入一次
+    assert manager.refresh_rollups() == 0
+    manager.turn_on_ac(room_id)
+    clock.advance(seconds=60)
+    manager.turn_off_ac(room_id)
+    assert manager.refresh_rollups() == 1
+    summary = manager.generate_summary('room')
+    assert sum(item.segments for item in summary) == len(manager.report_rows()) == 2
+    assert sum(item.cost for item in summary) == pytest.approx(sum(row[-1] for row in manager.report_rows()))
+    assert manager.verify_rollups() == []
+
+
+def test_memory_refresh_undoes_only_the_keys_it_touched(clock):
+    manager = Manager(clock=clock, storage=MemoryStorage(), hasher=PasswordHasher(rounds=4))
+    (_, first), (_, second) = check_in_guests(manager, 2)
+    for room_id in (first, second):
+        manager.turn_on_ac(room_id)
+        clock.advance(seconds=60)
+        manager.turn_off_ac(room_id)
+    manager.refresh_rollups()
+    storage = manager.storage
+    before = dict(storage._rollup)
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            # 修改第一个房间已有的合计，再加一个新的键
+            manager.turn_on_ac(first)
+            clock.advance(seconds=60)
+            manager.set_ac(first, Settings(temperature=20, fan_speed='Low', mode='Heat'))
+            clock.advance(seconds=60)
+            manager.turn_off_ac(first)
+            assert storage.refresh_rollups() == 2
+            assert len(storage._rollup) == len(before) + 1
+            # 没有新记录的房间的合计不复制
+            untouched = [key for key in before if key[0] == second]
+            assert untouched and all(storage._rollup[key] is before[key] for key in untouched)
+            raise RuntimeError
+    # 回滚后每个键的合计都是原来的列表，没有被原地修改
+    assert storage._rollup.keys() == before.keys()
+    assert all(storage._rollup[key] is totals for key, totals in before.items())
+    assert manager.refresh_rollups() == 0
+    assert manager.verify_rollups() == []